@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("activities", "0029_post_url_db_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emoji",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="fanout",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="hashtag",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="postattachment",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="postinteraction",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="previewcard",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
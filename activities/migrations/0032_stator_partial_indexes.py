@@ -0,0 +1,222 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:50
+
+from django.db import migrations, models
+
+from stator.operations import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("activities", "0031_stator_attempts"),
+        ("users", "0035_inboxmessage_created"),
+    ]
+
+    operations = [
+        RemoveIndexConcurrently(
+            model_name="emoji",
+            name="ix_emoji_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="fanout",
+            name="ix_fanout_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="hashtag",
+            name="ix_hashtag_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="post",
+            name="ix_post_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="postattachment",
+            name="ix_postattachm_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="postinteraction",
+            name="ix_postinterac_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="previewcard",
+            name="ix_previewcard_state_next",
+        ),
+        migrations.AlterField(
+            model_name="emoji",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="fanout",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="hashtag",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="post",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="postattachment",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="postinteraction",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="previewcard",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name="emoji",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_emoji_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="emoji",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["outdated"]), ("state_locked_until__isnull", True)
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_emoji_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="fanout",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_fanout_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="fanout",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["new"]), ("state_locked_until__isnull", True)
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_fanout_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="fanout",
+            index=models.Index(
+                condition=models.Q(("state__in", ["failed", "sent", "skipped"])),
+                fields=["state", "state_changed"],
+                name="ix_fanout_delete",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="hashtag",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_hashtag_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="hashtag",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["outdated"]), ("state_locked_until__isnull", True)
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_hashtag_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_post_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["deleted", "edited", "new"]),
+                    ("state_locked_until__isnull", True),
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_post_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("state__in", ["deleted_fanned_out"])),
+                fields=["state", "state_changed"],
+                name="ix_post_delete",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="postattachment",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_postattachm_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="postinteraction",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_postinterac_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="postinteraction",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["new", "undone"]),
+                    ("state_locked_until__isnull", True),
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_postinterac_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="postinteraction",
+            index=models.Index(
+                condition=models.Q(("state__in", ["undone_fanned_out"])),
+                fields=["state", "state_changed"],
+                name="ix_postinterac_delete",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="previewcard",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_previewcard_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="previewcard",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["needs_fetch"]), ("state_locked_until__isnull", True)
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_previewcard_ready",
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:30
+
+import django.db.models.expressions
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+from stator.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("activities", "0032_stator_partial_indexes"),
+        ("users", "0037_inboxmessage_shard_index"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="fanout",
+            index=models.Index(
+                models.F("state"),
+                django.db.models.expressions.CombinedExpression(
+                    models.Func(
+                        django.db.models.functions.comparison.Cast(
+                            "id", models.TextField()
+                        ),
+                        function="hashtext",
+                        output_field=models.IntegerField(),
+                    ),
+                    "&",
+                    models.Value(2147483647),
+                ),
+                condition=models.Q(
+                    ("state__in", ["new"]), ("state_locked_until__isnull", True)
+                ),
+                name="ix_fanout_shard",
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("activities", "0033_fanout_shard_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ActivityPayload",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("type", models.CharField(max_length=100)),
+                ("version", models.CharField(blank=True, max_length=50)),
+                ("body", models.BinaryField()),
+                ("digest", models.CharField(max_length=100)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "post",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="activity_payloads",
+                        to="activities.post",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["created"], name="activities__created_3e0872_idx"
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("post", "type", "version"),
+                        name="activity_payload_unique",
+                    )
+                ],
+            },
+        ),
+    ]
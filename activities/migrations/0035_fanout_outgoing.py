@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:31
+
+import django.db.models.expressions
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+from stator.operations import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("activities", "0034_activitypayload"),
+        ("users", "0038_domain_delivery_health"),
+    ]
+
+    operations = [
+        RemoveIndexConcurrently(
+            model_name="fanout",
+            name="ix_fanout_ready",
+        ),
+        RemoveIndexConcurrently(
+            model_name="fanout",
+            name="ix_fanout_shard",
+        ),
+        AddIndexConcurrently(
+            model_name="fanout",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["new", "outgoing"]),
+                    ("state_locked_until__isnull", True),
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_fanout_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="fanout",
+            index=models.Index(
+                models.F("state"),
+                django.db.models.expressions.CombinedExpression(
+                    models.Func(
+                        django.db.models.functions.comparison.Cast(
+                            "id", models.TextField()
+                        ),
+                        function="hashtext",
+                        output_field=models.IntegerField(),
+                    ),
+                    "&",
+                    models.Value(2147483647),
+                ),
+                condition=models.Q(
+                    ("state__in", ["new", "outgoing"]),
+                    ("state_locked_until__isnull", True),
+                ),
+                name="ix_fanout_shard",
+            ),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from .activity_payload import ActivityPayload  # noqa
 from .conversation import Conversation, ConversationMembership  # noqa
 from .emoji import Emoji, EmojiStates  # noqa
 from .fan_out import FanOut, FanOutStates  # noqa
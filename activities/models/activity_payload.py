@@ -0,0 +1,133 @@
+import datetime
+import json
+
+from django.db import models
+from django.utils import timezone
+
+from core.ld import canonicalise
+from core.signatures import HttpSignature
+
+
+class ActivityPayload(models.Model):
+    """
+    The serialized activity for one version of a post being fanned out, so
+    that it's canonicalised once rather than once per remote inbox.
+
+    These are deleted in batches by FanOut's deletion pass once they expire.
+    """
+
+    # Kept a little longer than fan-outs keep retrying for
+    EXPIRY = datetime.timedelta(days=4)
+    DELETE_BATCH_SIZE = 500
+
+    post = models.ForeignKey(
+        "activities.Post",
+        on_delete=models.CASCADE,
+        related_name="activity_payloads",
+    )
+
+    # The FanOut type this is the activity for
+    type = models.CharField(max_length=100)
+
+    # When the post was last edited (empty if never), so edits get a new
+    # payload rather than sending an old one
+    version = models.CharField(max_length=50, blank=True)
+
+    # The exact JSON to send, and its Digest header value
+    body = models.BinaryField()
+    digest = models.CharField(max_length=100)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["created"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "type", "version"],
+                name="activity_payload_unique",
+            ),
+        ]
+
+    @classmethod
+    def delete_expired(cls) -> int:
+        """
+        Deletes a batch of payloads that are past their expiry, returning
+        how many went.
+        """
+        select_query = cls.objects.filter(
+            created__lt=timezone.now() - cls.EXPIRY
+        ).values("pk")[: cls.DELETE_BATCH_SIZE]
+        return cls.objects.filter(pk__in=select_query).delete()[0]
+
+    @staticmethod
+    def post_version(post) -> str:
+        return post.edited.isoformat() if post.edited else ""
+
+    @classmethod
+    def build_activity(cls, post, type_: str) -> dict | None:
+        """
+        Returns the canonicalised activity for the post and FanOut type.
+        """
+        from activities.models import FanOut
+
+        match type_:
+            case FanOut.Types.post:
+                return canonicalise(post.to_create_ap())
+            case FanOut.Types.post_edited:
+                return canonicalise(post.to_update_ap())
+            case FanOut.Types.post_deleted:
+                return canonicalise(post.to_delete_ap())
+        return None
+
+    @classmethod
+    def for_post(cls, post, type_: str) -> "ActivityPayload | None":
+        """
+        Returns the payload for the current version of the post, making it
+        if it doesn't exist yet.
+        """
+        version = cls.post_version(post)
+        payload = cls.objects.filter(post=post, type=type_, version=version).first()
+        if payload:
+            return payload
+        activity = cls.build_activity(post, type_)
+        if activity is None:
+            return None
+        body = json.dumps(activity).encode("utf8")
+        payload, _ = cls.objects.get_or_create(
+            post=post,
+            type=type_,
+            version=version,
+            defaults={
+                "body": body,
+                "digest": HttpSignature.calculate_digest(body),
+            },
+        )
+        return payload
+
+    @classmethod
+    def for_fan_outs(cls, fan_outs) -> dict[tuple[int, str, str], "ActivityPayload"]:
+        """
+        Returns the payloads for the current versions of the fan-outs' posts,
+        keyed by (post ID, type, version), in one query.
+        """
+        keys = {
+            (
+                fan_out.subject_post_id,
+                fan_out.type,
+                cls.post_version(fan_out.subject_post),
+            )
+            for fan_out in fan_outs
+            if fan_out.subject_post_id
+        }
+        if not keys:
+            return {}
+        payloads = cls.objects.filter(post_id__in={post_id for post_id, _, _ in keys})
+        return {
+            (payload.post_id, payload.type, payload.version): payload
+            for payload in payloads
+            if (payload.post_id, payload.type, payload.version) in keys
+        }
+
+    @property
+    def activity(self) -> dict:
+        return json.loads(bytes(self.body))
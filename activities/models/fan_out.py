@@ -1,21 +1,57 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import httpx
+from django.conf import settings
 from django.db import models
 
+from activities.models.activity_payload import ActivityPayload
 from activities.models.timeline_event import TimelineEvent
+from core import http
 from core.ld import canonicalise
-from stator.models import State, StateField, StateGraph, StatorModel
-from users.models import Block, FollowStates, Identity
+from core.signatures import RequestRefused
+from stator import metrics, timeouts
+from stator.exceptions import TryAgainLater
+from stator.models import (
+    State,
+    StateField,
+    StateGraph,
+    StatorModel,
+    database_sync_to_async,
+)
+from users.models import Block, Domain, FollowStates, Identity
+
+logger = logging.getLogger(__name__)
 
 
 class FanOutStates(StateGraph):
-    new = State(try_interval=600)
+    # Fan-outs to local identities go ahead of background work (and are
+    # dispatched straight away), as people are waiting to see these in their
+    # timelines
+    new = State(try_interval=600, priority=4, batch_size=25, dispatch=True)
+    # Deliveries to other servers wait separately (and only at background
+    # priority), so a big post's backlog of them can't hold up local
+    # timelines; they back off from unreachable servers rather than
+    # retrying every ten minutes
+    outgoing = State(
+        try_interval=600,
+        batch_size=25,
+        backoff_multiplier=2,
+        backoff_cap=60 * 60 * 6,
+        backoff_jitter=0.2,
+    )
     sent = State(delete_after=86400)
     skipped = State(delete_after=86400)
     failed = State(delete_after=86400)
 
+    new.transitions_to(outgoing)
     new.transitions_to(sent)
     new.transitions_to(skipped)
     new.times_out_to(failed, seconds=86400 * 3)
+    outgoing.transitions_to(sent)
+    outgoing.times_out_to(failed, seconds=86400 * 3)
 
     @classmethod
     def _handle_group_actor_auto_boost(cls, identity: "Identity", post):
@@ -65,6 +101,525 @@ class FanOutStates(StateGraph):
             boosts, PostInteractionStates.undone
         )
 
+    @classmethod
+    def fetch_batch(cls, pks: list) -> dict[int, "FanOut"]:
+        """
+        Fetches fan-outs and everything they refer to in a single query, along
+        with the prepared activities for any posts.
+        """
+        fan_outs = FanOut.objects.select_related(
+            "identity",
+            "identity__domain",
+            "subject_post",
+            "subject_post__author",
+            "subject_post_interaction",
+            "subject_post_interaction__identity",
+            "subject_identity",
+            "subject_hashtag",
+        ).in_bulk(pks)
+        payloads = ActivityPayload.for_fan_outs(fan_outs.values())
+        for fan_out in fan_outs.values():
+            fan_out.activity_payloads = payloads
+        return fan_outs
+
+    @classmethod
+    def fetch_each(cls, instances: list["FanOut"]) -> list["FanOut"]:
+        """
+        Returns fetch_batch()'s copies of the instances, in the same order.
+        """
+        fan_outs = cls.fetch_batch([instance.pk for instance in instances])
+        return [fan_outs.get(instance.pk, instance) for instance in instances]
+
+    @classmethod
+    def copy_retry_delays(cls, instances: list["FanOut"], fetched: list["FanOut"]):
+        """
+        The runner saves the outcomes on the instances it passed in, so they
+        need to know when any of their fetched copies asked to be tried again.
+        """
+        for instance, fetched_instance in zip(instances, fetched):
+            if hasattr(fetched_instance, "state_retry_delay"):
+                instance.state_retry_delay = fetched_instance.state_retry_delay
+
+    @classmethod
+    def handle_new_batch(cls, instances: list["FanOut"]):
+        """
+        Fans out a batch of local fan-outs, fetching them and everything they
+        refer to in a single query first. Remote ones that ended up here are
+        moved on to be delivered.
+        """
+        fetched = cls.fetch_each(instances)
+        try:
+            results = {
+                instance.pk: cls.outgoing
+                for instance in fetched
+                if not instance.identity.local
+            }
+            results.update(
+                cls.handle_each(
+                    cls.handle_new,
+                    [instance for instance in fetched if instance.pk not in results],
+                )
+            )
+            return results
+        finally:
+            cls.copy_retry_delays(instances, fetched)
+
+    @classmethod
+    def handle_outgoing_batch(cls, instances: list["FanOut"]):
+        """
+        Sends a batch of remote fan-outs, fetching them and everything they
+        refer to in a single query first, together with any others waiting
+        for the same inboxes.
+        """
+        fetched = cls.fetch_each(instances)
+        try:
+            if settings.SETUP.FANOUT_INBOX_BATCH <= 0:
+                return cls.handle_each(cls.handle_new, fetched)
+            results, remote = cls.handle_unsendable(fetched)
+            results.update(cls.deliver_by_inbox(remote))
+            return results
+        finally:
+            cls.copy_retry_delays(instances, fetched)
+
+    @classmethod
+    async def ahandle_outgoing_batch(cls, instances: list["FanOut"]):
+        """
+        Like handle_outgoing_batch, for the asyncio runner: the sending is
+        all done on the event loop, and everything else in its thread pool.
+        """
+        fetched = await database_sync_to_async(cls.fetch_each)(instances)
+        try:
+            if settings.SETUP.FANOUT_INBOX_BATCH <= 0:
+                return await database_sync_to_async(cls.handle_each)(
+                    cls.handle_new, fetched
+                )
+            results, remote = await database_sync_to_async(cls.handle_unsendable)(
+                fetched
+            )
+            results.update(await cls.adeliver_by_inbox(remote))
+            return results
+        finally:
+            cls.copy_retry_delays(instances, fetched)
+
+    @classmethod
+    def handle_unsendable(
+        cls, instances: list["FanOut"]
+    ) -> tuple[dict[int, State | None], list["FanOut"]]:
+        """
+        Handles the fan-outs with no inbox to send to yet one by one, and
+        returns their outcomes along with the rest, to be delivered.
+        """
+        remote = [instance for instance in instances if instance.identity.inbox_uri]
+        remote_pks = {instance.pk for instance in remote}
+        results = cls.handle_each(
+            cls.handle_new,
+            [instance for instance in instances if instance.pk not in remote_pks],
+        )
+        return results, remote
+
+    @classmethod
+    def deliver_by_inbox(cls, instances: list["FanOut"]) -> dict[int, State | None]:
+        """
+        Groups remote fan-outs by the inbox they're going to, tops the groups
+        up with others already waiting for those inboxes (up to
+        FANOUT_INBOX_BATCH fan-outs in all), and sends them all.
+
+        The extra fan-outs are claimed with the same lock as the batch, and
+        their outcomes saved here (as the runner only knows about the batch).
+        """
+        started = time.monotonic()
+        deadline = timeouts.deadlines.current()
+        sending, extras = cls.claim_by_inbox(instances, deadline)
+        results: dict[int, State | None] = {}
+        try:
+            cls.deliver_each(sending, results)
+        except Exception as e:
+            # Keep the outcomes we already have, so what's been sent isn't
+            # sent again when the rest are retried
+            logger.exception(e)
+            metrics.recorder.fail(
+                FanOut._meta.label_lower, cls.outgoing, number=len(sending)
+            )
+        finally:
+            # If we ran so long we were abandoned, someone else may have the
+            # extras by now
+            if not (deadline and deadline.abandoned):
+                cls.complete_extras(extras, results, started)
+        return {instance.pk: results.get(instance.pk) for instance in instances}
+
+    @classmethod
+    async def adeliver_by_inbox(
+        cls, instances: list["FanOut"]
+    ) -> dict[int, State | None]:
+        """
+        Like deliver_by_inbox, sending on the event loop.
+        """
+        started = time.monotonic()
+        sending, extras = await database_sync_to_async(cls.claim_by_inbox)(
+            instances, None
+        )
+        results: dict[int, State | None] = {}
+        try:
+            await cls.adeliver_each(sending, results)
+        except Exception as e:
+            logger.exception(e)
+            metrics.recorder.fail(
+                FanOut._meta.label_lower, cls.outgoing, number=len(sending)
+            )
+        finally:
+            await database_sync_to_async(cls.complete_extras)(extras, results, started)
+        return {instance.pk: results.get(instance.pk) for instance in instances}
+
+    @classmethod
+    def claim_by_inbox(
+        cls, instances: list["FanOut"], deadline: timeouts.Deadline | None
+    ) -> tuple[list["FanOut"], list["FanOut"]]:
+        """
+        Works out what deliver_by_inbox should send, claiming the extra
+        fan-outs to top the groups up with. Returns (to send, extras).
+        """
+        groups: dict[str, list[FanOut]] = {}
+        for instance in instances:
+            groups.setdefault(instance.inbox_uri, []).append(instance)
+        sending: list[FanOut] = []
+        extras: list[FanOut] = []
+        # The whole task has to fit inside one handler deadline and lease,
+        # so the top-ups share one allowance rather than each group getting
+        # its own
+        allowance = settings.SETUP.FANOUT_INBOX_BATCH - len(instances)
+        for inbox_uri, group in groups.items():
+            # Hold back everything to a server that's been failing, apart
+            # from a single probe once it's due one, until it's worth trying
+            # again (which doesn't count as a failed attempt)
+            domain = group[0].identity.domain
+            if domain and domain.delivery_circuit != "closed":
+                if domain.delivery_allowed():
+                    sending.append(group.pop(0))
+                for instance in group:
+                    instance.state_retry_delay = domain.delivery_retry_delay()
+                continue
+            claimed = FanOut.transition_get_for_inbox(inbox_uri, group[0], allowance)
+            if claimed:
+                allowance -= len(claimed)
+                if deadline:
+                    deadline.add(instance.pk for instance in claimed)
+                fan_outs = cls.fetch_batch([instance.pk for instance in claimed])
+                claimed = [fan_outs.get(instance.pk, instance) for instance in claimed]
+                group.extend(claimed)
+                extras.extend(claimed)
+            sending.extend(group)
+        return sending, extras
+
+    @classmethod
+    def complete_extras(
+        cls,
+        extras: list["FanOut"],
+        results: dict[int, State | None],
+        started: float,
+    ):
+        """
+        Saves the outcomes of the extra fan-outs deliver_by_inbox claimed.
+        """
+        if extras:
+            FanOut.transition_complete_batch(cls.outgoing, extras, results)
+            metrics.recorder.observe(
+                FanOut._meta.label_lower,
+                cls.outgoing,
+                time.monotonic() - started,
+                handled=len(extras),
+            )
+
+    @classmethod
+    def prepare_each(
+        cls, instances: list["FanOut"], results: dict[int, State | None]
+    ) -> dict[int, tuple[Identity, dict | bytes, str | None]]:
+        """
+        Builds the activities to send for remote fan-outs, adding the
+        outcome for any that have nothing to send to `results`.
+        """
+        activities = {}
+
+        def prepare(instance: "FanOut"):
+            activity = cls.remote_activity(instance)
+            if activity is None:
+                return cls.sent
+            activities[instance.pk] = activity
+
+        results.update(cls.handle_each(prepare, instances))
+        return activities
+
+    @classmethod
+    def deliver_each(cls, instances: list["FanOut"], results: dict[int, State | None]):
+        """
+        Sends remote fan-outs, FANOUT_DELIVERY_CONCURRENCY at a time, adding
+        each one's outcome to `results` as soon as it's known. The
+        activities are all built first, as only the sending happens in other
+        threads (which have no database connection to use).
+        """
+        deadline = timeouts.deadlines.current()
+        activities = cls.prepare_each(instances, results)
+        sending = [instance for instance in instances if instance.pk in activities]
+        if not sending:
+            return
+
+        def deliver(instance: "FanOut"):
+            # Anything we can't get to in time is left for the next run
+            if deadline and deadline.remaining() <= 0:
+                raise TryAgainLater(0)
+            return cls.deliver(instance, *activities[instance.pk])
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=min(
+                    settings.SETUP.FANOUT_DELIVERY_CONCURRENCY, len(sending)
+                )
+            ) as executor:
+                futures = [
+                    executor.submit(cls.handle_each, deliver, [instance])
+                    for instance in sending
+                ]
+                for future in as_completed(futures):
+                    results.update(future.result())
+        finally:
+            cls.record_health(sending)
+
+    @classmethod
+    async def adeliver_each(
+        cls, instances: list["FanOut"], results: dict[int, State | None]
+    ):
+        """
+        Like deliver_each, sending on the event loop.
+        """
+        activities = await database_sync_to_async(cls.prepare_each)(instances, results)
+        sending = [instance for instance in instances if instance.pk in activities]
+        if not sending:
+            return
+
+        async def deliver(instance: "FanOut"):
+            return await cls.adeliver(instance, *activities[instance.pk])
+
+        try:
+            results.update(
+                await cls.ahandle_each(
+                    deliver, sending, settings.SETUP.FANOUT_DELIVERY_CONCURRENCY
+                )
+            )
+        finally:
+            await database_sync_to_async(cls.record_health)(sending)
+
+    @classmethod
+    def record_health(cls, instances: list["FanOut"]):
+        """
+        Records how deliveries went for each domain they went to: it's doing
+        fine if any of them got a response.
+        """
+        domains: dict[str, Domain] = {}
+        outcomes: dict[str, list[tuple[bool, float | None]]] = {}
+        for instance in instances:
+            domain = instance.identity.domain
+            outcome = getattr(instance, "delivery_outcome", None)
+            if domain is None or outcome is None:
+                continue
+            domains[domain.pk] = domain
+            outcomes.setdefault(domain.pk, []).append(outcome)
+        for pk, domain_outcomes in outcomes.items():
+            latencies = [latency for ok, latency in domain_outcomes if ok]
+            if latencies:
+                domains[pk].record_delivery(True, sum(latencies) / len(latencies))
+            else:
+                domains[pk].record_delivery(False)
+
+    @classmethod
+    def post_activity(cls, instance: "FanOut") -> tuple[dict | bytes, str | None]:
+        """
+        Returns the activity to send for a post fan-out, and its digest: the
+        payload serialized when the post was fanned out if it is still
+        current, or otherwise a freshly built one.
+        """
+        payloads = getattr(instance, "activity_payloads", None)
+        if payloads is None:
+            payloads = ActivityPayload.for_fan_outs([instance])
+        post = instance.subject_post
+        payload = payloads.get(
+            (post.pk, instance.type, ActivityPayload.post_version(post))
+        )
+        if payload:
+            return bytes(payload.body), payload.digest
+        return ActivityPayload.build_activity(post, instance.type), None
+
+    @classmethod
+    def remote_activity(
+        cls, instance: "FanOut"
+    ) -> tuple[Identity, dict | bytes, str | None] | None:
+        """
+        Returns the identity to sign as, the activity and its digest (if it's
+        already serialized) to send for a remote fan-out, or None if there's
+        nothing to send.
+        """
+        match instance.type:
+            # Posts being created, updated or deleted
+            case (
+                FanOut.Types.post | FanOut.Types.post_edited | FanOut.Types.post_deleted
+            ):
+                body, digest = cls.post_activity(instance)
+                return instance.subject_post.author, body, digest
+
+            # Boosts/likes/votes/pins
+            case FanOut.Types.interaction:
+                interaction = instance.subject_post_interaction
+                if interaction.type == interaction.Types.vote:
+                    body = interaction.to_create_ap()
+                elif interaction.type == interaction.Types.pin:
+                    body = interaction.to_add_ap()
+                else:
+                    body = interaction.to_ap()
+                return interaction.identity, canonicalise(body), None
+
+            # Undoing boosts/likes/pins
+            case FanOut.Types.undo_interaction:
+                interaction = instance.subject_post_interaction
+                if interaction.type == interaction.Types.pin:
+                    body = interaction.to_remove_ap()
+                else:
+                    body = interaction.to_undo_ap()
+                return interaction.identity, canonicalise(body), None
+
+            case FanOut.Types.identity_edited:
+                identity = instance.subject_identity
+                return identity, canonicalise(identity.to_update_ap()), None
+
+            case FanOut.Types.identity_deleted:
+                identity = instance.subject_identity
+                return identity, canonicalise(identity.to_delete_ap()), None
+
+            case FanOut.Types.identity_moved:
+                identity = instance.subject_identity
+                if identity.has_moved() and identity.aliases:
+                    return identity, canonicalise(identity.to_move_ap()), None
+                return None
+
+            case FanOut.Types.tag_featured:
+                identity = instance.subject_identity
+                return (
+                    identity,
+                    canonicalise(instance.subject_hashtag.to_add_ap(identity)),
+                    None,
+                )
+
+            case FanOut.Types.tag_unfeatured:
+                identity = instance.subject_identity
+                return (
+                    identity,
+                    canonicalise(instance.subject_hashtag.to_remove_ap(identity)),
+                    None,
+                )
+
+        raise ValueError(f"Cannot fan out with type {instance.type} local=False")
+
+    @classmethod
+    def deliver(
+        cls,
+        instance: "FanOut",
+        signer: Identity,
+        body: dict | bytes,
+        digest: str | None = None,
+    ) -> State | None:
+        """
+        Signs and sends an activity to the fan-out's inbox. This doesn't
+        touch the database, so it can run in other threads; how it went is
+        left in delivery_outcome for record_health() to save. Raises
+        TryAgainLater if the server asked us to slow down (with a 429, or a
+        503 that says when to come back).
+        """
+        started = time.monotonic()
+        try:
+            response = signer.signed_request(
+                method="post",
+                uri=instance.inbox_uri,
+                body=body,
+                digest=digest,
+            )
+        except (httpx.RequestError, ValueError) as error:
+            return cls.delivery_failed(instance, error, started)
+        return cls.delivered(instance, response, started)
+
+    @classmethod
+    async def adeliver(
+        cls,
+        instance: "FanOut",
+        signer: Identity,
+        body: dict | bytes,
+        digest: str | None = None,
+    ) -> State | None:
+        """
+        Like deliver, sending on the event loop.
+        """
+        started = time.monotonic()
+        try:
+            response = await signer.asigned_request(
+                method="post",
+                uri=instance.inbox_uri,
+                body=body,
+                digest=digest,
+            )
+        except (httpx.RequestError, ValueError) as error:
+            return cls.delivery_failed(instance, error, started)
+        return cls.delivered(instance, response, started)
+
+    @classmethod
+    def delivered(
+        cls, instance: "FanOut", response: httpx.Response, started: float
+    ) -> State | None:
+        """
+        Works out what a delivery's response means for the fan-out.
+        """
+        retry_after = http.parse_retry_after(response.headers.get("Retry-After"))
+        if response.status_code == 503 and retry_after:
+            raise TryAgainLater(retry_after)
+        instance.delivery_outcome = (
+            response.status_code < 500,
+            time.monotonic() - started,
+        )
+        return cls.sent
+
+    @classmethod
+    def delivery_failed(
+        cls,
+        instance: "FanOut",
+        error: httpx.RequestError | ValueError,
+        started: float,
+    ) -> State | None:
+        """
+        Works out what a delivery's error means for the fan-out, re-raising
+        it if it should count as a failed attempt.
+        """
+        if isinstance(error, http.RateLimited):
+            # Our own limit for the server (or what it told us before) wants
+            # us to slow down, which says nothing about its health; come
+            # back when it says to
+            raise TryAgainLater(error.retry_after)
+        if isinstance(error, httpx.PoolTimeout):
+            # Too many requests to it already in flight from here, which
+            # isn't its fault (or a failed attempt); try again shortly
+            raise TryAgainLater(random.uniform(5, 15))
+        if isinstance(error, httpx.RequestError):
+            instance.delivery_outcome = (False, None)
+            return None
+        if isinstance(error, RequestRefused) and error.response.status_code == 429:
+            # The server itself wants us to slow down
+            raise TryAgainLater(
+                http.parse_retry_after(error.response.headers.get("Retry-After"))
+            )
+        instance.delivery_outcome = (True, time.monotonic() - started)
+        # Deletes can get a 4xx if the remote end has already processed
+        # the deletion some other way; don't retry those
+        if instance.type not in [
+            FanOut.Types.post_deleted,
+            FanOut.Types.identity_deleted,
+        ]:
+            raise error
+        return cls.sent
+
     @classmethod
     def handle_new(cls, instance: "FanOut"):
         """
@@ -76,6 +631,20 @@ class FanOutStates(StateGraph):
         if not (instance.identity.local or instance.identity.inbox_uri):
             return
 
+        # Remote identities get the activity sent to their inbox, unless
+        # their server has been failing
+        if not instance.identity.local:
+            domain = instance.identity.domain
+            if domain and not domain.delivery_allowed():
+                raise TryAgainLater(domain.delivery_retry_delay())
+            activity = cls.remote_activity(instance)
+            if activity is None:
+                return cls.sent
+            try:
+                return cls.deliver(instance, *activity)
+            finally:
+                cls.record_health([instance])
+
         match (instance.type, instance.identity.local):
             # Handle creating/updating local posts
             case ((FanOut.Types.post | FanOut.Types.post_edited), True):
@@ -140,38 +709,6 @@ class FanOutStates(StateGraph):
                 if instance.identity.is_group:
                     cls._handle_group_actor_auto_boost(instance.identity, post)
 
-            # Handle sending remote posts create
-            case (FanOut.Types.post, False):
-                post = instance.subject_post
-                # Sign it and send it
-                try:
-                    post.author.signed_request(
-                        method="post",
-                        uri=(
-                            instance.identity.shared_inbox_uri
-                            or instance.identity.inbox_uri
-                        ),
-                        body=canonicalise(post.to_create_ap()),
-                    )
-                except httpx.RequestError:
-                    return
-
-            # Handle sending remote posts update
-            case (FanOut.Types.post_edited, False):
-                post = instance.subject_post
-                # Sign it and send it
-                try:
-                    post.author.signed_request(
-                        method="post",
-                        uri=(
-                            instance.identity.shared_inbox_uri
-                            or instance.identity.inbox_uri
-                        ),
-                        body=canonicalise(post.to_update_ap()),
-                    )
-                except httpx.RequestError:
-                    return
-
             # Handle deleting local posts
             case (FanOut.Types.post_deleted, True):
                 if instance.identity.is_group:
@@ -179,24 +716,6 @@ class FanOutStates(StateGraph):
                         instance.identity, instance.subject_post
                     )
 
-            # Handle sending remote post deletes
-            case (FanOut.Types.post_deleted, False):
-                post = instance.subject_post
-                # Send it to the remote inbox
-                try:
-                    post.author.signed_request(
-                        method="post",
-                        uri=(
-                            instance.identity.shared_inbox_uri
-                            or instance.identity.inbox_uri
-                        ),
-                        body=canonicalise(post.to_delete_ap()),
-                    )
-                except ValueError:
-                    pass  # ignore 401 when identity deletion is processed by remote earlier
-                except httpx.RequestError:
-                    return
-
             # Handle local boosts/likes
             case (FanOut.Types.interaction, True):
                 interaction = instance.subject_post_interaction
@@ -237,28 +756,6 @@ class FanOutStates(StateGraph):
                         instance.identity, interaction.post
                     )
 
-            # Handle sending remote boosts/likes/votes/pins
-            case (FanOut.Types.interaction, False):
-                interaction = instance.subject_post_interaction
-                # Send it to the remote inbox
-                try:
-                    if interaction.type == interaction.Types.vote:
-                        body = interaction.to_create_ap()
-                    elif interaction.type == interaction.Types.pin:
-                        body = interaction.to_add_ap()
-                    else:
-                        body = interaction.to_ap()
-                    interaction.identity.signed_request(
-                        method="post",
-                        uri=(
-                            instance.identity.shared_inbox_uri
-                            or instance.identity.inbox_uri
-                        ),
-                        body=canonicalise(body),
-                    )
-                except httpx.RequestError:
-                    return
-
             # Handle undoing local boosts/likes
             case (FanOut.Types.undo_interaction, True):  # noqa:F841
                 interaction = instance.subject_post_interaction
@@ -287,58 +784,6 @@ class FanOutStates(StateGraph):
                         instance.identity, interaction.post
                     )
 
-            # Handle sending remote undoing boosts/likes/pins
-            case (FanOut.Types.undo_interaction, False):  # noqa:F841
-                interaction = instance.subject_post_interaction
-                # Send an undo to the remote inbox
-                try:
-                    if interaction.type == interaction.Types.pin:
-                        body = interaction.to_remove_ap()
-                    else:
-                        body = interaction.to_undo_ap()
-                    interaction.identity.signed_request(
-                        method="post",
-                        uri=(
-                            instance.identity.shared_inbox_uri
-                            or instance.identity.inbox_uri
-                        ),
-                        body=canonicalise(body),
-                    )
-                except httpx.RequestError:
-                    return
-
-            # Handle sending identity edited to remote
-            case (FanOut.Types.identity_edited, False):
-                identity = instance.subject_identity
-                try:
-                    identity.signed_request(
-                        method="post",
-                        uri=(
-                            instance.identity.shared_inbox_uri
-                            or instance.identity.inbox_uri
-                        ),
-                        body=canonicalise(instance.subject_identity.to_update_ap()),
-                    )
-                except httpx.RequestError:
-                    return
-
-            # Handle sending identity deleted to remote
-            case (FanOut.Types.identity_deleted, False):
-                identity = instance.subject_identity
-                try:
-                    identity.signed_request(
-                        method="post",
-                        uri=(
-                            instance.identity.shared_inbox_uri
-                            or instance.identity.inbox_uri
-                        ),
-                        body=canonicalise(instance.subject_identity.to_delete_ap()),
-                    )
-                except httpx.RequestError:
-                    return
-                except ValueError:
-                    pass  # do not retry if 4xx
-
             # Handle move for local follower
             case (FanOut.Types.identity_moved, True):
                 from users.services import IdentityService
@@ -350,22 +795,6 @@ class FanOutStates(StateGraph):
                     follower.unfollow(identity)
                     follower.follow(new_identity)
 
-            # Handle sending identity moved to remote
-            case (FanOut.Types.identity_moved, False):
-                identity = instance.subject_identity
-                if identity.has_moved() and identity.aliases:
-                    try:
-                        identity.signed_request(
-                            method="post",
-                            uri=(
-                                instance.identity.shared_inbox_uri
-                                or instance.identity.inbox_uri
-                            ),
-                            body=canonicalise(identity.to_move_ap()),
-                        )
-                    except httpx.RequestError:
-                        return
-
             # Sending identity edited/deleted to local is a no-op
             case (FanOut.Types.identity_edited, True):
                 pass
@@ -382,39 +811,9 @@ class FanOutStates(StateGraph):
             case (FanOut.Types.tag_featured, True):
                 pass
 
-            case (FanOut.Types.tag_featured, False):
-                identity = instance.subject_identity
-                try:
-                    identity.signed_request(
-                        method="post",
-                        uri=(
-                            instance.identity.shared_inbox_uri
-                            or instance.identity.inbox_uri
-                        ),
-                        body=canonicalise(instance.subject_hashtag.to_add_ap(identity)),
-                    )
-                except httpx.RequestError:
-                    return
-
             case (FanOut.Types.tag_unfeatured, True):
                 pass
 
-            case (FanOut.Types.tag_unfeatured, False):
-                identity = instance.subject_identity
-                try:
-                    identity.signed_request(
-                        method="post",
-                        uri=(
-                            instance.identity.shared_inbox_uri
-                            or instance.identity.inbox_uri
-                        ),
-                        body=canonicalise(
-                            instance.subject_hashtag.to_remove_ap(identity)
-                        ),
-                    )
-                except httpx.RequestError:
-                    return
-
             case _:
                 raise ValueError(
                     f"Cannot fan out with type {instance.type} local={instance.identity.local}"
@@ -428,6 +827,14 @@ class FanOut(StatorModel):
     An activity that needs to get to an inbox somewhere.
     """
 
+    PARTITION_FIELD = "created"
+
+    # This queue can back up into the millions; don't count all of it
+    QUEUE_COUNT = "capped"
+
+    # Big enough that it's worth splitting between runners with --shard
+    SHARDED = True
+
     class Types(models.TextChoices):
         post = "post"
         post_edited = "post_edited"
@@ -488,3 +895,71 @@ class FanOut(StatorModel):
 
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        # Remote fan-outs go straight to their own queue (bulk creators have
+        # to pick the state themselves, with initial_state())
+        if self._state.adding and self.state == FanOutStates.new:
+            self.state = self.initial_state(self.identity.local)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def initial_state(cls, local: bool) -> State:
+        """
+        The state a fan-out to a local or remote identity starts in.
+        """
+        return FanOutStates.new if local else FanOutStates.outgoing
+
+    @property
+    def inbox_uri(self) -> str | None:
+        """
+        The inbox this is delivered to (the identity's shared one, if any)
+        """
+        return self.identity.shared_inbox_uri or self.identity.inbox_uri
+
+    @classmethod
+    def transition_delete_due(cls) -> int | None:
+        """
+        Deletes finished fan-outs, and the stored activity payloads that
+        fan-outs no longer need along with them.
+        """
+        deleted = super().transition_delete_due()
+        return (deleted or 0) + ActivityPayload.delete_expired()
+
+    @classmethod
+    def transition_get_for_inbox(
+        cls, inbox_uri: str, like: "FanOut", number: int
+    ) -> list["FanOut"]:
+        """
+        Claims up to `number` more fan-outs waiting for the same remote inbox as
+        `like`, locking them the same way it is locked.
+        """
+        if number <= 0 or like.state_locked_until is None:
+            return []
+        candidates = (
+            cls.transition_ready_queryset()
+            .filter(
+                state=FanOutStates.outgoing,
+                identity__local=False,
+                identity__domain_id=like.identity.domain_id,
+            )
+            .filter(
+                models.Q(identity__shared_inbox_uri=inbox_uri)
+                | (
+                    models.Q(identity__inbox_uri=inbox_uri)
+                    & (
+                        models.Q(identity__shared_inbox_uri__isnull=True)
+                        | models.Q(identity__shared_inbox_uri="")
+                    )
+                )
+            )
+            .order_by()
+            .values_list("pk", flat=True)[:number]
+        )
+        return cls.transition_get_with_lock(
+            number,
+            like.state_locked_until,
+            like.state_locked_by,
+            states=[FanOutStates.outgoing],
+            pks=list(candidates),
+        )
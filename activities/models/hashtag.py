@@ -12,7 +12,7 @@ from stator.models import State, StateField, StateGraph, StatorModel
 
 
 class HashtagStates(StateGraph):
-    outdated = State(try_interval=300, force_initial=True)
+    outdated = State(try_interval=300, force_initial=True, batch_size=20)
     updated = State(externally_progressed=True)
 
     outdated.transitions_to(updated)
@@ -23,49 +23,73 @@ class HashtagStates(StateGraph):
         """
         Computes the stats and other things for a Hashtag
         """
-        from .post import Post
+        return cls.handle_outdated_batch([instance])[instance.pk]
 
-        posts_query = Post.objects.local_public().tagged_with(instance)
-        total = posts_query.count()
+    @classmethod
+    def handle_outdated_batch(cls, instances: list["Hashtag"]):
+        """
+        Computes the stats for several Hashtags at once, using one query for
+        the counts and one for the history rather than a dozen per hashtag.
+        """
+        from .post import Post
 
         today = timezone.now().date()
-        total_today = posts_query.filter(created__date=today).count()
-        total_month = posts_query.filter(
-            created__year=today.year,
-            created__month=today.month,
-        ).count()
-        total_year = posts_query.filter(
-            created__year=today.year,
-        ).count()
-
-        history = []
-        tagged_posts = Post.objects.not_hidden().tagged_with(instance)
-        for i in range(8):
-            # Mastodon doesn't include today in history (let's do it anyway)
-            day = today - timedelta(days=i)
-            data = tagged_posts.filter(published__date=day).aggregate(
-                total=models.Count("id"),
-                num_authors=models.Count("author", distinct=True),
+        days = [today - timedelta(days=i) for i in range(8)]
+        any_tag_q = models.Q()
+        for instance in instances:
+            any_tag_q |= instance.posts_q
+
+        counts = {}
+        history_counts = {}
+        for i, instance in enumerate(instances):
+            tag_q = instance.posts_q
+            counts[f"t{i}_total"] = models.Count("id", filter=tag_q)
+            counts[f"t{i}_today"] = models.Count(
+                "id", filter=tag_q & models.Q(created__date=today)
             )
-            history.append(
-                {
-                    "day": str(int(time.mktime(day.timetuple()))),
-                    "uses": str(data["total"]),
-                    "accounts": str(data["num_authors"]),
-                }
+            counts[f"t{i}_month"] = models.Count(
+                "id",
+                filter=tag_q
+                & models.Q(created__year=today.year, created__month=today.month),
             )
+            counts[f"t{i}_year"] = models.Count(
+                "id", filter=tag_q & models.Q(created__year=today.year)
+            )
+            # Mastodon doesn't include today in history (let's do it anyway)
+            for j, day in enumerate(days):
+                day_q = tag_q & models.Q(published__date=day)
+                history_counts[f"t{i}_d{j}_total"] = models.Count("id", filter=day_q)
+                history_counts[f"t{i}_d{j}_authors"] = models.Count(
+                    "author", filter=day_q, distinct=True
+                )
+        totals = Post.objects.local_public().filter(any_tag_q).aggregate(**counts)
+        history_totals = (
+            Post.objects.not_hidden()
+            .filter(any_tag_q, published__date__gte=days[-1])
+            .aggregate(**history_counts)
+        )
 
-        instance.stats = {
-            "total": total,
-            today.isoformat(): total_today,
-            today.strftime("%Y-%m"): total_month,
-            today.strftime("%Y"): total_year,
-            "history": history,
-        }
-        instance.stats_updated = timezone.now()
-        instance.save()
-
-        return cls.updated
+        now = timezone.now()
+        for i, instance in enumerate(instances):
+            instance.stats = {
+                "total": totals[f"t{i}_total"],
+                today.isoformat(): totals[f"t{i}_today"],
+                today.strftime("%Y-%m"): totals[f"t{i}_month"],
+                today.strftime("%Y"): totals[f"t{i}_year"],
+                "history": [
+                    {
+                        "day": str(int(time.mktime(day.timetuple()))),
+                        "uses": str(history_totals[f"t{i}_d{j}_total"]),
+                        "accounts": str(history_totals[f"t{i}_d{j}_authors"]),
+                    }
+                    for j, day in enumerate(days)
+                ],
+            }
+            instance.stats_updated = now
+            instance.updated = now
+        Hashtag.objects.bulk_update(instances, ["stats", "stats_updated", "updated"])
+
+        return {instance.pk: cls.updated for instance in instances}
 
 
 class HashtagQuerySet(models.QuerySet):
@@ -132,6 +156,16 @@ class Hashtag(StatorModel):
 
     hashtag_regex = re.compile(r"\B#([a-zA-Z0-9(_)]+\b)(?!;)")
 
+    @property
+    def posts_q(self) -> models.Q:
+        """
+        A Q object matching posts tagged with this hashtag or its aliases
+        """
+        tag_q = models.Q(hashtags__contains=self.hashtag)
+        for alias in self.aliases or []:
+            tag_q |= models.Q(hashtags__contains=alias)
+        return tag_q
+
     def save(self, *args, **kwargs):
         self.hashtag = self.hashtag.lstrip("#")
         if self.name_override:
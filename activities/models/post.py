@@ -45,6 +45,7 @@ from users.models.inbox_message import InboxMessage
 from users.models.relay import Relay
 from users.models.system_actor import SystemActor
 
+from activities.models.activity_payload import ActivityPayload
 from activities.models.emoji import Emoji
 from activities.models.fan_out import FanOut
 from activities.models.hashtag import Hashtag
@@ -88,7 +89,7 @@ def _attach_preview_card(post_pk: int, content: str) -> None:
 
 
 class PostStates(StateGraph):
-    new = State(try_interval=300)
+    new = State(try_interval=300, dispatch=True)
     fanned_out = State(externally_progressed=True)
     deleted = State(try_interval=300)
     deleted_fanned_out = State(delete_after=86400)
@@ -108,30 +109,38 @@ class PostStates(StateGraph):
 
     @classmethod
     def targets_fan_out(cls, post: "Post", type_: str) -> None:
+        targets = list(post.targets_query().values_list("pk", "local"))
+        # Serialize the activity once for every remote inbox to share
+        payload = None
+        if post.local and any(not local for _, local in targets):
+            payload = ActivityPayload.for_post(post, type_)
         # Fan out to each target
-        for follow in post.get_targets():
-            FanOut.objects.create(
-                identity=follow,
-                type=type_,
-                subject_post=post,
-            )
-        cls.fan_out_to_relay(post, type_)
+        FanOut.bulk_create_ready(
+            [
+                FanOut(
+                    identity_id=identity_id,
+                    type=type_,
+                    subject_post=post,
+                    state=FanOut.initial_state(local),
+                )
+                for identity_id, local in targets
+            ]
+        )
+        cls.fan_out_to_relay(post, type_, payload)
 
     @classmethod
-    def fan_out_to_relay(cls, post: "Post", type_: str) -> None:
+    def fan_out_to_relay(
+        cls, post: "Post", type_: str, payload: ActivityPayload | None = None
+    ) -> None:
         if not post.local or post.visibility != Post.Visibilities.public:
             return
         relay_uris = Relay.active_inbox_uris()
         if not relay_uris:
             return
-        obj = None
-        match type_:
-            case FanOut.Types.post:
-                obj = canonicalise(post.to_create_ap())
-            case FanOut.Types.post_edited:
-                obj = canonicalise(post.to_update_ap())
-            case FanOut.Types.post_deleted:
-                obj = canonicalise(post.to_delete_ap())
+        if payload:
+            obj = payload.activity
+        else:
+            obj = ActivityPayload.build_activity(post, type_)
         if not obj:
             return
         # Attach LD signature so relay recipients can verify the original author
@@ -336,10 +345,7 @@ class PostQuerySet(models.QuerySet):
         if isinstance(hashtag, str):
             tag_q = models.Q(hashtags__contains=hashtag)
         else:
-            tag_q = models.Q(hashtags__contains=hashtag.hashtag)
-            if hashtag.aliases:
-                for alias in hashtag.aliases:
-                    tag_q |= models.Q(hashtags__contains=alias)
+            tag_q = hashtag.posts_q
         return self.filter(tag_q)
 
 
@@ -1013,82 +1019,71 @@ class Post(StatorModel):
         """
         Returns a list of Identities that need to see posts and their changes
         """
-        targets = set()
-        for mention in self.mentions.all():
-            targets.add(mention)
+        return set(self.targets_query())
+
+    def targets_query(self) -> models.QuerySet[Identity]:
+        """
+        Returns a queryset of the Identities that need to see posts and their
+        changes, with blocks removed and only one identity per shared inbox,
+        so that it can all be worked out in the database.
+        """
+        targets = models.Q(pk__in=self.mentions.values("pk"))
         if self.visibility in [Post.Visibilities.public, Post.Visibilities.unlisted]:
             # deliver edit to all previously interacted to this post
-            for interaction in self.interactions.all():
-                targets.add(interaction.identity)
+            targets |= models.Q(pk__in=self.interactions.values("identity_id"))
             # deliver to all hashtag followers
             if self.hashtags:
-                for follow in HashtagFollow.objects.by_hashtags(
-                    self.hashtags
-                ).prefetch_related("identity"):
-                    targets.add(follow.identity)
+                targets |= models.Q(
+                    pk__in=HashtagFollow.objects.by_hashtags(self.hashtags).values(
+                        "identity_id"
+                    )
+                )
         # Then, if it's not mentions only, also deliver to followers
         if self.visibility != Post.Visibilities.mentioned:
-            for follower in (
-                self.author.inbound_follows.filter(
+            targets |= models.Q(
+                pk__in=self.author.inbound_follows.filter(
                     state__in=FollowStates.group_active()
                 )
                 .exclude(source__state=IdentityStates.connection_issue)
-                .select_related("source")
-            ):
-                targets.add(follower.source)
-
+                .values("source_id")
+            )
         # If it quotes a post, include the quoted post's author
         if self.quote_url:
-            quoted_post = (
-                Post.objects.filter(object_uri=self.quote_url)
-                .select_related("author")
-                .first()
+            targets |= models.Q(
+                pk__in=Post.objects.filter(object_uri=self.quote_url)
+                .order_by("pk")
+                .values("author_id")[:1]
             )
-            if quoted_post:
-                targets.add(quoted_post.author)
         # If it's a reply, always include the original author if we know them
         reply_post = self.in_reply_to_post()
         if reply_post:
-            targets.add(reply_post.author)
+            targets |= models.Q(pk=reply_post.author_id)
             # And if it's a reply to one of our own, we have to re-fan-out to
             # the original author's followers
             if reply_post.author.local:
-                for follower in reply_post.author.inbound_follows.filter(
-                    state__in=FollowStates.group_active()
-                ).select_related("source"):
-                    targets.add(follower.source)
+                targets |= models.Q(
+                    pk__in=reply_post.author.inbound_follows.filter(
+                        state__in=FollowStates.group_active()
+                    ).values("source_id")
+                )
         # If this is a remote post or local-only, filter to only include
         # local identities
         if not self.local or self.visibility == Post.Visibilities.local_only:
-            targets = {target for target in targets if target.local}
+            targets &= models.Q(local=True)
         # If it's a local post, include the author
         if self.local:
-            targets.add(self.author)
-        # Fetch the author's full blocks and remove them as targets
-        blocks = (
-            self.author.outbound_blocks.active()
-            .filter(mute=False)
-            .select_related("target")
+            targets |= models.Q(pk=self.author_id)
+        # Remove the author's full blocks as targets, then dedupe the targets
+        # based on shared inboxes (we only keep one per shared inbox)
+        return (
+            Identity.objects.filter(targets)
+            .exclude(
+                pk__in=self.author.outbound_blocks.active()
+                .filter(mute=False)
+                .values("target_id")
+            )
+            .one_per_inbox()
         )
-        for block in blocks:
-            try:
-                targets.remove(block.target)
-            except KeyError:
-                pass
-        # Now dedupe the targets based on shared inboxes (we only keep one per
-        # shared inbox)
-        deduped_targets = set()
-        shared_inboxes = set()
-        for target in targets:
-            if target.local or not target.shared_inbox_uri:
-                deduped_targets.add(target)
-            elif target.shared_inbox_uri not in shared_inboxes:
-                shared_inboxes.add(target.shared_inbox_uri)
-                deduped_targets.add(target)
-            else:
-                # Their shared inbox is already being sent to
-                pass
-        return deduped_targets
 
     ### ActivityPub (inbound) ###
 
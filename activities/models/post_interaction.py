@@ -14,7 +14,7 @@ from users.models import Identity, Block
 
 
 class PostInteractionStates(StateGraph):
-    new = State(try_interval=300)
+    new = State(try_interval=300, dispatch=True)
     fanned_out = State(externally_progressed=True)
     undone = State(try_interval=300)
     undone_fanned_out = State(delete_after=24 * 60 * 60)
@@ -56,13 +56,20 @@ class PostInteractionStates(StateGraph):
                 subject_post_interaction=instance,
             )
         if instance.type == instance.Types.boost or instance.type == instance.Types.pin:
-            for target in instance.get_targets():
-                FanOut.objects.create(
-                    type=FanOut.Types.interaction,
-                    identity=target,
-                    subject_post=instance.post,
-                    subject_post_interaction=instance,
-                )
+            FanOut.bulk_create_ready(
+                [
+                    FanOut(
+                        type=FanOut.Types.interaction,
+                        identity_id=identity_id,
+                        subject_post=instance.post,
+                        subject_post_interaction=instance,
+                        state=FanOut.initial_state(local),
+                    )
+                    for identity_id, local in instance.targets_query().values_list(
+                        "pk", "local"
+                    )
+                ]
+            )
         # Like: send a copy to the original post author only,
         # if the liker is local or they are
         elif instance.type == instance.Types.like:
@@ -221,45 +228,39 @@ class PostInteraction(StatorModel):
         When interaction is boost, only boost follows are considered,
         for pins all followers are considered.
         """
+        return set(self.targets_query())
+
+    def targets_query(self) -> models.QuerySet[Identity]:
+        """
+        Returns get_targets() as a queryset, so it can be worked out in the
+        database.
+        """
         # Start including the post author
-        targets = {self.post.author}
+        targets = models.Q(pk=self.post.author_id)
 
         query = self.identity.inbound_follows.active()
         # Include all followers that are following the boosts
         if self.type == self.Types.boost:
             query = query.filter(boosts=True)
-        for follow in query.select_related("source"):
-            targets.add(follow.source)
-
-        # Fetch the full blocks and remove them as targets
-        for block in (
-            self.identity.outbound_blocks.active()
-            .filter(mute=False)
-            .select_related("target")
-        ):
-            try:
-                targets.remove(block.target)
-            except KeyError:
-                pass
-
-        deduped_targets = set()
-        shared_inboxes = set()
-        for target in targets:
-            if target.local:
-                # Local targets always gets the boosts
-                # despite its creator locality
-                if target != self.identity:
-                    deduped_targets.add(target)
-            elif self.identity.local:
-                # Dedupe the targets based on shared inboxes
-                # (we only keep one per shared inbox)
-                if not target.shared_inbox_uri:
-                    deduped_targets.add(target)
-                elif target.shared_inbox_uri not in shared_inboxes:
-                    shared_inboxes.add(target.shared_inbox_uri)
-                    deduped_targets.add(target)
-
-        return deduped_targets
+        targets |= models.Q(pk__in=query.values("source_id"))
+
+        # Local targets always gets the boosts despite its creator locality,
+        # but remote ones only get them from local identities
+        if not self.identity.local:
+            targets &= models.Q(local=True)
+
+        # Remove the full blocks as targets, then dedupe the targets based on
+        # shared inboxes (we only keep one per shared inbox)
+        return (
+            Identity.objects.filter(targets)
+            .exclude(pk=self.identity_id)
+            .exclude(
+                pk__in=self.identity.outbound_blocks.active()
+                .filter(mute=False)
+                .values("target_id")
+            )
+            .one_per_inbox()
+        )
 
     ### Create helpers ###
 
@@ -4,6 +4,7 @@ from html.parser import HTMLParser
 from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
 
 import httpx
+from core import http
 from core.uris import ProxyAbsoluteUrl
 from django.conf import settings
 from django.db import models
@@ -99,10 +100,11 @@ def _check_url_safety(request: httpx.Request) -> None:
 
 def _make_safe_client() -> httpx.Client:
     """
-    Returns an httpx.Client configured with SSRF protection, timeouts,
-    redirect limits, and a User-Agent header.
+    Returns the shared httpx.Client configured with SSRF protection,
+    timeouts, redirect limits, and a User-Agent header.
     """
-    return httpx.Client(
+    return http.client(
+        "preview_card",
         follow_redirects=True,
         max_redirects=5,
         timeout=httpx.Timeout(connect=5.0, read=10.0, write=5.0, pool=5.0),
@@ -181,8 +183,7 @@ class PreviewCardStates(StateGraph):
             return cls.fetch_failed
 
         try:
-            with _make_safe_client() as client:
-                response = client.get(instance.url)
+            response = _make_safe_client().get(instance.url)
         except Exception:
             return cls.fetch_failed
 
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0007_alter_pushnotification_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pushnotification",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0008_stator_locked_by"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pushnotification",
+            name="state_attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
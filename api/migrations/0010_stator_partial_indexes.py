@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:52
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("api", "0009_stator_attempts"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pushnotification",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name="pushnotification",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_pushnotific_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="pushnotification",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["sending"]), ("state_locked_until__isnull", True)
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_pushnotific_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="pushnotification",
+            index=models.Index(
+                condition=models.Q(("state__in", ["failed", "sent"])),
+                fields=["state", "state_changed"],
+                name="ix_pushnotific_delete",
+            ),
+        ),
+    ]
@@ -163,6 +163,8 @@ class PushNotificationStates(StateGraph):
 
 
 class PushNotification(StatorModel):
+    PARTITION_FIELD = "created"
+
     token = models.ForeignKey(
         "api.Token",
         on_delete=models.CASCADE,
@@ -179,6 +181,9 @@ class PushNotification(StatorModel):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes: list = []
+
     def to_webpush_json(self):
         return {
             "access_token": self.token.token,
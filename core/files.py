@@ -1,12 +1,13 @@
 import io
 
 import blurhash
-import httpx
 from django.conf import settings
 from django.core.files import File
 from django.core.files.base import ContentFile
 from PIL import Image, ImageOps
 
+from core import http
+
 
 class ImageFile(File):
     image: Image
@@ -66,25 +67,18 @@ def get_remote_file(
     """
     Download a URL and return the File and content-type.
     """
-    headers = {
-        "User-Agent": settings.TAKAHE_USER_AGENT,
-    }
-
-    with httpx.Client(headers=headers) as client:
-        with client.stream(
-            "GET", url, timeout=timeout, follow_redirects=True
-        ) as stream:
-            allow_download = max_size is None
-            if max_size:
-                try:
-                    content_length = int(stream.headers["content-length"])
-                    allow_download = content_length <= max_size
-                except (KeyError, TypeError):
-                    pass
-            if allow_download:
-                file = ContentFile(stream.read(), name=url)
-                return file, stream.headers.get(
-                    "content-type", "application/octet-stream"
-                )
+    with http.client().stream(
+        "GET", url, timeout=timeout, follow_redirects=True
+    ) as stream:
+        allow_download = max_size is None
+        if max_size:
+            try:
+                content_length = int(stream.headers["content-length"])
+                allow_download = content_length <= max_size
+            except (KeyError, TypeError):
+                pass
+        if allow_download:
+            file = ContentFile(stream.read(), name=url)
+            return file, stream.headers.get("content-type", "application/octet-stream")
 
     return None, None
@@ -0,0 +1,477 @@
+"""
+Shared, pooled HTTP clients for talking to other servers.
+
+Making a new httpx client for every request means a new DNS lookup, TCP
+connection and TLS handshake every time, even when we're sending thousands
+of activities to the same server. Instead, each process keeps one client
+(per purpose, and per event loop for async code) whose connections are
+kept alive and reused, with a limit on how many can be open to any one host
+so a single slow server can't take up the whole pool, and on how fast we
+send to each host so we don't get rate-limited by big servers.
+"""
+
+import asyncio
+import datetime
+import email.utils
+import os
+import threading
+import time
+import weakref
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from typing import TypeVar, cast
+
+import asgiref.sync
+import httpx
+from django.conf import settings
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+T = TypeVar("T")
+
+
+class ReleasingStream(httpx.SyncByteStream):
+    """
+    A response body that calls `release` once it has been closed.
+    """
+
+    def __init__(self, stream: httpx.SyncByteStream, release: Callable[[], None]):
+        self.stream = stream
+        self.release = release
+        self.released = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if not self.released:
+                self.released = True
+                self.release()
+
+
+class AsyncReleasingStream(httpx.AsyncByteStream):
+    """
+    A response body that calls `release` once it has been closed.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self.stream = stream
+        self.release = release
+        self.released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.released:
+                self.released = True
+                self.release()
+
+
+class RateLimited(httpx.PoolTimeout):
+    """
+    Raised instead of sending a request to a host that has asked us to back
+    off, or that we're sending to faster than its rate limit allows.
+    `retry_after` is how many seconds to wait before trying again, if known.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        *,
+        request: httpx.Request | None = None,
+        retry_after: float | None = None,
+    ):
+        super().__init__(message, request=request)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Returns how many seconds a Retry-After header (either a number of
+    seconds or an HTTP date) asks us to wait, or None if it can't be read.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.UTC)
+    return max((when - datetime.datetime.now(datetime.UTC)).total_seconds(), 0)
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests a second on average, in bursts of up to `burst`.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, returning how many seconds to wait until it can be
+        used (zero if one is available now).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, 0)
+
+    def refund(self):
+        """
+        Gives back a token that was reserved but not used.
+        """
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+
+class HostLimiter:
+    """
+    Limits each host to `per_host` requests in flight at once and `rate`
+    requests a second (in bursts of up to `burst`; a rate of zero means no
+    limit), with `overrides` of {host: (per_host, rate)} for particular
+    hosts. Also remembers hosts that have told us to back off with a
+    Retry-After header, until that time has passed.
+    """
+
+    def __init__(
+        self,
+        per_host: int,
+        rate: float = 0,
+        burst: int = 1,
+        overrides: dict[str, tuple[int, float]] | None = None,
+    ):
+        self.per_host = per_host
+        self.rate = rate
+        self.burst = burst
+        self.overrides = overrides or {}
+        self.lock = threading.Lock()
+        self.buckets: dict[str, TokenBucket | None] = {}
+        self.backoffs: dict[str, float] = {}
+
+    def limits(self, host: str) -> tuple[int, float]:
+        return self.overrides.get(host, (self.per_host, self.rate))
+
+    def bucket(self, host: str) -> TokenBucket | None:
+        with self.lock:
+            if host not in self.buckets:
+                rate = self.limits(host)[1]
+                self.buckets[host] = (
+                    TokenBucket(rate, max(self.burst, 1)) if rate > 0 else None
+                )
+            return self.buckets[host]
+
+    def reserve(self, request: httpx.Request) -> float:
+        """
+        Reserves a slot in the host's rate limit for the request, returning
+        how many seconds to wait before sending it. Raises RateLimited if
+        the host has asked us to back off, or the wait would be longer than
+        the pool timeout.
+        """
+        host = request.url.host
+        backoff = self.backoffs.get(host, 0) - time.monotonic()
+        if backoff > 0:
+            raise RateLimited(
+                f"{host} asked us to wait", request=request, retry_after=backoff
+            )
+        bucket = self.bucket(host)
+        if bucket is None:
+            return 0
+        wait = bucket.reserve()
+        pool_timeout = request.extensions.get("timeout", {}).get("pool")
+        if pool_timeout is not None and wait > pool_timeout:
+            bucket.refund()
+            raise RateLimited(
+                f"Sending to {host} too fast", request=request, retry_after=wait
+            )
+        return wait
+
+    def refund(self, request: httpx.Request):
+        """
+        Gives back the request's slot in its host's rate limit, if it didn't
+        get sent after all.
+        """
+        bucket = self.bucket(request.url.host)
+        if bucket is not None:
+            bucket.refund()
+
+    def observe(self, request: httpx.Request, response: httpx.Response):
+        """
+        Remembers if the response asked us to stop sending to its host for a
+        while.
+        """
+        if response.status_code not in [429, 503]:
+            return
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after:
+            self.backoffs[request.url.host] = time.monotonic() + retry_after
+
+
+class HostLimitedTransport(httpx.BaseTransport):
+    """
+    Wraps a transport so only so many requests to each host can be in
+    flight (and so only that many connections to it can be open) at once,
+    and so they're sent no faster than its rate limit (see HostLimiter).
+    Further requests wait for a slot, for up to the pool timeout.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.BaseTransport,
+        per_host: int,
+        rate: float = 0,
+        burst: int = 1,
+        overrides: dict[str, tuple[int, float]] | None = None,
+    ):
+        self.transport = transport
+        self.limiter = HostLimiter(per_host, rate, burst, overrides)
+        self.lock = threading.Lock()
+        self.semaphores: dict[str, threading.BoundedSemaphore] = {}
+
+    def semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(
+                    self.limiter.limits(host)[0]
+                )
+            return self.semaphores[host]
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        wait = self.limiter.reserve(request)
+        if wait:
+            time.sleep(wait)
+        semaphore = self.semaphore(request.url.host)
+        pool_timeout = request.extensions.get("timeout", {}).get("pool")
+        if not semaphore.acquire(timeout=pool_timeout):
+            self.limiter.refund(request)
+            raise httpx.PoolTimeout(
+                f"Too many requests to {request.url.host} at once", request=request
+            )
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        self.limiter.observe(request, response)
+        # The connection is only free again once the body has been read
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=ReleasingStream(
+                cast(httpx.SyncByteStream, response.stream), semaphore.release
+            ),
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncHostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    The async version of HostLimitedTransport, for use on one event loop.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        per_host: int,
+        rate: float = 0,
+        burst: int = 1,
+        overrides: dict[str, tuple[int, float]] | None = None,
+    ):
+        self.transport = transport
+        self.limiter = HostLimiter(per_host, rate, burst, overrides)
+        self.semaphores: dict[str, asyncio.BoundedSemaphore] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        wait = self.limiter.reserve(request)
+        if wait:
+            await asyncio.sleep(wait)
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.BoundedSemaphore(
+                self.limiter.limits(host)[0]
+            )
+        semaphore = self.semaphores[host]
+        pool_timeout = request.extensions.get("timeout", {}).get("pool")
+        try:
+            await asyncio.wait_for(semaphore.acquire(), pool_timeout)
+        except TimeoutError:
+            self.limiter.refund(request)
+            raise httpx.PoolTimeout(
+                f"Too many requests to {host} at once", request=request
+            )
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        self.limiter.observe(request, response)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=AsyncReleasingStream(
+                cast(httpx.AsyncByteStream, response.stream), semaphore.release
+            ),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def host_limits() -> dict:
+    """
+    Returns the per-host limits every client's transport gets.
+    """
+    return {
+        "per_host": settings.SETUP.REMOTE_POOL_PER_HOST,
+        "rate": settings.SETUP.REMOTE_HOST_RATE,
+        "burst": settings.SETUP.REMOTE_HOST_BURST,
+        "overrides": settings.SETUP.REMOTE_HOST_LIMITS,
+    }
+
+
+def pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.SETUP.REMOTE_POOL_SIZE,
+        max_keepalive_connections=settings.SETUP.REMOTE_POOL_KEEPALIVE,
+        keepalive_expiry=settings.SETUP.REMOTE_POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def client_options(options: dict) -> dict:
+    """
+    Fills in the defaults every client gets, unless given.
+    """
+    return {
+        "timeout": settings.SETUP.REMOTE_TIMEOUT,
+        "headers": {"User-Agent": settings.TAKAHE_USER_AGENT},
+        **options,
+    }
+
+
+class ClientPool:
+    """
+    Holds this process' clients, creating each one the first time it's
+    asked for.
+    """
+
+    def __init__(self):
+        self.reset()
+        # Forked children (like supervised runners) mustn't share our
+        # sockets, so they start with no clients at all
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.clients: dict[str, httpx.Client] = {}
+        self.async_clients: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[str, httpx.AsyncClient]
+        ] = weakref.WeakKeyDictionary()
+
+    def client(self, name: str = "default", **options) -> httpx.Client:
+        """
+        Returns the shared client with the given name, creating it with
+        `options` (passed to httpx.Client) if it doesn't exist yet.
+        """
+        with self.lock:
+            if name not in self.clients:
+                http2 = settings.SETUP.REMOTE_HTTP2 and HTTP2_AVAILABLE
+                verify = options.pop("verify", True)
+                self.clients[name] = httpx.Client(
+                    transport=HostLimitedTransport(
+                        httpx.HTTPTransport(
+                            limits=pool_limits(), http2=http2, verify=verify
+                        ),
+                        **host_limits(),
+                    ),
+                    **client_options(options),
+                )
+            return self.clients[name]
+
+    def async_client(self, name: str = "default", **options) -> httpx.AsyncClient:
+        """
+        Returns the shared async client with the given name for the running
+        event loop, creating it with `options` if it doesn't exist yet.
+        """
+        loop = asyncio.get_running_loop()
+        clients = self.async_clients.setdefault(loop, {})
+        if name not in clients:
+            http2 = settings.SETUP.REMOTE_HTTP2 and HTTP2_AVAILABLE
+            verify = options.pop("verify", True)
+            clients[name] = httpx.AsyncClient(
+                transport=AsyncHostLimitedTransport(
+                    httpx.AsyncHTTPTransport(
+                        limits=pool_limits(), http2=http2, verify=verify
+                    ),
+                    **host_limits(),
+                ),
+                **client_options(options),
+            )
+        return clients[name]
+
+    async def aclose_loop(self):
+        """
+        Closes the running event loop's async clients; call this before a
+        loop finishes, or their connections are left open.
+        """
+        clients = self.async_clients.pop(asyncio.get_running_loop(), {})
+        for http_client in clients.values():
+            await http_client.aclose()
+
+    def close(self):
+        """
+        Closes the sync clients (async ones are closed by aclose_loop).
+        """
+        with self.lock:
+            clients, self.clients = self.clients, {}
+        for http_client in clients.values():
+            http_client.close()
+
+
+pool = ClientPool()
+client = pool.client
+async_client = pool.async_client
+
+
+def async_to_sync(function: Callable[..., Awaitable[T]]) -> Callable[..., T]:
+    """
+    Like asgiref's async_to_sync, but always runs `function` in its own
+    short-lived event loop and closes any async clients it made before the
+    loop goes away (a loop we don't own might still be using its clients).
+    """
+
+    async def run_closing(*args, **kwargs) -> T:
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            await pool.aclose_loop()
+
+    return asgiref.sync.async_to_sync(run_closing, force_new_loop=True)
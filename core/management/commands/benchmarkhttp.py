@@ -0,0 +1,138 @@
+import datetime
+import ssl
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from django.core.management.base import BaseCommand
+
+from core import http
+
+
+class InboxHandler(BaseHTTPRequestHandler):
+    """
+    Stands in for a remote server's inbox: accepts any POST, keeping the
+    connection open afterwards like a real server would.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def self_signed_context(directory: Path) -> tuple[ssl.SSLContext, ssl.SSLContext]:
+    """
+    Makes a certificate for localhost, and returns a server context using it
+    and a client context that trusts it.
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.UTC)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False
+        )
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = directory / "cert.pem"
+    key_path = directory / "key.pem"
+    cert_path.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        )
+    )
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert_path, key_path)
+    client_context = ssl.create_default_context(cafile=str(cert_path))
+    return server_context, client_context
+
+
+class Command(BaseCommand):
+    help = "Compares a new HTTP client per request with the shared pool, against a local server"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            "-n",
+            type=int,
+            default=500,
+            help="How many requests to send in each mode",
+        )
+        parser.add_argument(
+            "--threads",
+            "-t",
+            type=int,
+            default=8,
+            help="How many threads to send them from",
+        )
+        parser.add_argument(
+            "--plain",
+            action="store_true",
+            help="Use plain HTTP rather than HTTPS",
+        )
+
+    def handle(self, requests: int, threads: int, plain: bool, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            server = ThreadingHTTPServer(("localhost", 0), InboxHandler)
+            server.daemon_threads = True
+            verify: ssl.SSLContext | bool = True
+            if not plain:
+                server_context, verify = self_signed_context(Path(directory))
+                server.socket = server_context.wrap_socket(
+                    server.socket, server_side=True
+                )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            scheme = "http" if plain else "https"
+            url = f"{scheme}://localhost:{server.server_address[1]}/inbox"
+            body = b'{"type": "Create"}' * 50
+
+            def fresh(index):
+                with httpx.Client(verify=verify) as client:
+                    client.post(url, content=body).raise_for_status()
+
+            pooled_client = http.client("benchmark", verify=verify)
+
+            def pooled(index):
+                pooled_client.post(url, content=body).raise_for_status()
+
+            try:
+                for name, send in [
+                    ("new client per request", fresh),
+                    ("pooled", pooled),
+                ]:
+                    started = time.monotonic()
+                    with ThreadPoolExecutor(max_workers=threads) as executor:
+                        list(executor.map(send, range(requests)))
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f"{name:>24}: {requests / elapsed:8.1f} requests/s "
+                        f"({elapsed / requests * 1000 * threads:.2f}ms each)"
+                    )
+            finally:
+                server.shutdown()
+                http.pool.clients.pop("benchmark").close()
@@ -0,0 +1,75 @@
+import time
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from django.core.management.base import BaseCommand
+
+from core.signatures import HttpSignature, LDSignature, RsaKeys
+
+
+class Command(BaseCommand):
+    help = "Measures signing and verifying throughput, with and without the key cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            "-n",
+            type=int,
+            default=500,
+            help="How many signatures to make and check in each test",
+        )
+
+    def handle(self, iterations: int, *args, **options):
+        private_key, public_key = RsaKeys.generate_keypair()
+        key_id = "https://example.com/actor#main-key"
+        cleartext = "(request-target): post /inbox\nhost: example.com\ndate: now"
+        signature = RsaKeys.load_private_key(private_key).sign(
+            cleartext.encode("utf8"), padding.PKCS1v15(), hashes.SHA256()
+        )
+        document = {
+            "@context": ["https://www.w3.org/ns/activitystreams"],
+            "id": "https://example.com/create",
+            "type": "Create",
+            "actor": "https://example.com/actor",
+        }
+
+        def sign():
+            RsaKeys.load_private_key(private_key, key_id).sign(
+                cleartext.encode("utf8"), padding.PKCS1v15(), hashes.SHA256()
+            )
+
+        def verify():
+            HttpSignature.verify_signature(signature, cleartext, public_key, key_id)
+
+        # JSON-LD normalisation dominates these, so they're only run a few
+        # times to show the (smaller) difference there
+        ld_signature = LDSignature.create_signature(document, private_key, key_id)
+
+        def sign_ld():
+            LDSignature.create_signature(document, private_key, key_id)
+
+        def verify_ld():
+            LDSignature.verify_signature(
+                {**document, "signature": ld_signature}, public_key, key_id
+            )
+
+        for name, function, number in [
+            ("HTTP sign", sign, iterations),
+            ("HTTP verify", verify, iterations),
+            ("LD sign", sign_ld, max(iterations // 50, 1)),
+            ("LD verify", verify_ld, max(iterations // 50, 1)),
+        ]:
+            rates = []
+            for cached in [False, True]:
+                RsaKeys.clear_cache()
+                started = time.perf_counter()
+                for _ in range(number):
+                    if not cached:
+                        RsaKeys.clear_cache()
+                    function()
+                rates.append(number / (time.perf_counter() - started))
+            self.stdout.write(
+                f"{name:>12}: {rates[0]:9.1f}/s uncached, {rates[1]:9.1f}/s cached "
+                f"({rates[1] / rates[0]:.1f}x)"
+            )
+        RsaKeys.clear_cache()
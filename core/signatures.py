@@ -1,7 +1,11 @@
 import base64
 import binascii
+import hashlib
 import json
 import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from ssl import SSLCertVerificationError, SSLError
 from typing import Literal, NotRequired, TypedDict, cast
 from urllib.parse import urlparse
@@ -18,6 +22,7 @@ from httpx._types import TimeoutTypes
 from idna.core import InvalidCodepoint
 from pyld import jsonld
 
+from core import http
 from core.ld import format_ld_date
 
 logger = logging.getLogger(__name__)
@@ -39,7 +44,83 @@ class VerificationFormatError(VerificationError):
     pass
 
 
+class RequestRefused(ValueError):
+    """
+    A signed POST got a 4xx response (other than 404 or 410)
+    """
+
+    def __init__(self, message: str, response: httpx.Response):
+        super().__init__(message)
+        self.response = response
+
+
 class RsaKeys:
+    # How many loaded key objects to keep around. Parsing a PEM private key
+    # costs about as much as signing with it, so the keys of recently active
+    # identities are kept rather than parsed for every request.
+    CACHE_SIZE = 2000
+    _cache: OrderedDict[tuple[str, str], tuple[str, object]] = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def _load_cached(cls, kind: str, pem: str, key_id: str | None, loader):
+        """
+        Returns the key object for the PEM, loading it with `loader` if it
+        isn't cached. Entries are stored under the key ID (if there is one)
+        along with the PEM's fingerprint, so when an identity's key changes
+        the old object is replaced rather than used.
+        """
+        fingerprint = hashlib.sha256(pem.encode("ascii")).hexdigest()
+        cache_key = (kind, key_id or fingerprint)
+        with cls._cache_lock:
+            entry = cls._cache.get(cache_key)
+            if entry and entry[0] == fingerprint:
+                cls._cache.move_to_end(cache_key)
+                return entry[1]
+        key = loader(pem.encode("ascii"))
+        with cls._cache_lock:
+            cls._cache[cache_key] = (fingerprint, key)
+            cls._cache.move_to_end(cache_key)
+            while len(cls._cache) > cls.CACHE_SIZE:
+                cls._cache.popitem(last=False)
+        return key
+
+    @classmethod
+    def load_private_key(
+        cls, private_key: str, key_id: str | None = None
+    ) -> rsa.RSAPrivateKey:
+        """
+        Returns the private key object for a PEM private key.
+        """
+        return cast(
+            rsa.RSAPrivateKey,
+            cls._load_cached(
+                "private",
+                private_key,
+                key_id,
+                lambda data: serialization.load_pem_private_key(data, password=None),
+            ),
+        )
+
+    @classmethod
+    def load_public_key(
+        cls, public_key: str, key_id: str | None = None
+    ) -> rsa.RSAPublicKey:
+        """
+        Returns the public key object for a PEM public key.
+        """
+        return cast(
+            rsa.RSAPublicKey,
+            cls._load_cached(
+                "public", public_key, key_id, serialization.load_pem_public_key
+            ),
+        )
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._cache_lock:
+            cls._cache.clear()
+
     @classmethod
     def generate_keypair(cls) -> tuple[str, str]:
         """
@@ -171,11 +252,9 @@ class HttpSignature:
         signature: bytes,
         cleartext: str,
         public_key: str,
+        key_id: str | None = None,
     ):
-        public_key_instance: rsa.RSAPublicKey = cast(
-            rsa.RSAPublicKey,
-            serialization.load_pem_public_key(public_key.encode("ascii")),
-        )
+        public_key_instance = RsaKeys.load_public_key(public_key, key_id)
         try:
             public_key_instance.verify(
                 signature,
@@ -253,24 +332,87 @@ class HttpSignature:
             signature_details["signature"],
             headers_string,
             public_key,
+            key_id=signature_details["keyid"],
         )
 
     @classmethod
     def signed_request(
         cls,
         uri: str,
-        body: dict | None,
+        body: dict | bytes | None,
         private_key: str,
         key_id: str,
         content_type: str = "application/activity+json",
         method: Literal["get", "post"] = "post",
         timeout: TimeoutTypes = settings.SETUP.REMOTE_TIMEOUT,
+        digest: str | None = None,
     ):
+        """
+        Performs a request to the given path, with a document, signed as an
+        identity. The document can be given already serialized (along with
+        its digest, if known) to save doing it for every request.
+        """
         if settings.SETUP.NO_FEDERATION:
             return httpx.Response(200, json={})
+        headers, body_bytes = cls.signed_request_headers(
+            uri, body, private_key, key_id, content_type, method, digest
+        )
+        with cls.request_errors(uri):
+            response = http.client().request(
+                method,
+                uri,
+                headers=headers,
+                content=body_bytes,
+                follow_redirects=method == "get",
+                timeout=timeout,
+            )
+        return cls.check_response(uri, method, response)
+
+    @classmethod
+    async def asigned_request(
+        cls,
+        uri: str,
+        body: dict | bytes | None,
+        private_key: str,
+        key_id: str,
+        content_type: str = "application/activity+json",
+        method: Literal["get", "post"] = "post",
+        timeout: TimeoutTypes = settings.SETUP.REMOTE_TIMEOUT,
+        digest: str | None = None,
+    ):
+        """
+        Performs a signed request like signed_request, but on the running
+        event loop's shared async client.
+        """
+        if settings.SETUP.NO_FEDERATION:
+            return httpx.Response(200, json={})
+        headers, body_bytes = cls.signed_request_headers(
+            uri, body, private_key, key_id, content_type, method, digest
+        )
+        with cls.request_errors(uri):
+            response = await http.async_client().request(
+                method,
+                uri,
+                headers=headers,
+                content=body_bytes,
+                follow_redirects=method == "get",
+                timeout=timeout,
+            )
+        return cls.check_response(uri, method, response)
+
+    @classmethod
+    def signed_request_headers(
+        cls,
+        uri: str,
+        body: dict | bytes | None,
+        private_key: str,
+        key_id: str,
+        content_type: str,
+        method: Literal["get", "post"],
+        digest: str | None,
+    ) -> tuple[dict[str, str], bytes]:
         """
-        Performs an async request to the given path, with a document, signed
-        as an identity.
+        Returns the signed headers and body bytes for a signed request.
         """
         if "://" not in uri:
             raise ValueError("URI does not contain a scheme")
@@ -284,8 +426,11 @@ class HttpSignature:
         }
         # If we have a body, add a digest and content type
         if body is not None:
-            body_bytes = json.dumps(body).encode("utf8")
-            headers["Digest"] = cls.calculate_digest(body_bytes)
+            if isinstance(body, bytes):
+                body_bytes = body
+            else:
+                body_bytes = json.dumps(body).encode("utf8")
+            headers["Digest"] = digest or cls.calculate_digest(body_bytes)
             headers["Content-Type"] = content_type
         else:
             body_bytes = b""
@@ -296,13 +441,7 @@ class HttpSignature:
         signed_string = "\n".join(
             f"{name.lower()}: {value}" for name, value in headers.items()
         )
-        private_key_instance: rsa.RSAPrivateKey = cast(
-            rsa.RSAPrivateKey,
-            serialization.load_pem_private_key(
-                private_key.encode("ascii"),
-                password=None,
-            ),
-        )
+        private_key_instance = RsaKeys.load_private_key(private_key, key_id)
         signature = private_key_instance.sign(
             signed_string.encode("utf8"),
             padding.PKCS1v15(),
@@ -322,33 +461,43 @@ class HttpSignature:
 
         # Send the request with all those headers except the pseudo one
         del headers["(request-target)"]
-        with httpx.Client(timeout=timeout) as client:
-            try:
-                response = client.request(
-                    method,
-                    uri,
-                    headers=headers,
-                    content=body_bytes,
-                    follow_redirects=method == "get",
-                )
-            except SSLError as invalid_cert:
-                # Not our problem if the other end doesn't have proper SSL
-                logger.info("Invalid cert on %s %s", uri, invalid_cert)
-                raise SSLCertVerificationError(invalid_cert) from invalid_cert
-            except InvalidCodepoint as ex:
-                # Convert to a more generic error we handle
-                raise httpx.HTTPError(f"InvalidCodepoint: {str(ex)}") from None
-
-            if (
-                method == "post"
-                and response.status_code >= 400
-                and response.status_code < 500
-                and response.status_code not in [404, 410]
-            ):
-                raise ValueError(
-                    f"POST error to {uri}: {response.status_code} {response.content!r}"
-                )
-            return response
+        return headers, body_bytes
+
+    @classmethod
+    @contextmanager
+    def request_errors(cls, uri: str):
+        """
+        Converts errors sending a signed request into ones we handle.
+        """
+        try:
+            yield
+        except SSLError as invalid_cert:
+            # Not our problem if the other end doesn't have proper SSL
+            logger.info("Invalid cert on %s %s", uri, invalid_cert)
+            raise SSLCertVerificationError(invalid_cert) from invalid_cert
+        except InvalidCodepoint as ex:
+            # Convert to a more generic error we handle
+            raise httpx.HTTPError(f"InvalidCodepoint: {str(ex)}") from None
+
+    @classmethod
+    def check_response(
+        cls, uri: str, method: str, response: httpx.Response
+    ) -> httpx.Response:
+        """
+        Raises RequestRefused if a signed POST got a 4xx response (other
+        than 404 or 410).
+        """
+        if (
+            method == "post"
+            and response.status_code >= 400
+            and response.status_code < 500
+            and response.status_code not in [404, 410]
+        ):
+            raise RequestRefused(
+                f"POST error to {uri}: {response.status_code} {response.content!r}",
+                response,
+            )
+        return response
 
 
 class HttpSignatureDetails(TypedDict):
@@ -366,7 +515,9 @@ class LDSignature:
     """
 
     @classmethod
-    def verify_signature(cls, document: dict, public_key: str) -> None:
+    def verify_signature(
+        cls, document: dict, public_key: str, key_id: str | None = None
+    ) -> None:
         """
         Verifies a document
         """
@@ -388,10 +539,7 @@ class LDSignature:
         # Get the normalised hash of each document
         final_hash = cls.normalized_hash(options) + cls.normalized_hash(document)
         # Verify the signature
-        public_key_instance: rsa.RSAPublicKey = cast(
-            rsa.RSAPublicKey,
-            serialization.load_pem_public_key(public_key.encode("ascii")),
-        )
+        public_key_instance = RsaKeys.load_public_key(public_key, key_id)
         try:
             public_key_instance.verify(
                 base64.b64decode(signature["signatureValue"]),
@@ -420,13 +568,7 @@ class LDSignature:
         # Get the normalised hash of each document
         final_hash = cls.normalized_hash(options) + cls.normalized_hash(document)
         # Create the signature
-        private_key_instance: rsa.RSAPrivateKey = cast(
-            rsa.RSAPrivateKey,
-            serialization.load_pem_private_key(
-                private_key.encode("ascii"),
-                password=None,
-            ),
-        )
+        private_key_instance = RsaKeys.load_private_key(private_key, key_id)
         signature = base64.b64encode(
             private_key_instance.sign(
                 final_hash,
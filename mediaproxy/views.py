@@ -2,11 +2,11 @@ from urllib.parse import urlparse
 
 import httpx
 from activities.models import Emoji, PostAttachment
-from django.conf import settings
 from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.views.generic import View
 
+from core import http
 from users.models import Identity
 
 
@@ -36,11 +36,9 @@ class BaseProxyView(View):
             )
         else:
             try:
-                remote_response = httpx.get(
+                remote_response = http.client().get(
                     remote_url,
-                    headers={"User-Agent": settings.TAKAHE_USER_AGENT},
                     follow_redirects=True,
-                    timeout=settings.SETUP.REMOTE_TIMEOUT,
                 )
             except httpx.RequestError:
                 return HttpResponse(status=502)
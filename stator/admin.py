@@ -1,15 +1,32 @@
 from django.contrib import admin
 
-from stator.models import Stats
+from stator.models import StatorMetric, StatorSlowTask
 
 
-@admin.register(Stats)
-class DomainAdmin(admin.ModelAdmin):
+@admin.register(StatorMetric)
+class StatorMetricAdmin(admin.ModelAdmin):
     list_display = [
         "model_label",
-        "updated",
+        "state",
+        "start",
+        "handled",
+        "failed",
+        "timed_out",
+        "queued",
     ]
-    ordering = ["model_label"]
+    list_filter = ["model_label"]
+    ordering = ["model_label", "state", "-start"]
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StatorSlowTask)
+class StatorSlowTaskAdmin(admin.ModelAdmin):
+    list_display = ["model_label", "state", "pks", "duration", "created"]
+    list_filter = ["model_label"]
+    ordering = ["-created"]
+    readonly_fields = ["model_label", "state", "pks", "duration", "samples", "queries"]
 
     def has_add_permission(self, request, obj=None):
         return False
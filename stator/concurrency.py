@@ -0,0 +1,118 @@
+import math
+
+from django.db import connection
+
+
+class ConcurrencyController:
+    """
+    Decides how many tasks a runner should have going at once, between a
+    minimum and maximum, and how those slots are shared out between models.
+
+    Like TCP congestion control, it grows additively (a slot at a time)
+    while there is a backlog to work through and the pool is busy, and
+    shrinks multiplicatively as soon as the database is running out of
+    connections or handlers start taking much longer than usual. When there
+    is little to do it slowly gives slots back.
+
+    Handler latencies are tracked separately for each kind of task (model
+    and state), as some are always far slower than others, and each is
+    only compared with its own usual latency.
+    """
+
+    # Fraction of the database's connection limit at which we back off
+    connection_limit = 0.9
+    # How many times slower than usual handlers can get before we back off
+    latency_limit = 2.0
+    # Smoothing factors for the recent and long-run handler latencies
+    fast_alpha = 0.3
+    slow_alpha = 0.02
+
+    def __init__(self, minimum: int, maximum: int, initial: int):
+        if not 1 <= minimum <= maximum:
+            raise ValueError("Concurrency bounds must satisfy 1 <= minimum <= maximum")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.concurrency = min(max(initial, minimum), maximum)
+        self.model_limits: dict[str, int] = {}
+        self.latency_fast: dict[str, float] = {}
+        self.latency_slow: dict[str, float] = {}
+        # The kinds of task that have finished since the last update
+        self.observed: set[str] = set()
+
+    def observe(self, kind: str, duration: float):
+        """
+        Records how long a task of the given kind (model and state) took.
+        """
+        self.observed.add(kind)
+        if kind not in self.latency_fast:
+            self.latency_fast[kind] = self.latency_slow[kind] = duration
+            return
+        self.latency_fast[kind] += self.fast_alpha * (
+            duration - self.latency_fast[kind]
+        )
+        self.latency_slow[kind] += self.slow_alpha * (
+            duration - self.latency_slow[kind]
+        )
+
+    @property
+    def latency_ratio(self) -> float:
+        """
+        How much slower handlers are running recently than they usually do,
+        for whichever kind of task that's run since the last update has
+        slowed down the most.
+        """
+        ratios = [
+            self.latency_fast[kind] / self.latency_slow[kind]
+            for kind in self.observed
+            if self.latency_slow[kind]
+        ]
+        return max(ratios, default=1.0)
+
+    def update(
+        self,
+        busy: int,
+        backlogs: dict[str, int],
+        connection_usage: float | None = None,
+    ) -> int:
+        """
+        Adjusts the concurrency given how many tasks are running, how many
+        instances of each model are waiting, and what fraction of the
+        database's connections are in use (if known). Returns the new value.
+        """
+        latency_ratio = self.latency_ratio
+        self.observed.clear()
+        if (
+            connection_usage is not None and connection_usage >= self.connection_limit
+        ) or latency_ratio >= self.latency_limit:
+            self.concurrency = max(self.minimum, int(self.concurrency * 0.75))
+        elif sum(backlogs.values()) > busy and busy >= self.concurrency * 0.8:
+            self.concurrency = min(self.maximum, self.concurrency + 1)
+        elif busy < self.concurrency / 2:
+            self.concurrency = max(self.minimum, self.concurrency - 1)
+        self.allocate(backlogs)
+        return self.concurrency
+
+    def allocate(self, backlogs: dict[str, int]):
+        """
+        Shares the slots out between models in proportion to their backlogs,
+        always leaving at least one for each so new work gets picked up.
+        """
+        total = sum(backlogs.values())
+        for label, backlog in backlogs.items():
+            share = math.ceil(self.concurrency * backlog / total) if total else 0
+            self.model_limits[label] = max(1, min(self.concurrency, share))
+
+
+def database_connection_usage() -> float | None:
+    """
+    Returns what fraction of the database's connection limit is in use, or
+    None if we can't tell.
+    """
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*), current_setting('max_connections')::int FROM pg_stat_activity"
+        )
+        used, limit = cursor.fetchone()
+    return used / limit
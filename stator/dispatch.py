@@ -0,0 +1,226 @@
+"""
+Optional in-process dispatch of Stator work as soon as it's committed.
+
+With STATOR_DISPATCH enabled, rows that are saved or transitioned into a
+state that opts in (with State(dispatch=True)) are claimed and run by a small
+thread pool in the process that made them (usually a web worker), right
+after their transaction commits, rather than waiting for a runner to poll
+for them. Anything the pool can't take, or that fails, is left for the
+runners as normal.
+"""
+
+import datetime
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from stator import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """
+    Collects committed rows per model and runs them in a thread pool, one
+    drain job per model at a time so rows arriving together get claimed
+    (and batched) together. Each claimed row or batch then runs as its own
+    job, and like a runner, we keep renewing our leases on everything we've
+    claimed until it's done.
+    """
+
+    # How often to write this process' handler metrics out
+    metrics_interval = 60
+    # How many rows can be waiting before we leave new ones to the runners
+    max_pending = 1000
+    # How long our locks last; they're renewed every third of this
+    lock_expiry = 30
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: dict[type, set] = {}
+        # How many claimed jobs each model has waiting or running
+        self.claimed: dict[type, int] = {}
+        self.executor: ThreadPoolExecutor | None = None
+        self.renewer: threading.Thread | None = None
+        self.stopped = threading.Event()
+        self.runner_id = f"dispatch-{uuid.uuid4().hex}"
+        self.metrics_flushed = time.monotonic()
+        # Runners turn this off in their own processes, as they'll find new
+        # work quickly themselves
+        self.enabled = True
+
+    @property
+    def active(self) -> bool:
+        return self.enabled and getattr(settings, "STATOR_DISPATCH", False)
+
+    def add(self, model, pk):
+        """
+        Queues a committed row to be run, unless too much is queued already.
+        """
+        with self.lock:
+            if sum(len(pks) for pks in self.pending.values()) >= self.max_pending:
+                return
+            if model in self.pending:
+                self.pending[model].add(pk)
+                return
+            self.pending[model] = {pk}
+            if self.executor is None:
+                from stator.runner import ConnectionClosingExecutor
+
+                self.executor = ConnectionClosingExecutor(
+                    max_workers=getattr(settings, "STATOR_DISPATCH_CONCURRENCY", 4),
+                    thread_name_prefix="stator-dispatch",
+                )
+        self.executor.submit(self.drain, model)
+
+    def drain(self, model):
+        """
+        Claims everything queued for the model, and starts a job for each
+        row (or batch of rows, for batch states).
+        """
+        with self.lock:
+            pks = self.pending.pop(model, set())
+        started: set = set()
+        instances = []
+        try:
+            # Rows that have moved on to other states since are the runners'
+            instances = model.transition_get_with_lock(
+                number=len(pks),
+                lock_expiry=timezone.now()
+                + datetime.timedelta(seconds=self.lock_expiry),
+                runner_id=self.runner_id,
+                states=list(model.state_graph.dispatch_states),
+                pks=list(pks),
+            )
+            batches: dict[str, list] = {}
+            for instance in instances:
+                state = model.state_graph.states[instance.state]
+                if not state.batch_size:
+                    self.start(model, [instance])
+                    started.add(instance.pk)
+                    continue
+                batch = batches.setdefault(state.name, [])
+                batch.append(instance)
+                if len(batch) >= state.batch_size:
+                    self.start(model, batches.pop(state.name))
+                    started.update(instance.pk for instance in batch)
+            for batch in batches.values():
+                self.start(model, batch)
+                started.update(instance.pk for instance in batch)
+        except Exception:
+            logger.exception(f"Error dispatching {model._meta.label_lower}")
+            # Hand anything we claimed but couldn't start back to the runners
+            unstarted = [
+                instance.pk for instance in instances if instance.pk not in started
+            ]
+            if unstarted:
+                model.transition_release_locks(self.runner_id, pks=unstarted)
+
+    def start(self, model, instances: list):
+        """
+        Starts a job running the claimed instances, keeping their leases
+        renewed until it's done.
+        """
+        with self.lock:
+            self.claimed[model] = self.claimed.get(model, 0) + 1
+            if self.renewer is None:
+                self.renewer = threading.Thread(
+                    target=self.renew_leases, name="stator-dispatch-leases", daemon=True
+                )
+                self.renewer.start()
+        try:
+            self.executor.submit(self.run, model, instances)
+        except BaseException:
+            self.finished(model)
+            raise
+
+    def run(self, model, instances: list):
+        """
+        Runs a transition (or a batch of them) for claimed instances.
+        """
+        from stator.runner import task_transition, task_transition_batch
+
+        try:
+            if model.state_graph.states[instances[0].state].batch_size:
+                task_transition_batch(instances, in_thread=False)
+            else:
+                task_transition(instances[0], in_thread=False)
+        except Exception:
+            logger.exception(f"Error dispatching {model._meta.label_lower}")
+        finally:
+            # Anything it didn't finish goes straight back to the runners
+            # rather than waiting for its lease to expire
+            try:
+                model.transition_release_locks(
+                    self.runner_id, pks=[instance.pk for instance in instances]
+                )
+            finally:
+                self.finished(model)
+            self.flush_metrics()
+
+    def finished(self, model):
+        with self.lock:
+            self.claimed[model] -= 1
+            if not self.claimed[model]:
+                del self.claimed[model]
+
+    def renew_leases(self):
+        """
+        Extends our locks on everything we've claimed, for as long as we have
+        claimed jobs waiting or running.
+        """
+        while True:
+            stopped = self.stopped.wait(self.lock_expiry / 3)
+            with self.lock:
+                models = list(self.claimed)
+                if stopped or not models:
+                    self.renewer = None
+                    break
+            lock_expiry = timezone.now() + datetime.timedelta(seconds=self.lock_expiry)
+            try:
+                for model in models:
+                    model.transition_renew_locks(self.runner_id, lock_expiry)
+            except Exception:
+                logger.exception("Error renewing dispatched leases")
+        close_old_connections()
+
+    def shutdown(self):
+        """
+        Waits for dispatched work to finish and stops the thread pool.
+        """
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+        renewer = self.renewer
+        if renewer:
+            self.stopped.set()
+            renewer.join()
+            self.stopped.clear()
+
+    def flush_metrics(self):
+        """
+        Writes out handler metrics every so often, as there's no runner
+        scheduling loop here to do it.
+        """
+        if time.monotonic() - self.metrics_flushed >= self.metrics_interval:
+            self.metrics_flushed = time.monotonic()
+            metrics.recorder.flush()
+
+
+# The dispatcher shared by everything in this process
+dispatcher = Dispatcher()
+
+
+def dispatch_on_commit(model, pk):
+    """
+    Runs the row in this process once the current transaction commits, if
+    dispatch is enabled.
+    """
+    if dispatcher.active:
+        transaction.on_commit(lambda: dispatcher.add(model, pk))
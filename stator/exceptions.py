@@ -1,5 +1,18 @@
 class TryAgainLater(BaseException):
     """
     Special exception that Stator will catch without error,
-    leaving a state to have another attempt soon.
+    leaving a state to have another attempt soon (or in `delay` seconds, if
+    given, rather than after the state's usual retry interval).
+    """
+
+    def __init__(self, delay: float | None = None):
+        super().__init__(delay)
+        self.delay = delay
+
+
+class HandlerTimeout(BaseException):
+    """
+    Raised out of a coroutine state handler that has been cancelled for
+    running longer than it is allowed to. It's a BaseException so that
+    handlers catching Exception don't swallow it.
     """
@@ -1,6 +1,16 @@
-from collections.abc import Callable
+import asyncio
+import logging
+import random
+from collections.abc import Awaitable, Callable
 from typing import Any, ClassVar
 
+from asgiref.sync import iscoroutinefunction
+
+from stator import metrics
+from stator.exceptions import TryAgainLater
+
+logger = logging.getLogger(__name__)
+
 
 class StateGraph:
     """
@@ -14,6 +24,7 @@ class StateGraph:
     terminal_states: ClassVar[set["State"]]
     automatic_states: ClassVar[set["State"]]
     deletion_states: ClassVar[set["State"]]
+    dispatch_states: ClassVar[set["State"]]
 
     def __init_subclass__(cls) -> None:
         # Collect state members
@@ -73,11 +84,31 @@ class StateGraph:
                         raise ValueError(
                             f"State '{state}' has no try_interval and is not terminal or manual"
                         )
-                    try:
-                        state.handler
-                    except AttributeError:
+                    if state.batch_size:
+                        try:
+                            handler = state.batch_handler
+                        except AttributeError:
+                            raise ValueError(
+                                f"State '{state}' does not have a batch handler method ({state.batch_handler_name})"
+                            )
+                    else:
+                        try:
+                            handler = state.handler
+                        except AttributeError:
+                            raise ValueError(
+                                f"State '{state}' does not have a handler method ({state.handler_name})"
+                            )
+                    # Coroutines go in the separate async handler, so the
+                    # threaded runner never needs an event loop
+                    if iscoroutinefunction(handler):
+                        raise ValueError(
+                            f"State '{state}' handler must not be a coroutine; name it a{handler.__name__}"
+                        )
+                    if state.async_handler and not iscoroutinefunction(
+                        state.async_handler
+                    ):
                         raise ValueError(
-                            f"State '{state}' does not have a handler method ({state.handler_name})"
+                            f"State '{state}' async handler must be a coroutine"
                         )
                     automatic_states.add(state)
         if initial_state is None:
@@ -86,9 +117,61 @@ class StateGraph:
         cls.terminal_states = terminal_states
         cls.automatic_states = automatic_states
         cls.deletion_states = deletion_states
+        cls.dispatch_states = {state for state in automatic_states if state.dispatch}
         # Generate choices
         cls.choices = [(name, name) for name in cls.states.keys()]
 
+    @classmethod
+    def handle_each(
+        cls, handler: Callable[[Any], Any], instances: list[Any]
+    ) -> dict[Any, Any]:
+        """
+        Helper for batch handlers that runs a single-instance handler on each
+        instance in turn, so one failure doesn't take the rest of the batch
+        with it. Returns a dict of {instance pk: next state (or None)}.
+        """
+        results = {}
+        for instance in instances:
+            try:
+                results[instance.pk] = handler(instance)
+            except TryAgainLater as e:
+                instance.state_retry_delay = e.delay
+                results[instance.pk] = None
+            except Exception as e:
+                logger.exception(e)
+                metrics.recorder.fail(instance._meta.label_lower, instance.state)
+                results[instance.pk] = None
+        return results
+
+    @classmethod
+    async def ahandle_each(
+        cls,
+        handler: Callable[[Any], Awaitable[Any]],
+        instances: list[Any],
+        concurrency: int,
+    ) -> dict[Any, Any]:
+        """
+        Like handle_each, but for coroutine handlers, running up to
+        `concurrency` of them at once.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        results = {}
+
+        async def handle(instance):
+            async with semaphore:
+                try:
+                    results[instance.pk] = await handler(instance)
+                except TryAgainLater as e:
+                    instance.state_retry_delay = e.delay
+                    results[instance.pk] = None
+                except Exception as e:
+                    logger.exception(e)
+                    metrics.recorder.fail(instance._meta.label_lower, instance.state)
+                    results[instance.pk] = None
+
+        await asyncio.gather(*(handle(instance) for instance in instances))
+        return results
+
 
 class State:
     """
@@ -103,6 +186,14 @@ class State:
         attempt_immediately: bool = True,
         force_initial: bool = False,
         delete_after: int | None = None,
+        batch_size: int | None = None,
+        batch_handler_name: str | None = None,
+        backoff_multiplier: float = 1,
+        backoff_cap: float | None = None,
+        backoff_jitter: float = 0,
+        priority: float = 1,
+        handler_timeout: float | None = None,
+        dispatch: bool = False,
     ):
         self.try_interval = try_interval
         self.handler_name = handler_name
@@ -110,6 +201,24 @@ class State:
         self.attempt_immediately = attempt_immediately
         self.force_initial = force_initial
         self.delete_after = delete_after
+        # Batch states are handled up to batch_size instances at a time
+        self.batch_size = batch_size
+        self.batch_handler_name = batch_handler_name
+        # Retries wait try_interval * backoff_multiplier ** attempts (up to
+        # backoff_cap), randomly adjusted by up to +/- backoff_jitter of that
+        self.backoff_multiplier = backoff_multiplier
+        self.backoff_cap = backoff_cap
+        self.backoff_jitter = backoff_jitter
+        # Runners share their capacity between states in proportion to this
+        # (times their model's PRIORITY)
+        self.priority = priority
+        # How long the handler may run before it's interrupted (if not set,
+        # the STATOR_HANDLER_TIMEOUT setting applies)
+        self.handler_timeout = handler_timeout
+        # Whether rows arriving in this state are run by the process that
+        # committed them (with STATOR_DISPATCH on) rather than left for the
+        # runners; only worth it for quick work someone is waiting to see
+        self.dispatch = dispatch
         # Deletes are also only attempted on try_intervals
         if self.delete_after and not self.try_interval:
             self.try_interval = self.delete_after
@@ -124,6 +233,8 @@ class State:
         self.graph.states[name] = self
         if self.handler_name is None:
             self.handler_name = f"handle_{self.name}"
+        if self.batch_handler_name is None:
+            self.batch_handler_name = f"handle_{self.name}_batch"
 
     def __repr__(self):
         return f"<State {self.name}>"
@@ -165,3 +276,36 @@ class State:
         if self.handler_name is None:
             raise AttributeError("No handler defined")
         return getattr(self.graph, self.handler_name)
+
+    def retry_delay(self, attempts: int) -> float:
+        """
+        Returns how many seconds to wait before trying again, given how many
+        attempts have already failed in this state.
+        """
+        delay = self.try_interval * self.backoff_multiplier**attempts  # type: ignore
+        if self.backoff_cap is not None:
+            delay = min(delay, self.backoff_cap)
+        if self.backoff_jitter:
+            delay *= random.uniform(1 - self.backoff_jitter, 1 + self.backoff_jitter)
+        return delay
+
+    @property
+    def batch_handler(self) -> Callable[[list[Any]], dict[Any, str | None]]:
+        """
+        For batch states, the handler that takes a list of instances and
+        returns a dict of {instance pk: next state (or None)}.
+        """
+        if not self.batch_size or self.batch_handler_name is None:
+            raise AttributeError("Not a batch state")
+        return getattr(self.graph, self.batch_handler_name)
+
+    @property
+    def async_handler(self) -> Callable[..., Awaitable[Any]] | None:
+        """
+        The coroutine version of the handler (or batch handler, for batch
+        states), if the graph has one: a method named like it with an "a" in
+        front. The asyncio runner awaits it instead of running the handler
+        in its thread pool.
+        """
+        name = self.batch_handler_name if self.batch_size else self.handler_name
+        return getattr(self.graph, f"a{name}", None)
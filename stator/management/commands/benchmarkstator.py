@@ -0,0 +1,134 @@
+import datetime
+import multiprocessing
+import queue
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from stator.models import StatorModel
+
+
+def claim_worker(model_label: str, batch: int, duration: float, results):
+    """
+    Claims batches of ready rows, committing each claim just like a real
+    runner, until there are none left or the time is up. The claimed rows
+    are unlocked again afterwards so the benchmark leaves no trace.
+    """
+    model = apps.get_model(model_label)
+    runner_id = f"benchmark-{multiprocessing.current_process().name}"
+    claimed = 0
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        instances = model.transition_get_with_lock(
+            number=batch,
+            lock_expiry=timezone.now() + datetime.timedelta(seconds=300),
+            runner_id=runner_id,
+        )
+        if not instances:
+            break
+        claimed += len(instances)
+    elapsed = time.monotonic() - started
+    model.objects.filter(state_locked_by=runner_id).update(
+        state_locked_until=None,
+        state_locked_by=None,
+    )
+    results.put((runner_id, claimed, elapsed))
+
+
+class Command(BaseCommand):
+    help = "Measures how fast concurrent Stator runners can claim ready rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--runners",
+            "-n",
+            type=int,
+            default=4,
+            help="How many claiming processes to run at once",
+        )
+        parser.add_argument(
+            "--batch",
+            "-b",
+            type=int,
+            default=15,
+            help="How many rows each claim asks for",
+        )
+        parser.add_argument(
+            "--duration",
+            "-d",
+            type=float,
+            default=10,
+            help="Maximum number of seconds each runner claims for",
+        )
+        parser.add_argument("model_label", type=str)
+
+    def handle(
+        self,
+        model_label: str,
+        runners: int,
+        batch: int,
+        duration: float,
+        *args,
+        **options,
+    ):
+        model = apps.get_model(model_label)
+        if not issubclass(model, StatorModel):
+            raise CommandError(f"{model_label} is not a Stator model")
+        ready = model.transition_ready_count()
+        self.stdout.write(f"{model._meta.label_lower}: {ready} rows ready")
+        # Child processes must open their own database connections
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=claim_worker,
+                args=(model._meta.label_lower, batch, duration, results),
+                name=f"runner{i}",
+            )
+            for i in range(runners)
+        ]
+        started = time.monotonic()
+        for process in processes:
+            process.start()
+        # Don't wait forever on a runner that crashed (or hung)
+        outcomes = []
+        deadline = started + duration + 60
+        while len(outcomes) < len(processes):
+            try:
+                outcomes.append(results.get(timeout=1))
+            except queue.Empty:
+                crashed = [
+                    process.name
+                    for process in processes
+                    if process.exitcode not in [None, 0]
+                ]
+                if crashed or time.monotonic() > deadline:
+                    for process in processes:
+                        process.terminate()
+                    problem = (
+                        f"Runners crashed: {', '.join(crashed)}"
+                        if crashed
+                        else "Runners did not finish in time"
+                    )
+                    raise CommandError(
+                        f"{problem} (rows they claimed stay locked until their "
+                        "locks expire)"
+                    )
+        for process in processes:
+            process.join()
+        elapsed = time.monotonic() - started
+        total = 0
+        for runner_id, claimed, runner_elapsed in sorted(outcomes):
+            total += claimed
+            self.stdout.write(
+                f"{runner_id}: {claimed} claimed in {runner_elapsed:.2f}s "
+                f"({claimed / max(runner_elapsed, 0.001):.0f}/s)"
+            )
+        self.stdout.write(
+            f"Total: {total} claimed by {runners} runners in {elapsed:.2f}s "
+            f"({total / max(elapsed, 0.001):.0f}/s)"
+        )
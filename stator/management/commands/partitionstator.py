@@ -0,0 +1,70 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from stator import partitions
+from stator.models import StatorModel
+
+
+class Command(BaseCommand):
+    help = "Converts Stator tables to or from daily partitions, and maintains them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert",
+            action="store_true",
+            help="Convert the tables to be partitioned (locks them while copying)",
+        )
+        parser.add_argument(
+            "--unconvert",
+            action="store_true",
+            help="Convert partitioned tables back to normal ones",
+        )
+        parser.add_argument(
+            "--days-ahead",
+            type=int,
+            default=partitions.DAYS_AHEAD,
+            help="How many days of future partitions to create",
+        )
+        parser.add_argument(
+            "model_labels",
+            nargs="*",
+            type=str,
+            help="Models to work on (defaults to all that support partitioning)",
+        )
+
+    def handle(
+        self,
+        model_labels: list[str],
+        convert: bool,
+        unconvert: bool,
+        days_ahead: int,
+        *args,
+        **options,
+    ):
+        if convert and unconvert:
+            raise CommandError("Pick one of --convert and --unconvert")
+        if model_labels:
+            models = [apps.get_model(label) for label in model_labels]
+        else:
+            models = [
+                model for model in StatorModel.subclasses if model.PARTITION_FIELD
+            ]
+        for model in models:
+            label = model._meta.label_lower
+            if not model.PARTITION_FIELD:
+                raise CommandError(f"{label} does not support partitioning")
+            if convert and not partitions.is_partitioned(model):
+                self.stdout.write(f"{label}: Converting to partitions...")
+                partitions.partition_table(model, days_ahead=days_ahead)
+            elif unconvert and partitions.is_partitioned(model):
+                self.stdout.write(f"{label}: Converting back to one table...")
+                partitions.unpartition_table(model)
+            if not partitions.is_partitioned(model):
+                self.stdout.write(f"{label}: Not partitioned")
+                continue
+            created = partitions.ensure_partitions(model, days_ahead=days_ahead)
+            dropped = model.transition_delete_due()
+            self.stdout.write(
+                f"{label}: {len(partitions.list_partitions(model))} partitions "
+                f"({len(created)} created, {dropped} expired rows dropped)"
+            )
@@ -0,0 +1,97 @@
+import datetime
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.utils import timezone
+
+from stator.models import StatorProfile, StatorSlowTask
+
+
+class Command(BaseCommand):
+    help = "Shows where Stator handlers have been spending their time (needs STATOR_PROFILE)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=24,
+            help="How many hours back to look",
+        )
+        parser.add_argument(
+            "--limit",
+            "-n",
+            type=int,
+            default=10,
+            help="How many entries to show in each list",
+        )
+        parser.add_argument(
+            "--collapsed",
+            action="store_true",
+            help="Print every sampled stack in collapsed format, for flamegraph tools",
+        )
+        parser.add_argument(
+            "model_label",
+            nargs="?",
+            type=str,
+            help="Only show this model",
+        )
+
+    def handle(
+        self,
+        hours: int,
+        limit: int,
+        collapsed: bool,
+        model_label: str | None,
+        *args,
+        **options,
+    ):
+        since = timezone.now() - datetime.timedelta(hours=hours)
+        stacks = StatorProfile.objects.filter(
+            kind=StatorProfile.Kinds.stack, start__gte=since
+        )
+        if model_label:
+            stacks = stacks.filter(model_label=model_label)
+        stacks = (
+            stacks.values("model_label", "state", "key")
+            .annotate(count=models.Sum("count"), duration=models.Sum("duration"))
+            .order_by()
+        )
+        if collapsed:
+            for row in stacks:
+                handler = f"{row['model_label']}.{row['state']}"
+                self.stdout.write(f"{handler};{row['key']} {row['count']}")
+            return
+
+        # Time per handler, and per function the handler was actually in
+        handlers: Counter[str] = Counter()
+        functions: Counter[tuple[str, str]] = Counter()
+        for row in stacks:
+            handler = f"{row['model_label']}.{row['state']}"
+            handlers[handler] += row["duration"]
+            functions[(handler, row["key"].rsplit(";", 1)[-1])] += row["duration"]
+        self.stdout.write(f"Hottest handlers (sampled, last {hours} hours):")
+        for handler, duration in handlers.most_common(limit):
+            self.stdout.write(f"  {duration:10.1f}s  {handler}")
+        self.stdout.write("Hottest functions:")
+        for (handler, function), duration in functions.most_common(limit):
+            self.stdout.write(f"  {duration:10.1f}s  {handler}: {function}")
+
+        self.stdout.write("Hottest queries:")
+        for row in StatorProfile.hottest(
+            StatorProfile.Kinds.query, since, model_label=model_label, limit=limit
+        ):
+            self.stdout.write(
+                f"  {row['duration']:10.1f}s  {row['count']:>8}x  "
+                f"{row['model_label']}.{row['state']}: {row['key']}"
+            )
+
+        slow_tasks = StatorSlowTask.objects.filter(created__gte=since)
+        if model_label:
+            slow_tasks = slow_tasks.filter(model_label=model_label)
+        self.stdout.write("Slowest tasks:")
+        for task in slow_tasks.order_by("-duration")[:limit]:
+            self.stdout.write(
+                f"  {task.duration:10.1f}s  {task.model_label}.{task.state} "
+                f"{', '.join(task.pks)} ({len(task.queries)} queries, #{task.pk})"
+            )
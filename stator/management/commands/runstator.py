@@ -2,11 +2,13 @@ import logging
 from typing import cast
 
 from django.apps import apps
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from core.models import Config
+from stator import dispatch
 from stator.models import StatorModel
-from stator.runner import StatorRunner
+from stator.runner import AsyncStatorRunner, StatorRunner
+from stator.supervisor import StatorSupervisor
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +24,18 @@ class Command(BaseCommand):
             default=15,
             help="How many tasks to run at once",
         )
+        parser.add_argument(
+            "--concurrency-min",
+            type=int,
+            default=None,
+            help="The fewest tasks to run at once when adapting concurrency",
+        )
+        parser.add_argument(
+            "--concurrency-max",
+            type=int,
+            default=None,
+            help="The most tasks to run at once; enables adapting concurrency to load",
+        )
         parser.add_argument(
             "--liveness-file",
             type=str,
@@ -42,6 +56,36 @@ class Command(BaseCommand):
             default=0,
             help="How long to run for before exiting (defaults to infinite)",
         )
+        parser.add_argument(
+            "--processes",
+            "-p",
+            type=int,
+            default=1,
+            help="How many runner processes to run, each with its own share of the work",
+        )
+        parser.add_argument(
+            "--shard",
+            type=str,
+            default=None,
+            help="Only claim work in shard i of n, given as i/n (e.g. 0/4)",
+        )
+        parser.add_argument(
+            "--runner-id",
+            type=str,
+            default=None,
+            help="A stable ID for this runner, so it can take back its locked rows after a crash",
+        )
+        parser.add_argument(
+            "--drain-timeout",
+            type=int,
+            default=25,
+            help="How long to let running tasks finish for after SIGTERM",
+        )
+        parser.add_argument(
+            "--asyncio",
+            action="store_true",
+            help="Run coroutine handlers on an event loop rather than in threads",
+        )
         parser.add_argument(
             "--exclude",
             "-x",
@@ -55,13 +99,21 @@ class Command(BaseCommand):
         self,
         model_labels: list[str],
         concurrency: int,
+        concurrency_min: int | None,
+        concurrency_max: int | None,
         liveness_file: str,
         schedule_interval: int,
         run_for: int,
+        processes: int,
+        shard: str | None,
+        runner_id: str | None,
+        drain_timeout: int,
+        asyncio: bool,
         exclude: list[str],
         *args,
         **options,
     ):
+        shard_spec = self.parse_shard(shard) if shard else None
         # Cache system config
         Config.system = Config.load_system()
         logging.basicConfig(
@@ -85,15 +137,60 @@ class Command(BaseCommand):
         logger.info(
             "Running for models: " + " ".join(m._meta.label_lower for m in models)
         )
-        # Run a runner
-        runner = StatorRunner(
-            models,
-            concurrency=concurrency,
-            liveness_file=liveness_file,
-            schedule_interval=schedule_interval,
-            run_for=run_for,
-        )
+        # Our runners pick up new work quickly enough themselves, so this
+        # process (and any runners it forks) doesn't need to dispatch it too.
+        # This is only done here, as runners can also run inside web workers
+        dispatch.dispatcher.enabled = False
+        # Run a runner (or several)
+        runner_class = AsyncStatorRunner if asyncio else StatorRunner
+        # Only override the settings' concurrency bounds if given
+        bounds = {
+            name: value
+            for name, value in [
+                ("concurrency_min", concurrency_min),
+                ("concurrency_max", concurrency_max),
+            ]
+            if value is not None
+        }
+        if processes > 1:
+            runner = StatorSupervisor(
+                models,
+                processes=processes,
+                runner_class=runner_class,
+                concurrency=concurrency,
+                liveness_file=liveness_file,
+                schedule_interval=schedule_interval,
+                run_for=run_for,
+                runner_id=runner_id,
+                drain_timeout=drain_timeout,
+                shard=shard_spec,
+                **bounds,
+            )
+        else:
+            runner = runner_class(
+                models,
+                concurrency=concurrency,
+                liveness_file=liveness_file,
+                schedule_interval=schedule_interval,
+                run_for=run_for,
+                runner_id=runner_id,
+                drain_timeout=drain_timeout,
+                shard=shard_spec,
+                **bounds,
+            )
         try:
             runner.run()
         except KeyboardInterrupt:
             logger.critical("Ctrl-C received")
+
+    def parse_shard(self, shard: str) -> tuple[int, int]:
+        """
+        Parses a shard given as "i/n" into (i, n).
+        """
+        try:
+            index, count = (int(part) for part in shard.split("/"))
+        except ValueError:
+            raise CommandError(f"Shard must be given as i/n, not {shard!r}")
+        if not 0 <= index < count:
+            raise CommandError(f"Shard index must be between 0 and {count - 1}")
+        return (index, count)
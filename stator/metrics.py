@@ -0,0 +1,213 @@
+import bisect
+import threading
+from collections import defaultdict
+
+from django.db import connection
+from django.utils import timezone
+
+# Upper bounds (in seconds) of the handler duration histogram buckets; the
+# last bucket counts everything slower
+DURATION_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class MetricsRecorder:
+    """
+    Collects handler metrics in memory, from any thread, until the runner
+    flushes them into StatorMetric on its scheduling loop.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.handled: dict[tuple[str, str], int] = defaultdict(int)
+        self.failed: dict[tuple[str, str], int] = defaultdict(int)
+        self.timed_out: dict[tuple[str, str], int] = defaultdict(int)
+        self.duration_sum: dict[tuple[str, str], float] = defaultdict(float)
+        self.duration_buckets: dict[tuple[str, str], list[int]] = {}
+        self.queued: dict[tuple[str, str], int] = {}
+
+    def observe(self, model_label: str, state: str, duration: float, handled=1):
+        """
+        Records one handler run (which may have handled a whole batch).
+        """
+        key = (model_label, str(state))
+        bucket = bisect.bisect_left(DURATION_BUCKETS, duration)
+        with self.lock:
+            self.handled[key] += handled
+            self.duration_sum[key] += duration
+            buckets = self.duration_buckets.setdefault(
+                key, [0] * (len(DURATION_BUCKETS) + 1)
+            )
+            buckets[bucket] += 1
+
+    def fail(self, model_label: str, state: str, number=1):
+        """
+        Records a handler raising an error (for `number` instances).
+        """
+        with self.lock:
+            self.failed[(model_label, str(state))] += number
+
+    def time_out(self, model_label: str, state: str, number=1):
+        """
+        Records a handler being interrupted for running out of time (for
+        `number` instances).
+        """
+        with self.lock:
+            self.timed_out[(model_label, str(state))] += number
+
+    def set_queued(self, model_label: str, state: str, number: int):
+        """
+        Records how many instances are currently waiting in a state.
+        """
+        with self.lock:
+            self.queued[(model_label, str(state))] = number
+
+    def flush(self):
+        """
+        Adds everything recorded since the last flush to both this hour's
+        rows and the all-time rows, and trims expired hourly rows.
+        """
+        with self.lock:
+            handled, failed, timed_out = self.handled, self.failed, self.timed_out
+            duration_sum, duration_buckets = self.duration_sum, self.duration_buckets
+            queued = self.queued
+            self.reset()
+        from stator.models import StatorMetric
+
+        keys = set(handled) | set(failed) | set(timed_out) | set(queued)
+        if not keys:
+            return
+        now = timezone.now()
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        rows = []
+        for model_label, state in sorted(keys):
+            key = (model_label, state)
+            for start in [hour, StatorMetric.TOTALS_START]:
+                rows.append(
+                    [
+                        model_label,
+                        state,
+                        start,
+                        handled.get(key, 0),
+                        failed.get(key, 0),
+                        timed_out.get(key, 0),
+                        duration_sum.get(key, 0.0),
+                        duration_buckets.get(key, []),
+                        queued.get(key),
+                        now,
+                    ]
+                )
+        table = connection.ops.quote_name(StatorMetric._meta.db_table)
+        # Several runners may be adding to the same rows at once, so this
+        # has to add to them in SQL rather than overwrite them
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"""
+                INSERT INTO {table} AS t (
+                    model_label, state, start, handled, failed, timed_out,
+                    duration_sum, duration_buckets, queued, updated
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s::bigint[], %s, %s)
+                ON CONFLICT (model_label, state, start) DO UPDATE SET
+                    handled = t.handled + EXCLUDED.handled,
+                    failed = t.failed + EXCLUDED.failed,
+                    timed_out = t.timed_out + EXCLUDED.timed_out,
+                    duration_sum = t.duration_sum + EXCLUDED.duration_sum,
+                    duration_buckets = ARRAY(
+                        SELECT COALESCE(a, 0) + COALESCE(b, 0)
+                        FROM unnest(t.duration_buckets, EXCLUDED.duration_buckets)
+                        WITH ORDINALITY AS x(a, b, i)
+                        ORDER BY i
+                    ),
+                    queued = COALESCE(EXCLUDED.queued, t.queued),
+                    updated = EXCLUDED.updated
+                """,
+                rows,
+            )
+        StatorMetric.objects.filter(
+            start__gt=StatorMetric.TOTALS_START,
+            start__lt=now - StatorMetric.RETENTION,
+        ).delete()
+
+
+# The recorder shared by everything in this process
+recorder = MetricsRecorder()
+
+
+def escape_label(value: str) -> str:
+    """
+    Escapes a label value for the text exposition formats.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics(openmetrics: bool = False) -> str:
+    """
+    Renders the all-time metrics in the Prometheus text format, or in
+    OpenMetrics if requested.
+    """
+    from stator.models import StatorMetric
+
+    families: dict[str, tuple[str, str, list[str]]] = {
+        "stator_handled": ("counter", "Instances handled by Stator", []),
+        "stator_failed": ("counter", "Stator handlers that raised an error", []),
+        "stator_timed_out": (
+            "counter",
+            "Stator handlers interrupted for running out of time",
+            [],
+        ),
+        "stator_handler_duration_seconds": (
+            "histogram",
+            "How long Stator handlers took to run",
+            [],
+        ),
+        "stator_queued": ("gauge", "Instances waiting to be handled", []),
+    }
+    for metric in StatorMetric.objects.filter(start=StatorMetric.TOTALS_START).order_by(
+        "model_label", "state"
+    ):
+        labels = (
+            f'model="{escape_label(metric.model_label)}",'
+            f'state="{escape_label(metric.state)}"'
+        )
+        families["stator_handled"][2].append(
+            f"stator_handled_total{{{labels}}} {metric.handled}"
+        )
+        families["stator_failed"][2].append(
+            f"stator_failed_total{{{labels}}} {metric.failed}"
+        )
+        families["stator_timed_out"][2].append(
+            f"stator_timed_out_total{{{labels}}} {metric.timed_out}"
+        )
+        durations = families["stator_handler_duration_seconds"][2]
+        count = 0
+        bounds = [*DURATION_BUCKETS, "+Inf"]
+        for bound, number in zip(
+            bounds,
+            metric.duration_buckets or [0] * len(bounds),
+        ):
+            count += number
+            durations.append(
+                f'stator_handler_duration_seconds_bucket{{{labels},le="{bound}"}} {count}'
+            )
+        durations.append(
+            f"stator_handler_duration_seconds_sum{{{labels}}} {metric.duration_sum}"
+        )
+        durations.append(f"stator_handler_duration_seconds_count{{{labels}}} {count}")
+        if metric.queued is not None:
+            families["stator_queued"][2].append(
+                f"stator_queued{{{labels}}} {metric.queued}"
+            )
+    lines = []
+    for name, (metric_type, help_text, samples) in families.items():
+        # Prometheus' own format wants the _total suffix on counter names
+        if metric_type == "counter" and not openmetrics:
+            name = f"{name}_total"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(samples)
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
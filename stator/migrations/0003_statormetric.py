@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:56
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("stator", "0002_stats_delete_statorerror"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatorMetric",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_label", models.CharField(max_length=200)),
+                ("state", models.CharField(max_length=100)),
+                ("start", models.DateTimeField()),
+                ("handled", models.BigIntegerField(default=0)),
+                ("failed", models.BigIntegerField(default=0)),
+                ("duration_sum", models.FloatField(default=0)),
+                (
+                    "duration_buckets",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.BigIntegerField(), default=list, size=None
+                    ),
+                ),
+                ("queued", models.IntegerField(blank=True, null=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.DeleteModel(
+            name="Stats",
+        ),
+        migrations.AddConstraint(
+            model_name="statormetric",
+            constraint=models.UniqueConstraint(
+                fields=("model_label", "state", "start"), name="stator_metric_unique"
+            ),
+        ),
+    ]
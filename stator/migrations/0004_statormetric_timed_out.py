@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("stator", "0003_statormetric"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="statormetric",
+            name="timed_out",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:33
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("stator", "0004_statormetric_timed_out"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatorProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_label", models.CharField(max_length=200)),
+                ("state", models.CharField(max_length=100)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("stack", "Stack"), ("query", "Query")], max_length=10
+                    ),
+                ),
+                ("key", models.TextField()),
+                ("digest", models.CharField(max_length=32)),
+                ("start", models.DateTimeField()),
+                ("count", models.BigIntegerField(default=0)),
+                ("duration", models.FloatField(default=0)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("model_label", "state", "kind", "digest", "start"),
+                        name="stator_profile_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="StatorSlowTask",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_label", models.CharField(max_length=200)),
+                ("state", models.CharField(max_length=100)),
+                (
+                    "pks",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.TextField(), default=list, size=None
+                    ),
+                ),
+                ("duration", models.FloatField()),
+                ("samples", models.JSONField(default=dict)),
+                ("queries", models.JSONField(default=list)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["created"], name="stator_slow_created")
+                ],
+            },
+        ),
+    ]
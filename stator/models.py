@@ -1,14 +1,22 @@
+import asyncio
 import datetime
+import json
 import logging
-from typing import ClassVar
+from concurrent.futures import Executor
+from functools import partial
+from typing import ClassVar, Literal
 
-from asgiref.sync import async_to_sync, iscoroutinefunction
-from django.db import models, transaction
-from django.db.models.signals import class_prepared
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.db import connection, models, transaction
+from django.db.models.functions import Cast
+from django.db.models.signals import class_prepared, post_save
 from django.utils import timezone
 from django.utils.functional import classproperty
 
-from stator.exceptions import TryAgainLater
+from stator import dispatch, metrics, partitions, timeouts
+from stator.exceptions import HandlerTimeout, TryAgainLater
 from stator.graph import State, StateGraph
 
 logger = logging.getLogger(__name__)
@@ -44,14 +52,61 @@ def add_stator_indexes(sender, **kwargs):
     Inject Indexes used by StatorModel in to any subclasses. This sidesteps the
     current Django inability to inherit indexes when the Model subclass defines
     its own indexes.
+
+    The indexes are partial, covering only the rows Stator will actually look
+    for - most rows sit in a terminal state forever and don't need to be in
+    them. Their conditions match the filters in transition_get_with_lock,
+    transition_ready_count, transition_clean_locks and transition_delete_q.
+    SHARDED models also get an index of their ready rows by shard hash, for
+    runners that only claim one shard.
     """
     if issubclass(sender, StatorModel):
+        prefix = f"ix_{sender.__name__.lower()[:11]}"
+        graph = sender.state_graph
         indexes = [
             models.Index(
-                fields=["state", "state_next_attempt", "state_locked_until"],
-                name=f"ix_{sender.__name__.lower()[:11]}_state_next",
+                fields=["state_locked_until"],
+                name=f"{prefix}_locked",
+                condition=models.Q(state_locked_until__isnull=False),
             ),
         ]
+        if graph.automatic_states:
+            indexes.append(
+                models.Index(
+                    fields=["state", "state_next_attempt"],
+                    name=f"{prefix}_ready",
+                    condition=models.Q(
+                        state__in=sorted(
+                            state.name for state in graph.automatic_states
+                        ),
+                        state_locked_until__isnull=True,
+                    ),
+                )
+            )
+        if graph.automatic_states and sender.SHARDED:
+            indexes.append(
+                models.Index(
+                    "state",
+                    sender.transition_shard_expression(),
+                    name=f"{prefix}_shard",
+                    condition=models.Q(
+                        state__in=sorted(
+                            state.name for state in graph.automatic_states
+                        ),
+                        state_locked_until__isnull=True,
+                    ),
+                )
+            )
+        if graph.deletion_states:
+            indexes.append(
+                models.Index(
+                    fields=["state", "state_changed"],
+                    name=f"{prefix}_delete",
+                    condition=models.Q(
+                        state__in=sorted(state.name for state in graph.deletion_states)
+                    ),
+                )
+            )
 
         if not sender._meta.indexes:
             # Meta.indexes needs to not be None to trigger Django behaviors
@@ -69,6 +124,62 @@ def add_stator_indexes(sender, **kwargs):
 class_prepared.connect(add_stator_indexes)
 
 
+# Shard hashes are in the range [0, SHARD_HASH_RANGE)
+SHARD_HASH_RANGE = 2**31
+
+# The PostgreSQL NOTIFY channel runners listen on for new work
+NOTIFY_CHANNEL = "stator"
+
+
+def notify_ready(model: type["StatorModel"]):
+    """
+    Tells any listening runners that the model has rows ready to run right
+    now, if notifications are enabled. PostgreSQL only delivers the
+    notification once the current transaction commits (and collapses
+    duplicates within it), so this is safe to call inside atomic blocks.
+    """
+    if not getattr(settings, "STATOR_NOTIFY", False):
+        return
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_notify(%s, %s)",
+            [NOTIFY_CHANNEL, model._meta.label_lower],
+        )
+
+
+def notify_on_save(sender, instance, **kwargs):
+    """
+    Sends a notification (and dispatches it, if enabled) when a StatorModel
+    is saved in a state that should be attempted immediately (most commonly,
+    when it's first created).
+    """
+    if (
+        isinstance(instance, StatorModel)
+        and instance.state_next_attempt is None
+        and instance.state_locked_until is None
+    ):
+        state = sender.state_graph.states[str(instance.state)]
+        if state in sender.state_graph.automatic_states:
+            notify_ready(sender)
+        if state in sender.state_graph.dispatch_states:
+            dispatch.dispatch_on_commit(sender, instance.pk)
+
+
+post_save.connect(notify_on_save)
+
+
+def database_sync_to_async(function):
+    """
+    Wraps a synchronous function (usually one that uses the database) for
+    async handlers to await. Unlike plain sync_to_async, it runs in the
+    event loop's default executor, which the asyncio runner makes its own
+    bounded thread pool, rather than all going through one shared thread.
+    """
+    return sync_to_async(function, thread_sensitive=False)
+
+
 class StatorModel(models.Model):
     """
     A model base class that has a state machine backing it, with tasks to work
@@ -80,6 +191,26 @@ class StatorModel(models.Model):
 
     CLEAN_BATCH_SIZE = 1000
     DELETE_BATCH_SIZE = 500
+    CREATE_BATCH_SIZE = 1000
+
+    # The creation timestamp column to partition by day on, for models that
+    # support partitioning (see stator.partitions)
+    PARTITION_FIELD: str | None = None
+
+    # How to count ready instances for metrics: "exact" runs a full COUNT,
+    # "capped" stops counting at QUEUE_COUNT_CAP, and "estimate" asks the
+    # query planner. Can be overridden per model with STATOR_QUEUE_COUNT.
+    QUEUE_COUNT: Literal["exact", "capped", "estimate"] = "exact"
+    QUEUE_COUNT_CAP = 10000
+
+    # If runners will be claiming only one shard of this model's rows at a
+    # time (runstator --shard), index the ready rows by shard hash
+    SHARDED = False
+
+    # How much of a runner's capacity this model gets relative to others
+    # (multiplied by each state's priority). Can be overridden per model with
+    # STATOR_PRIORITY.
+    PRIORITY: float = 1
 
     state: StateField
 
@@ -90,8 +221,13 @@ class StatorModel(models.Model):
     state_next_attempt = models.DateTimeField(blank=True, null=True)
 
     # If a lock is out on this row, when it is locked until
-    # (we don't identify the lock owner, as there's no heartbeats)
-    state_locked_until = models.DateTimeField(null=True, blank=True, db_index=True)
+    state_locked_until = models.DateTimeField(null=True, blank=True)
+
+    # The ID of the runner that currently holds the lock, if any
+    state_locked_by = models.CharField(max_length=100, null=True, blank=True)
+
+    # How many attempts have failed since the state last changed
+    state_attempts = models.PositiveIntegerField(default=0)
 
     # Collection of subclasses of us
     subclasses: ClassVar[list[type["StatorModel"]]] = []
@@ -111,66 +247,292 @@ class StatorModel(models.Model):
     def state_age(self) -> float:
         return (timezone.now() - self.state_changed).total_seconds()
 
+    @classmethod
+    def bulk_create_ready(cls, instances: list["StatorModel"]) -> list["StatorModel"]:
+        """
+        Inserts new instances CREATE_BATCH_SIZE rows at a time, then notifies
+        runners and dispatches them as saving each one would have (bulk
+        inserts don't send post_save).
+        """
+        if not instances:
+            return instances
+        created = cls.objects.bulk_create(instances, batch_size=cls.CREATE_BATCH_SIZE)
+        ready = [
+            instance
+            for instance in created
+            if instance.state_next_attempt is None
+            and instance.state_locked_until is None
+            and cls.state_graph.states[str(instance.state)]
+            in cls.state_graph.automatic_states
+        ]
+        if ready:
+            notify_ready(cls)
+        for instance in ready:
+            if cls.state_graph.states[str(instance.state)].dispatch:
+                dispatch.dispatch_on_commit(cls, instance.pk)
+        return created
+
     @classmethod
     def transition_get_with_lock(
-        cls, number: int, lock_expiry: datetime.datetime
+        cls,
+        number: int,
+        lock_expiry: datetime.datetime,
+        runner_id: str | None = None,
+        shard: tuple[int, int] | None = None,
+        states: list[State] | None = None,
+        pks: list | None = None,
     ) -> list["StatorModel"]:
         """
         Returns up to `number` tasks for execution, having locked them.
+
+        Selection and locking happen in a single UPDATE ... RETURNING whose
+        inner SELECT uses FOR UPDATE SKIP LOCKED, so concurrent runners never
+        wait on each other's row locks - they just claim different rows.
+
+        If `shard` is given as (index, count), only rows whose primary key
+        hashes into that shard's range are returned. If `states` is given, only rows in
+        those (automatic) states are, and if `pks` is given, only rows with
+        those primary keys are.
         """
-        with transaction.atomic():
-            # Query for `number` rows that:
-            #  - Have a next_attempt that's either null or in the past
-            #  - Have one of the states we care about
-            # Then, sort them by next_attempt NULLS FIRST, so that we handle the
-            # rows in a roughly FIFO order.
-            selected = list(
-                cls.objects.filter(
-                    models.Q(state_next_attempt__isnull=True)
-                    | models.Q(state_next_attempt__lte=timezone.now()),
-                    state__in=cls.state_graph.automatic_states,
-                    state_locked_until__isnull=True,
-                )[:number].select_for_update()
+        if number <= 0:
+            return []
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        pk = qn(cls._meta.pk.column)
+        # Query for `number` rows that:
+        #  - Have a next_attempt that's either null or in the past
+        #  - Have one of the states we care about
+        #  - Are not locked by anyone else (including rows another runner is
+        #    claiming right now, which SKIP LOCKED steps over)
+        params = [
+            sorted(
+                state.name for state in (states or cls.state_graph.automatic_states)
+            ),
+            timezone.now(),
+        ]
+        conditions = []
+        if pks is not None:
+            conditions.append(f"AND {pk} = ANY(%s)")
+            params.append(list(pks))
+        if shard:
+            conditions.append(
+                f"AND {cls.transition_shard_sql()} >= %s AND {cls.transition_shard_sql()} < %s"
+            )
+            params.extend(cls.transition_shard_bounds(*shard))
+        params.extend([number, lock_expiry, runner_id])
+        sql = f"""
+            WITH claimed AS MATERIALIZED (
+                SELECT {pk} FROM {table}
+                WHERE state = ANY(%s)
+                AND (state_next_attempt IS NULL OR state_next_attempt <= %s)
+                AND state_locked_until IS NULL
+                {" ".join(conditions)}
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
             )
-            cls.objects.filter(pk__in=[i.pk for i in selected]).update(
-                state_locked_until=lock_expiry
+            UPDATE {table}
+            SET state_locked_until = %s, state_locked_by = %s
+            WHERE {pk} IN (SELECT {pk} FROM claimed)
+            RETURNING *
+        """
+        return list(cls.objects.raw(sql, params))
+
+    @classmethod
+    def transition_shard_expression(cls) -> models.Expression:
+        """
+        Returns the expression whose value decides which shard a row is in: a
+        non-negative 31-bit hash of its primary key. It's hashed as Snowflake
+        IDs and string keys are not evenly spread.
+        """
+        return models.Func(
+            Cast(cls._meta.pk.attname, models.TextField()),
+            function="hashtext",
+            output_field=models.IntegerField(),
+        ).bitand(SHARD_HASH_RANGE - 1)
+
+    @classmethod
+    def transition_shard_sql(cls) -> str:
+        """
+        Returns transition_shard_expression() as raw SQL, written the same
+        way as the shard index so the planner can use it.
+        """
+        pk = connection.ops.quote_name(cls._meta.pk.column)
+        return f"(hashtext(({pk})::text) & {SHARD_HASH_RANGE - 1})"
+
+    @staticmethod
+    def transition_shard_bounds(index: int, count: int) -> tuple[int, int]:
+        """
+        Returns the range of hash values in shard `index` of `count`.
+
+        Shards are contiguous ranges of hash values, rather than hash % count,
+        so a single index serves any number of shards, and when the number
+        changes each new shard only overlaps a couple of old ones.
+        """
+        if not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index}/{count}")
+        return (
+            index * SHARD_HASH_RANGE // count,
+            (index + 1) * SHARD_HASH_RANGE // count,
+        )
+
+    @classmethod
+    def transition_delete_q(cls) -> models.Q | None:
+        """
+        Returns a Q object matching instances that are due to be deleted, or
+        None if the model never deletes anything.
+        """
+        if not cls.state_graph.deletion_states:
+            return None
+        constraints = models.Q()
+        for state in cls.state_graph.deletion_states:
+            constraints |= models.Q(
+                state=state,
+                state_changed__lte=(
+                    timezone.now() - datetime.timedelta(seconds=state.delete_after)
+                ),
             )
-        return selected
+        return constraints & (
+            models.Q(state_next_attempt__isnull=True)
+            | models.Q(state_next_attempt__lte=timezone.now())
+        )
 
     @classmethod
     def transition_delete_due(cls) -> int | None:
         """
         Finds instances of this model that need to be deleted and deletes them
         in small batches. Returns how many were deleted.
+
+        Partitioned models instead drop whole partitions once everything in
+        them is due for deletion.
+        """
+        delete_q = cls.transition_delete_q()
+        if delete_q is None:
+            return None
+        if partitions.is_partitioned(cls):
+            return partitions.drop_expired_partitions(cls)
+        select_query = cls.objects.filter(delete_q)[: cls.DELETE_BATCH_SIZE]
+        return cls.objects.filter(pk__in=select_query).delete()[0]
+
+    @classmethod
+    def transition_priority(cls, state: State) -> float:
+        """
+        Returns the scheduling weight of the given state of this model
+        """
+        priority = getattr(settings, "STATOR_PRIORITY", {}).get(
+            cls._meta.label_lower, cls.PRIORITY
+        )
+        return priority * state.priority
+
+    @classmethod
+    def transition_handler_timeout(cls, state: State) -> float | None:
+        """
+        Returns how long the given state's handler may run for
+        """
+        return state.handler_timeout or getattr(
+            settings, "STATOR_HANDLER_TIMEOUT", None
+        )
+
+    @classmethod
+    def transition_timed_out(cls, state: State, handler_timeout, number=1):
+        """
+        Records a handler running out of time
+        """
+        logger.warning(
+            f"{cls._meta.label_lower}: {state} handler timed out after {handler_timeout}s"
+        )
+        metrics.recorder.time_out(cls._meta.label_lower, state, number)
+
+    @classmethod
+    def transition_abandon(
+        cls, state: State, locked_by: str | None, handler_timeout, pks: set
+    ) -> int:
+        """
+        Releases the rows an abandoned handler was working on, if they're
+        still in `state` and locked as it left them, counting it as a failed
+        attempt and backing off as usual. Returns how many it released.
         """
-        if cls.state_graph.deletion_states:
-            constraints = models.Q()
-            for state in cls.state_graph.deletion_states:
-                constraints |= models.Q(
+        now = timezone.now()
+        with transaction.atomic():
+            instances = list(
+                cls.objects.filter(
+                    pk__in=pks,
                     state=state,
-                    state_changed__lte=(
-                        timezone.now() - datetime.timedelta(seconds=state.delete_after)
-                    ),
+                    state_locked_until__isnull=False,
+                    state_locked_by=locked_by,
+                ).select_for_update(skip_locked=True)
+            )
+            for instance in instances:
+                instance.state_next_attempt = now + datetime.timedelta(
+                    seconds=state.retry_delay(instance.state_attempts)
                 )
-            select_query = cls.objects.filter(
-                models.Q(state_next_attempt__isnull=True)
-                | models.Q(state_next_attempt__lte=timezone.now()),
-                constraints,
-            )[: cls.DELETE_BATCH_SIZE]
-            return cls.objects.filter(pk__in=select_query).delete()[0]
-        return None
+                instance.state_attempts += 1
+                instance.state_locked_until = None
+                instance.state_locked_by = None
+            cls.objects.bulk_update(
+                instances,
+                [
+                    "state_next_attempt",
+                    "state_attempts",
+                    "state_locked_until",
+                    "state_locked_by",
+                ],
+            )
+        cls.transition_timed_out(state, handler_timeout, len(pks))
+        return len(instances)
 
     @classmethod
-    def transition_ready_count(cls) -> int:
+    def transition_ready_queryset(cls) -> models.QuerySet:
         """
-        Returns how many instances are "queued"
+        Returns a queryset of instances that are "queued" (ready to be claimed)
         """
         return cls.objects.filter(
             models.Q(state_next_attempt__isnull=True)
             | models.Q(state_next_attempt__lte=timezone.now()),
             state_locked_until__isnull=True,
-            state__in=cls.state_graph.automatic_states,
-        ).count()
+            state__in=sorted(state.name for state in cls.state_graph.automatic_states),
+        )
+
+    @classmethod
+    def transition_ready_count(cls, cap: int | None = None) -> int:
+        """
+        Returns how many instances are "queued", stopping at `cap` if given
+        """
+        if cap:
+            return cls.transition_ready_queryset().order_by()[:cap].count()
+        return cls.transition_ready_queryset().count()
+
+    @classmethod
+    def transition_queue_count_mode(cls) -> str:
+        """
+        Returns how this model's queues should be counted
+        """
+        return getattr(settings, "STATOR_QUEUE_COUNT", {}).get(
+            cls._meta.label_lower, cls.QUEUE_COUNT
+        )
+
+    @classmethod
+    def transition_ready_counts(cls) -> dict[str, int]:
+        """
+        Returns how many instances are "queued" in each automatic state,
+        counted according to transition_queue_count_mode().
+        """
+        mode = cls.transition_queue_count_mode()
+        counts = {state.name: 0 for state in cls.state_graph.automatic_states}
+        ready = cls.transition_ready_queryset().order_by()
+        if mode == "exact":
+            for row in ready.values("state").annotate(count=models.Count("pk")):
+                counts[row["state"]] = row["count"]
+        elif mode == "capped":
+            # Counts a LIMITed subquery, so it stops after the cap
+            for state in counts:
+                counts[state] = ready.filter(state=state)[: cls.QUEUE_COUNT_CAP].count()
+        elif mode == "estimate":
+            for state in counts:
+                plan = json.loads(ready.filter(state=state).explain(format="json"))
+                counts[state] = int(plan[0]["Plan"]["Plan Rows"])
+        else:
+            raise ValueError(f"Unknown queue count mode {mode}")
+        return counts
 
     @classmethod
     def transition_clean_locks(cls):
@@ -180,7 +542,35 @@ class StatorModel(models.Model):
         select_query = cls.objects.filter(state_locked_until__lte=timezone.now())[
             : cls.CLEAN_BATCH_SIZE
         ]
-        cls.objects.filter(pk__in=select_query).update(state_locked_until=None)
+        cls.objects.filter(pk__in=select_query).update(
+            state_locked_until=None,
+            state_locked_by=None,
+        )
+
+    @classmethod
+    def transition_renew_locks(
+        cls, runner_id: str, lock_expiry: datetime.datetime
+    ) -> int:
+        """
+        Extends the locks the runner still holds (its leases on the rows it's
+        working on) until lock_expiry
+        """
+        return cls.objects.filter(
+            state_locked_until__isnull=False, state_locked_by=runner_id
+        ).update(state_locked_until=lock_expiry)
+
+    @classmethod
+    def transition_release_locks(cls, runner_id: str, pks: list | None = None) -> int:
+        """
+        Releases every lock the runner holds (or just those on `pks`), such
+        as ones left behind by a previous run of it that crashed
+        """
+        queryset = cls.objects.filter(
+            state_locked_until__isnull=False, state_locked_by=runner_id
+        )
+        if pks is not None:
+            queryset = queryset.filter(pk__in=pks)
+        return queryset.update(state_locked_until=None, state_locked_by=None)
 
     def transition_attempt(self) -> State | None:
         """
@@ -196,46 +586,283 @@ class StatorModel(models.Model):
             )
             return None
 
+        # Batch states always go through the batch handler, even for one
+        if current_state.batch_size:
+            return self.transition_attempt_batch([self])[self.pk]
+
         # Try running its handler function
+        handler_timeout = self.transition_handler_timeout(current_state)
+        deadline = None
         try:
-            if iscoroutinefunction(current_state.handler):
-                next_state = async_to_sync(current_state.handler)(self)
-            else:
+            with timeouts.deadlines.limit(
+                handler_timeout,
+                self._meta.label_lower,
+                [self.pk],
+                partial(
+                    self.transition_abandon,
+                    current_state,
+                    self.state_locked_by,
+                    handler_timeout,
+                ),
+            ) as deadline:
                 next_state = current_state.handler(self)
-        except TryAgainLater:
-            pass
+        except TryAgainLater as e:
+            self.state_retry_delay = e.delay
+            next_state = None
+        except HandlerTimeout:
+            self.transition_timed_out(current_state, handler_timeout)
+            next_state = None
         except BaseException as e:
             logger.exception(e)
-        else:
+            metrics.recorder.fail(self._meta.label_lower, current_state)
+            next_state = None
+        # If it ran so long it was abandoned, it's already been released to
+        # be tried again (and another runner may have it by now), so leave
+        # it alone
+        if deadline and deadline.abandoned:
+            return None
+        return self.transition_complete(current_state, next_state)
+
+    async def atransition_attempt(
+        self, executor: Executor | None = None
+    ) -> State | None:
+        """
+        Attempts to transition the current state from inside an event loop.
+
+        States with an async handler have it awaited directly on the loop;
+        other handlers, and all of the database work, run in `executor` (or
+        the loop's default executor if not given).
+        """
+        loop = asyncio.get_running_loop()
+        current_state: State = self.state_graph.states[self.state]
+        if current_state.externally_progressed or not current_state.async_handler:
+            return await loop.run_in_executor(executor, self.transition_attempt)
+        if current_state.batch_size:
+            return (await self.atransition_attempt_batch([self], executor))[self.pk]
+
+        handler_timeout = self.transition_handler_timeout(current_state)
+        try:
+            next_state = await timeouts.limit_async(
+                current_state.async_handler(self), handler_timeout
+            )
+        except asyncio.CancelledError:
+            raise
+        except TryAgainLater as e:
+            self.state_retry_delay = e.delay
+            next_state = None
+        except HandlerTimeout:
+            self.transition_timed_out(current_state, handler_timeout)
+            next_state = None
+        except BaseException as e:
+            logger.exception(e)
+            metrics.recorder.fail(self._meta.label_lower, current_state)
+            next_state = None
+        return await loop.run_in_executor(
+            executor, self.transition_complete, current_state, next_state
+        )
+
+    @classmethod
+    async def atransition_attempt_batch(
+        cls, instances: list["StatorModel"], executor: Executor | None = None
+    ) -> dict[object, State | None]:
+        """
+        Attempts to transition a batch of instances from inside an event
+        loop, as atransition_attempt does for one.
+        """
+        loop = asyncio.get_running_loop()
+        current_state: State = cls.state_graph.states[instances[0].state]
+        if current_state.externally_progressed or not current_state.async_handler:
+            return await loop.run_in_executor(
+                executor, cls.transition_attempt_batch, instances
+            )
+        if any(instance.state != current_state.name for instance in instances):
+            raise ValueError("All instances in a batch must be in the same state")
+
+        handler_timeout = cls.transition_handler_timeout(current_state)
+        try:
+            results = await timeouts.limit_async(
+                current_state.async_handler(instances), handler_timeout
+            )
+        except asyncio.CancelledError:
+            raise
+        except TryAgainLater as e:
+            for instance in instances:
+                instance.state_retry_delay = e.delay
+            results = {}
+        except HandlerTimeout:
+            cls.transition_timed_out(current_state, handler_timeout, len(instances))
+            results = {}
+        except BaseException as e:
+            logger.exception(e)
+            metrics.recorder.fail(
+                cls._meta.label_lower, current_state, number=len(instances)
+            )
+            results = {}
+        return await loop.run_in_executor(
+            executor,
+            cls.transition_complete_batch,
+            current_state,
+            instances,
+            results or {},
+        )
+
+    @classmethod
+    def transition_attempt_batch(
+        cls, instances: list["StatorModel"]
+    ) -> dict[object, State | None]:
+        """
+        Attempts to transition several instances, all in the same batch
+        state, with one call to that state's batch handler. Returns a dict
+        of {pk: new state (or None if it did not change)}.
+        """
+        if not instances:
+            return {}
+        current_state: State = cls.state_graph.states[instances[0].state]
+        if any(instance.state != current_state.name for instance in instances):
+            raise ValueError("All instances in a batch must be in the same state")
+        if current_state.externally_progressed:
+            logger.warning(
+                f"Warning: trying to progress externally progressed state {current_state}!"
+            )
+            return {instance.pk: None for instance in instances}
+
+        # Run the batch handler; if it fails, the whole batch tries again later
+        handler_timeout = cls.transition_handler_timeout(current_state)
+        deadline = None
+        try:
+            with timeouts.deadlines.limit(
+                handler_timeout,
+                cls._meta.label_lower,
+                [instance.pk for instance in instances],
+                partial(
+                    cls.transition_abandon,
+                    current_state,
+                    instances[0].state_locked_by,
+                    handler_timeout,
+                ),
+            ) as deadline:
+                results = current_state.batch_handler(instances)
+        except TryAgainLater as e:
+            for instance in instances:
+                instance.state_retry_delay = e.delay
+            results = {}
+        except HandlerTimeout:
+            cls.transition_timed_out(current_state, handler_timeout, len(instances))
+            results = {}
+        except BaseException as e:
+            logger.exception(e)
+            metrics.recorder.fail(
+                cls._meta.label_lower, current_state, number=len(instances)
+            )
+            results = {}
+        if deadline and deadline.abandoned:
+            return {instance.pk: None for instance in instances}
+        return cls.transition_complete_batch(current_state, instances, results or {})
+
+    @classmethod
+    def transition_complete_batch(
+        cls,
+        current_state: State,
+        instances: list["StatorModel"],
+        results: dict[object, State | str | None],
+    ) -> dict[object, State | None]:
+        """
+        Applies the results of running a batch handler, moving instances to
+        their new states in one query per state, and scheduling the next
+        attempt for the rest in another.
+
+        Only rows still locked as they were when claimed are written, so a
+        runner whose lease ran out (and whose rows may have been claimed by
+        another since) can't overwrite the new owner's work.
+        """
+        outcomes: dict[object, State | None] = {}
+        moving: dict[State, list] = {}
+        unchanged = []
+        now = timezone.now()
+        for instance in instances:
+            next_state = results.get(instance.pk)
             if next_state:
                 # Ensure it's a State object
                 if isinstance(next_state, str):
-                    next_state = self.state_graph.states[next_state]
+                    next_state = cls.state_graph.states[next_state]
                 # Ensure it's a child
                 if next_state not in current_state.children:
                     raise ValueError(
                         f"Cannot transition from {current_state} to {next_state} - not a declared transition"
                     )
-                self.transition_perform(next_state)
-                return next_state
-
-        # See if it timed out since its last state change
-        if (
-            current_state.timeout_value
-            and current_state.timeout_value
-            <= (timezone.now() - self.state_changed).total_seconds()
-        ):
-            self.transition_perform(current_state.timeout_state)  # type: ignore
-            return current_state.timeout_state
+            # See if it timed out since its last state change
+            elif (
+                current_state.timeout_value
+                and current_state.timeout_value
+                <= (now - instance.state_changed).total_seconds()
+            ):
+                next_state = current_state.timeout_state
+            if next_state:
+                moving.setdefault(next_state, []).append(instance.pk)
+            else:
+                unchanged.append(instance)
+            outcomes[instance.pk] = next_state
+        # Only write rows still locked as they were when claimed, holding
+        # them while we do
+        with transaction.atomic():
+            locked_by = instances[0].state_locked_by if instances else None
+            owned = set(
+                cls.objects.filter(pk__in=outcomes, state_locked_by=locked_by)
+                .select_for_update()
+                .values_list("pk", flat=True)
+            )
+            if len(owned) < len(outcomes):
+                logger.warning(
+                    f"{cls._meta.label_lower}: {len(outcomes) - len(owned)} items no longer locked by {locked_by}, not saving their results"
+                )
+            for next_state, pks in moving.items():
+                pks = [pk for pk in pks if pk in owned]
+                if pks:
+                    cls.transition_perform_queryset(
+                        cls.objects.filter(pk__in=pks), next_state
+                    )
+            # Nothing happened to the rest, back off their next execution and
+            # unlock them (unless the handler said when to try again, which
+            # doesn't count as a failed attempt)
+            unchanged = [instance for instance in unchanged if instance.pk in owned]
+            for instance in unchanged:
+                retry_delay = getattr(instance, "state_retry_delay", None)
+                if retry_delay is not None:
+                    instance.state_next_attempt = now + datetime.timedelta(
+                        seconds=retry_delay
+                    )
+                else:
+                    instance.state_next_attempt = now + datetime.timedelta(
+                        seconds=current_state.retry_delay(instance.state_attempts)
+                    )
+                    instance.state_attempts += 1
+                instance.state_locked_until = None
+                instance.state_locked_by = None
+            if unchanged:
+                cls.objects.bulk_update(
+                    unchanged,
+                    [
+                        "state_next_attempt",
+                        "state_attempts",
+                        "state_locked_until",
+                        "state_locked_by",
+                    ],
+                )
+        return {
+            pk: next_state if pk in owned else None
+            for pk, next_state in outcomes.items()
+        }
 
-        # Nothing happened, set next execution and unlock it
-        self.__class__.objects.filter(pk=self.pk).update(
-            state_next_attempt=(
-                timezone.now() + datetime.timedelta(seconds=current_state.try_interval)  # type: ignore
-            ),
-            state_locked_until=None,
-        )
-        return None
+    def transition_complete(
+        self, current_state: State, next_state: State | str | None
+    ) -> State | None:
+        """
+        Applies the result of running the current state's handler - moving to
+        the returned state, timing out, or scheduling the next attempt.
+        """
+        return self.transition_complete_batch(
+            current_state, [self], {self.pk: next_state}
+        )[self.pk]
 
     def transition_perform(self, state: State | str):
         """
@@ -245,6 +872,12 @@ class StatorModel(models.Model):
             self.__class__.objects.filter(pk=self.pk),
             state,
         )
+        state_obj = self.state_graph.states[str(state)]
+        if (
+            state_obj.attempt_immediately
+            and state_obj in self.state_graph.dispatch_states
+        ):
+            dispatch.dispatch_on_commit(self.__class__, self.pk)
 
     @classmethod
     def transition_perform_queryset(
@@ -262,12 +895,16 @@ class StatorModel(models.Model):
             state_obj = cls.state_graph.states[state]
         # See if it's ready immediately (if not, delay until first try_interval)
         if state_obj.attempt_immediately or state_obj.try_interval is None:
-            queryset.update(
+            updated = queryset.update(
                 state=state_obj,
                 state_changed=timezone.now(),
                 state_next_attempt=None,
                 state_locked_until=None,
+                state_locked_by=None,
+                state_attempts=0,
             )
+            if updated and state_obj in cls.state_graph.automatic_states:
+                notify_ready(cls)
         else:
             queryset.update(
                 state=state_obj,
@@ -276,125 +913,182 @@ class StatorModel(models.Model):
                     timezone.now() + datetime.timedelta(seconds=state_obj.try_interval)
                 ),
                 state_locked_until=None,
+                state_locked_by=None,
+                state_attempts=0,
             )
 
 
-class Stats(models.Model):
+class StatorMetric(models.Model):
     """
-    Tracks summary statistics of each model over time.
+    Per-model, per-state processing metrics, as one row per hour (kept for
+    RETENTION) plus one all-time row per model and state whose counters only
+    ever go up, for exporting to Prometheus.
     """
 
+    # The start value of the all-time rows
+    TOTALS_START = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+    # How long hourly rows are kept
+    RETENTION = datetime.timedelta(days=62)
     # appname.modelname (lowercased) label for the model this represents
-    model_label = models.CharField(max_length=200, primary_key=True)
+    model_label = models.CharField(max_length=200)
 
-    statistics = models.JSONField()
+    # The state instances were handled from
+    state = models.CharField(max_length=100)
+
+    # Start of the hour this row covers, or TOTALS_START for all time
+    start = models.DateTimeField()
+
+    # How many instances were handled, how many handlers raised an error, and
+    # how many were interrupted for running out of time
+    handled = models.BigIntegerField(default=0)
+    failed = models.BigIntegerField(default=0)
+    timed_out = models.BigIntegerField(default=0)
+
+    # Handler durations, as a sum and a count per metrics.DURATION_BUCKETS
+    # bucket
+    duration_sum = models.FloatField(default=0)
+    duration_buckets = ArrayField(models.BigIntegerField(), default=list)
+
+    # The most recent number of instances waiting in this state
+    queued = models.IntegerField(null=True, blank=True)
 
-    created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
     class Meta:
-        verbose_name_plural = "Stats"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_label", "state", "start"],
+                name="stator_metric_unique",
+            ),
+        ]
 
     @classmethod
-    def get_for_model(cls, model: type[StatorModel]) -> "Stats":
-        instance = cls.objects.filter(model_label=model._meta.label_lower).first()
-        if instance is None:
-            instance = cls(model_label=model._meta.label_lower)
-        if not instance.statistics:
-            instance.statistics = {}
-        # Ensure there are the right keys
-        for key in ["queued", "hourly", "daily", "monthly"]:
-            if key not in instance.statistics:
-                instance.statistics[key] = {}
-        return instance
-
-    def set_queued(self, number: int):
-        """
-        Sets the current queued amount.
-
-        The queue is an instantaneous value (a "gauge") rather than a
-        sum ("counter"). It's mostly used for reporting what things are right
-        now, but basic trend analysis is also used to see if we think the
-        queue is backing up.
-        """
-        self.statistics["queued"][
-            int(timezone.now().replace(second=0, microsecond=0).timestamp())
-        ] = number
-
-    def add_handled(self, number: int):
-        """
-        Adds the "handled" number to the current stats.
-        """
-        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
-        day = hour.replace(hour=0)
-        hour_timestamp = str(int(hour.timestamp()))
-        day_timestamp = str(int(day.timestamp()))
-        month_timestamp = str(int(day.replace(day=1).timestamp()))
-        self.statistics["hourly"][hour_timestamp] = (
-            self.statistics["hourly"].get(hour_timestamp, 0) + number
-        )
-        self.statistics["daily"][day_timestamp] = (
-            self.statistics["daily"].get(day_timestamp, 0) + number
-        )
-        self.statistics["monthly"][month_timestamp] = (
-            self.statistics["monthly"].get(month_timestamp, 0) + number
-        )
-
-    def trim_data(self):
+    def summary_for_model(cls, model: type[StatorModel]) -> dict[str, float]:
         """
-        Removes excessively old data from the field
+        Returns the current queue size (and whether that is approximate),
+        today's and this month's handled counts, today's failed and timed out
+        counts, and today's average handler duration for a model.
         """
-        queued_horizon = int((timezone.now() - datetime.timedelta(hours=2)).timestamp())
-        hourly_horizon = int(
-            (timezone.now() - datetime.timedelta(hours=50)).timestamp()
+        now = timezone.now()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        month = today.replace(day=1)
+        rows = cls.objects.filter(model_label=model._meta.label_lower)
+        totals = rows.filter(start=cls.TOTALS_START).aggregate(
+            queued=models.Sum("queued")
         )
-        daily_horizon = int((timezone.now() - datetime.timedelta(days=62)).timestamp())
-        monthly_horizon = int(
-            (timezone.now() - datetime.timedelta(days=3653)).timestamp()
+        today_totals = rows.filter(start__gte=today).aggregate(
+            handled=models.Sum("handled"),
+            failed=models.Sum("failed"),
+            timed_out=models.Sum("timed_out"),
+            duration_sum=models.Sum("duration_sum"),
         )
-        self.statistics["queued"] = {
-            ts: v
-            for ts, v in self.statistics["queued"].items()
-            if int(ts) >= queued_horizon
-        }
-        self.statistics["hourly"] = {
-            ts: v
-            for ts, v in self.statistics["hourly"].items()
-            if int(ts) >= hourly_horizon
-        }
-        self.statistics["daily"] = {
-            ts: v
-            for ts, v in self.statistics["daily"].items()
-            if int(ts) >= daily_horizon
-        }
-        self.statistics["monthly"] = {
-            ts: v
-            for ts, v in self.statistics["monthly"].items()
-            if int(ts) >= monthly_horizon
+        month_totals = rows.filter(start__gte=month).aggregate(
+            handled=models.Sum("handled")
+        )
+        # Each task is one histogram observation, however many it handled
+        observations = sum(
+            sum(buckets)
+            for buckets in rows.filter(start__gte=today).values_list(
+                "duration_buckets", flat=True
+            )
+        )
+        return {
+            "queued": totals["queued"] or 0,
+            "queued_approximate": model.transition_queue_count_mode() != "exact",
+            "handled_today": today_totals["handled"] or 0,
+            "failed_today": today_totals["failed"] or 0,
+            "timed_out_today": today_totals["timed_out"] or 0,
+            "handled_month": month_totals["handled"] or 0,
+            "average_duration": (
+                (today_totals["duration_sum"] or 0) / observations
+                if observations
+                else 0
+            ),
         }
 
-    def most_recent_queued(self) -> int:
-        """
-        Returns the most recent number of how many were queued
-        """
-        queued = [(int(ts), v) for ts, v in self.statistics["queued"].items()]
-        queued.sort(reverse=True)
-        if queued:
-            return queued[0][1]
-        else:
-            return 0
 
-    def most_recent_handled(self) -> tuple[int, int, int]:
+class StatorProfile(models.Model):
+    """
+    How often each handler was seen in each Python stack by the sampling
+    profiler, and how many times (and for how long) it ran each SQL query,
+    as one row per hour. Only written with STATOR_PROFILE enabled.
+    """
+
+    # How long rows (and slow tasks) are kept
+    RETENTION = datetime.timedelta(days=7)
+
+    class Kinds(models.TextChoices):
+        stack = "stack"
+        query = "query"
+
+    model_label = models.CharField(max_length=200)
+    state = models.CharField(max_length=100)
+    kind = models.CharField(max_length=10, choices=Kinds.choices)
+
+    # The stack (outermost call first, separated by semicolons) or the SQL,
+    # and its MD5 so it can be part of the unique constraint
+    key = models.TextField()
+    digest = models.CharField(max_length=32)
+
+    # Start of the hour this row covers
+    start = models.DateTimeField()
+
+    # How many samples (or query runs) there were, and roughly how much time
+    # they add up to
+    count = models.BigIntegerField(default=0)
+    duration = models.FloatField(default=0)
+
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_label", "state", "kind", "digest", "start"],
+                name="stator_profile_unique",
+            ),
+        ]
+
+    @classmethod
+    def hottest(
+        cls,
+        kind: str,
+        since: datetime.datetime,
+        model_label: str | None = None,
+        limit: int = 10,
+    ) -> list[dict]:
         """
-        Returns the current handling numbers for hour, day, month
+        Returns the stacks or queries with the most time spent in them since
+        the given time, per model and state.
         """
-        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
-        day = hour.replace(hour=0)
-        hour_timestamp = str(int(hour.timestamp()))
-        day_timestamp = str(int(day.timestamp()))
-        month_timestamp = str(int(day.replace(day=1).timestamp()))
-        return (
-            self.statistics["hourly"].get(hour_timestamp, 0),
-            self.statistics["daily"].get(day_timestamp, 0),
-            self.statistics["monthly"].get(month_timestamp, 0),
+        rows = cls.objects.filter(kind=kind, start__gte=since)
+        if model_label:
+            rows = rows.filter(model_label=model_label)
+        return list(
+            rows.values("model_label", "state", "key")
+            .annotate(count=models.Sum("count"), duration=models.Sum("duration"))
+            .order_by("-duration")[:limit]
         )
+
+
+class StatorSlowTask(models.Model):
+    """
+    The stack samples and SQL queries of a transition that took longer than
+    STATOR_PROFILE_SLOW, captured by the profiler.
+    """
+
+    model_label = models.CharField(max_length=200)
+    state = models.CharField(max_length=100)
+
+    # The instances handled (more than one for batch handlers)
+    pks = ArrayField(models.TextField(), default=list)
+
+    duration = models.FloatField()
+
+    # Sample counts per stack, and [sql, seconds] for each query in order
+    samples = models.JSONField(default=dict)
+    queries = models.JSONField(default=list)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["created"], name="stator_slow_created")]
@@ -0,0 +1,79 @@
+"""
+Migration operations for Stator tables that might have been partitioned.
+
+PostgreSQL can't create or drop indexes CONCURRENTLY on a partitioned table,
+so these do it concurrently on normal tables (as Django's versions do) and
+fall back to a plain CREATE/DROP INDEX on tables that `partitionstator` has
+partitioned.
+"""
+
+from django.contrib.postgres import operations
+
+
+def can_index_concurrently(schema_editor, model) -> bool:
+    """
+    Returns if the model's table is an ordinary (not partitioned) one.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return not (row and row[0] == "p")
+
+
+class AddIndexConcurrently(operations.AddIndexConcurrently):
+    """
+    Creates an index concurrently, unless the table is partitioned.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._ensure_not_in_transaction(schema_editor)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(
+                model,
+                self.index,
+                concurrently=can_index_concurrently(schema_editor, model),
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._ensure_not_in_transaction(schema_editor)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(
+                model,
+                self.index,
+                concurrently=can_index_concurrently(schema_editor, model),
+            )
+
+
+class RemoveIndexConcurrently(operations.RemoveIndexConcurrently):
+    """
+    Drops an index concurrently, unless the table is partitioned.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._ensure_not_in_transaction(schema_editor)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            from_model_state = from_state.models[app_label, self.model_name_lower]
+            index = from_model_state.get_index_by_name(self.name)
+            schema_editor.remove_index(
+                model,
+                index,
+                concurrently=can_index_concurrently(schema_editor, model),
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._ensure_not_in_transaction(schema_editor)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            to_model_state = to_state.models[app_label, self.model_name_lower]
+            index = to_model_state.get_index_by_name(self.name)
+            schema_editor.add_index(
+                model,
+                index,
+                concurrently=can_index_concurrently(schema_editor, model),
+            )
@@ -0,0 +1,320 @@
+"""
+Optional daily range partitioning for high-churn Stator tables.
+
+Models opt in by setting PARTITION_FIELD to a creation timestamp column, and
+their tables are then converted (and converted back) with the
+`partitionstator` management command. Once a table is partitioned, Stator
+keeps creating partitions ahead of time and drops whole expired partitions
+instead of deleting their rows one batch at a time. Rows that turn up before
+their day's partition exists (if Stator has been down for a while) go in a
+DEFAULT partition, and are moved out when their partition is made.
+"""
+
+import datetime
+import re
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+# Partitions are named <table>_pYYYYMMDD after the (UTC) day they hold
+PARTITION_SUFFIX = re.compile(r"_p(\d{8})$")
+
+# How many days ahead of today to keep partitions created for
+DAYS_AHEAD = 7
+
+_partitioned: dict[str, bool] = {}
+
+
+def is_partitioned(model) -> bool:
+    """
+    Returns if the model's table is currently partitioned (cached per process;
+    the conversion functions below keep the cache up to date).
+    """
+    label = model._meta.label_lower
+    if label not in _partitioned:
+        if connection.vendor != "postgresql" or not model.PARTITION_FIELD:
+            _partitioned[label] = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT EXISTS(SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+                    [model._meta.db_table],
+                )
+                _partitioned[label] = cursor.fetchone()[0]
+    return _partitioned[label]
+
+
+def day_bounds(day: datetime.date) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    Returns the start and end datetimes of the partition for a day.
+    """
+    start = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.UTC)
+    return start, start + datetime.timedelta(days=1)
+
+
+def list_partitions(model) -> dict[datetime.date, str]:
+    """
+    Returns the model's daily partitions as {day: table name}.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            """,
+            [model._meta.db_table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_SUFFIX.search(name)
+        if match:
+            day = datetime.datetime.strptime(match.group(1), "%Y%m%d").date()
+            partitions[day] = name
+    return partitions
+
+
+def default_partition(model) -> str:
+    """
+    Returns the name of the model's DEFAULT partition.
+    """
+    return f"{model._meta.db_table}_default"
+
+
+def create_default_partition(model) -> bool:
+    """
+    Creates the model's DEFAULT partition, which takes any rows no daily
+    partition covers, if it doesn't exist yet. Returns if it made it.
+    """
+    qn = connection.ops.quote_name
+    name = default_partition(model)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(
+            f"CREATE TABLE {qn(name)} PARTITION OF {qn(model._meta.db_table)} DEFAULT"
+        )
+    return True
+
+
+def create_partitions(model, start: datetime.date, end: datetime.date) -> list[str]:
+    """
+    Creates any missing partitions for the days from start to end inclusive,
+    returning the names of the ones it made.
+
+    Each one is made as a separate table, filled with any of its rows that
+    are waiting in the DEFAULT partition, and then attached; a partition
+    can't be added while the DEFAULT one has rows that belong in it, so
+    the DEFAULT partition is locked against new rows until it's attached.
+    """
+    create_default_partition(model)
+    existing = list_partitions(model)
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    field = qn(model.PARTITION_FIELD)
+    created = []
+    day = start
+    while day <= end:
+        if day not in existing:
+            name = f"{model._meta.db_table}_p{day:%Y%m%d}"
+            lower, upper = day_bounds(day)
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Take the locks the attach needs up front (parent first, as
+                # inserts do) so nothing can be inserted in between
+                cursor.execute(f"LOCK TABLE {table} IN SHARE UPDATE EXCLUSIVE MODE")
+                cursor.execute(
+                    f"LOCK TABLE {qn(default_partition(model))} IN ACCESS EXCLUSIVE MODE"
+                )
+                cursor.execute(
+                    f"CREATE TABLE {qn(name)} (LIKE {table} INCLUDING DEFAULTS "
+                    "INCLUDING CONSTRAINTS)"
+                )
+                cursor.execute(
+                    f"WITH moved AS (DELETE FROM {qn(default_partition(model))} "
+                    f"WHERE {field} >= %s AND {field} < %s RETURNING *) "
+                    f"INSERT INTO {qn(name)} SELECT * FROM moved",
+                    [lower, upper],
+                )
+                cursor.execute(
+                    f"ALTER TABLE {table} ATTACH PARTITION {qn(name)} "
+                    f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+                )
+            created.append(name)
+        day += datetime.timedelta(days=1)
+    return created
+
+
+def ensure_partitions(model, days_ahead: int = DAYS_AHEAD) -> list[str]:
+    """
+    Makes sure partitions exist from today until days_ahead days from now,
+    and for any earlier days that have rows waiting in the DEFAULT partition
+    (which would otherwise never be dropped). This is run both by Stator's
+    scheduling loop and by the maintenance command.
+    """
+    today = timezone.now().astimezone(datetime.UTC).date()
+    start = today
+    if not create_default_partition(model):
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT MIN({qn(model.PARTITION_FIELD)}) "
+                f"FROM {qn(default_partition(model))}"
+            )
+            oldest = cursor.fetchone()[0]
+        if oldest:
+            start = min(oldest.astimezone(datetime.UTC).date(), today)
+    return create_partitions(model, start, today + datetime.timedelta(days=days_ahead))
+
+
+def drop_expired_partitions(model) -> int:
+    """
+    Drops whole partitions, oldest first, for as long as every row in them is
+    due for deletion. Returns how many rows went with them.
+    """
+    delete_q = model.transition_delete_q()
+    if delete_q is None:
+        return 0
+    # No row can be due for deletion sooner than the shortest delete_after
+    horizon = timezone.now() - datetime.timedelta(
+        seconds=min(state.delete_after for state in model.state_graph.deletion_states)
+    )
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    field = model.PARTITION_FIELD
+    dropped = 0
+    for day, name in sorted(list_partitions(model).items()):
+        lower, upper = day_bounds(day)
+        if upper > horizon:
+            break
+        rows = model.objects.filter(**{f"{field}__gte": lower, f"{field}__lt": upper})
+        # Check it over without any locks, as that means reading the whole
+        # partition. Partitions still holding live rows (and everything
+        # after them) will have to wait for a later pass
+        checked = timezone.now()
+        if rows.exclude(delete_q).exists():
+            break
+        count = rows.count()
+        with transaction.atomic():
+            # Then lock it (taking the parent's lock first, as queries
+            # through the parent do, or we can deadlock with them) and make
+            # sure nothing has moved to a live state while we were looking
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE ONLY {table} IN ACCESS EXCLUSIVE MODE")
+                cursor.execute(f"LOCK TABLE {qn(name)} IN ACCESS EXCLUSIVE MODE")
+            if rows.filter(state_changed__gte=checked).exists():
+                break
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {qn(name)}")
+        dropped += count
+    return dropped
+
+
+def partition_table(model, days_ahead: int = DAYS_AHEAD):
+    """
+    Converts the model's table to be partitioned by day, copying all of its
+    rows across. Holds an exclusive lock on the table while it runs.
+    """
+    if not model.PARTITION_FIELD:
+        raise ValueError(f"{model._meta.label_lower} does not support partitioning")
+    if is_partitioned(model):
+        raise ValueError(f"{model._meta.label_lower} is already partitioned")
+    rebuild_table(model, partitioned=True, days_ahead=days_ahead)
+
+
+def unpartition_table(model):
+    """
+    Converts the model's table back to a normal, unpartitioned table.
+    """
+    if not is_partitioned(model):
+        raise ValueError(f"{model._meta.label_lower} is not partitioned")
+    rebuild_table(model, partitioned=False)
+
+
+def rebuild_table(model, partitioned: bool, days_ahead: int = DAYS_AHEAD):
+    """
+    Recreates the model's table (partitioned or not) with the same columns,
+    indexes and foreign keys, and copies its rows into it.
+
+    Partitioned tables have to include the partition column in their primary
+    key, so they get a primary key of (pk, PARTITION_FIELD); Django still
+    only looks things up by pk.
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    old_table = f"{table}_old"
+    pk = model._meta.pk.column
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE")
+        # Note down the indexes and constraints to recreate
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+            [table],
+        )
+        pk_name = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+            [table, pk_name],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        # Move the old table out of the way, freeing up its index names
+        cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old_table)}")
+        for index_name, _ in indexes:
+            cursor.execute(f"DROP INDEX {qn(index_name)}")
+        cursor.execute(f"ALTER TABLE {qn(old_table)} DROP CONSTRAINT {qn(pk_name)}")
+        # Make the new table and copy everything across
+        cursor.execute(
+            f"CREATE TABLE {qn(table)} (LIKE {qn(old_table)} INCLUDING DEFAULTS "
+            "INCLUDING CONSTRAINTS INCLUDING IDENTITY INCLUDING GENERATED "
+            "INCLUDING STORAGE)"
+            + (
+                f" PARTITION BY RANGE ({qn(model.PARTITION_FIELD)})"
+                if partitioned
+                else ""
+            )
+        )
+        key = [pk, model.PARTITION_FIELD] if partitioned else [pk]
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(pk_name)} "
+            f"PRIMARY KEY ({', '.join(qn(column) for column in key)})"
+        )
+        _partitioned[model._meta.label_lower] = partitioned
+        if partitioned:
+            cursor.execute(
+                f"SELECT MIN({qn(model.PARTITION_FIELD)}) FROM {qn(old_table)}"
+            )
+            oldest = cursor.fetchone()[0]
+            today = timezone.now().astimezone(datetime.UTC).date()
+            create_partitions(
+                model,
+                min(oldest.astimezone(datetime.UTC).date(), today) if oldest else today,
+                today + datetime.timedelta(days=days_ahead),
+            )
+        cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old_table)}")
+        for _, index_def in indexes:
+            cursor.execute(index_def)
+        for constraint_name, constraint_def in foreign_keys:
+            cursor.execute(
+                f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(constraint_name)} {constraint_def}"
+            )
+        cursor.execute(f"DROP TABLE {qn(old_table)}")
+        # Carry on the ID sequence from where the old one left off, under
+        # its old name
+        cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [table, pk])
+        sequence = cursor.fetchone()[0]
+        if sequence:
+            cursor.execute(
+                f"SELECT setval(%s, COALESCE(MAX({qn(pk)}), 0) + 1, false) FROM {qn(table)}",
+                [sequence],
+            )
+            sequence_name = f"{table}_{pk}_seq"
+            if sequence.split(".")[-1].strip('"') != sequence_name:
+                cursor.execute(
+                    f"ALTER SEQUENCE {sequence} RENAME TO {qn(sequence_name)}"
+                )
@@ -0,0 +1,273 @@
+"""
+Opt-in profiling of Stator handlers, enabled with STATOR_PROFILE.
+
+While a runner is going, a sampler thread records the Python stack of every
+worker thread that is in the middle of a transition, every
+STATOR_PROFILE_INTERVAL seconds, and every SQL query the transition runs.
+They're added up per model and state in StatorProfile, which the
+profilestator command summarises. Any transition slower than
+STATOR_PROFILE_SLOW seconds also gets its own samples and full query list
+saved as a StatorSlowTask.
+
+Coroutine handlers all run on the one event loop thread, so only the
+synchronous parts of them that go through the thread pool are sampled.
+"""
+
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from types import FrameType
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+# The most queries kept for a single slow task
+MAX_SLOW_QUERIES = 500
+
+# Runs of placeholders (from IN lists and bulk inserts) all look the same
+PLACEHOLDER_RUN = re.compile(r"%s(?:\s*,\s*%s)+")
+VALUES_RUN = re.compile(r"\(%s, \.\.\.\)(?:\s*,\s*\(%s, \.\.\.\))+")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Collapses lists of placeholders so the same query with different numbers
+    of parameters is counted together.
+    """
+    sql = PLACEHOLDER_RUN.sub("%s, ...", sql)
+    return VALUES_RUN.sub("(%s, ...), ...", sql)
+
+
+def frame_name(frame: FrameType) -> str:
+    """
+    Returns a frame's function as module.qualname.
+    """
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+@dataclass
+class Task:
+    """
+    A transition that a worker thread is in the middle of.
+    """
+
+    model_label: str
+    state: str
+    pks: list
+    # The frame the transition was started from, where its stacks stop
+    root: FrameType | None
+    started: float = field(default_factory=time.monotonic)
+    samples: Counter = field(default_factory=Counter)
+    queries: list[tuple[str, float]] = field(default_factory=list)
+
+
+class Profiler:
+    """
+    Tracks which transition each worker thread is running, samples their
+    stacks from a background thread, and buffers the results until the
+    runner flushes them into the database on its scheduling loop.
+    """
+
+    def __init__(self):
+        self.reset()
+        # Forked children (like supervised runners) don't get our thread,
+        # and mustn't inherit a lock it might have been holding
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.tasks: dict[int, Task] = {}
+        self.thread: threading.Thread | None = None
+        self.stopping = threading.Event()
+        self.clear()
+
+    def clear(self):
+        self.samples: Counter[tuple[str, str, str]] = Counter()
+        self.query_counts: Counter[tuple[str, str, str]] = Counter()
+        self.query_times: Counter[tuple[str, str, str]] = Counter()
+        self.slow_tasks: list[tuple[Task, float]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return getattr(settings, "STATOR_PROFILE", False)
+
+    @property
+    def interval(self) -> float:
+        return getattr(settings, "STATOR_PROFILE_INTERVAL", 0.05)
+
+    def start(self):
+        """
+        Starts the sampler thread, if profiling is enabled.
+        """
+        if not self.enabled or self.thread:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(
+            target=self.run, name="stator-profiler", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """
+        Records the current stack of every thread running a transition.
+        """
+        frames = sys._current_frames()
+        with self.lock:
+            for thread_id, task in self.tasks.items():
+                frame = frames.get(thread_id)
+                names = []
+                while frame is not None and frame is not task.root:
+                    names.append(frame_name(frame))
+                    frame = frame.f_back
+                if not names:
+                    continue
+                stack = ";".join(reversed(names))
+                task.samples[stack] += 1
+                self.samples[(task.model_label, task.state, stack)] += 1
+
+    @contextmanager
+    def task(self, model_label: str, state: str, pks: list):
+        """
+        Profiles the transition run inside the block, if the profiler has
+        been started in this process.
+        """
+        if not self.thread:
+            yield
+            return
+        task = Task(
+            model_label=model_label,
+            state=str(state),
+            pks=pks,
+            # Our caller is the generator machinery; theirs started the task
+            root=sys._getframe(2),
+        )
+
+        def record_query(execute, sql, params, many, context):
+            started = time.monotonic()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                task.queries.append((sql, time.monotonic() - started))
+
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.tasks[thread_id] = task
+        try:
+            with connection.execute_wrapper(record_query):
+                yield
+        finally:
+            duration = time.monotonic() - task.started
+            with self.lock:
+                del self.tasks[thread_id]
+                for sql, query_time in task.queries:
+                    key = (task.model_label, task.state, normalize_sql(sql))
+                    self.query_counts[key] += 1
+                    self.query_times[key] += query_time
+                if duration >= getattr(settings, "STATOR_PROFILE_SLOW", 5):
+                    self.slow_tasks.append((task, duration))
+
+    def flush(self):
+        """
+        Adds everything recorded since the last flush to this hour's
+        StatorProfile rows, saves slow tasks, and trims expired rows.
+        """
+        with self.lock:
+            samples, query_counts, query_times = (
+                self.samples,
+                self.query_counts,
+                self.query_times,
+            )
+            slow_tasks = self.slow_tasks
+            self.clear()
+        from stator.models import StatorProfile, StatorSlowTask
+
+        now = timezone.now()
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        # Each stack sample stands for one interval's worth of time
+        rows = [
+            [model_label, state, "stack", stack, count, count * self.interval]
+            for (model_label, state, stack), count in samples.items()
+        ]
+        for (model_label, state, sql), count in query_counts.items():
+            rows.append(
+                [
+                    model_label,
+                    state,
+                    "query",
+                    sql,
+                    count,
+                    query_times[(model_label, state, sql)],
+                ]
+            )
+        if rows:
+            table = connection.ops.quote_name(StatorProfile._meta.db_table)
+            # Several runners may be adding to the same rows at once
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"""
+                    INSERT INTO {table} AS t (
+                        model_label, state, kind, digest, key, start, count,
+                        duration, updated
+                    )
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (model_label, state, kind, digest, start) DO UPDATE SET
+                        count = t.count + EXCLUDED.count,
+                        duration = t.duration + EXCLUDED.duration,
+                        updated = EXCLUDED.updated
+                    """,
+                    [
+                        [
+                            model_label,
+                            state,
+                            kind,
+                            hashlib.md5(key.encode()).hexdigest(),
+                            key,
+                            hour,
+                            count,
+                            duration,
+                            now,
+                        ]
+                        for model_label, state, kind, key, count, duration in rows
+                    ],
+                )
+        StatorSlowTask.objects.bulk_create(
+            [
+                StatorSlowTask(
+                    model_label=task.model_label,
+                    state=task.state,
+                    pks=[str(pk) for pk in task.pks],
+                    duration=duration,
+                    samples=dict(task.samples.most_common()),
+                    queries=[
+                        [sql, query_time]
+                        for sql, query_time in task.queries[:MAX_SLOW_QUERIES]
+                    ],
+                )
+                for task, duration in slow_tasks
+            ]
+        )
+        StatorProfile.objects.filter(start__lt=now - StatorProfile.RETENTION).delete()
+        StatorSlowTask.objects.filter(
+            created__lt=now - StatorProfile.RETENTION
+        ).delete()
+
+
+# The profiler shared by everything in this process
+profiler = Profiler()
@@ -1,18 +1,27 @@
+import asyncio
 import datetime
 import logging
 import os
 import signal
+import threading
 import time
 import uuid
-from concurrent.futures import Future, ThreadPoolExecutor
+import weakref
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait
 
 from django.conf import settings
-from django.db import close_old_connections
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
 from django.utils import timezone
 
-from core import sentry
+from core import http, sentry
 from core.models import Config
-from stator.models import StatorModel, Stats
+from stator import metrics, partitions, profiling, timeouts
+from stator.concurrency import ConcurrencyController, database_connection_usage
+from stator.graph import State
+from stator.models import NOTIFY_CHANNEL, StatorModel
+from stator.scheduler import FairScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -43,12 +52,71 @@ class LoopingTimer:
         return False
 
 
+class NotifyListener:
+    """
+    Holds a dedicated database connection that LISTENs on the Stator channel,
+    so an idle runner can block until there is new work instead of polling.
+    """
+
+    def __init__(self, channel: str = NOTIFY_CHANNEL):
+        self.wrapper = connections.create_connection(DEFAULT_DB_ALIAS)
+        if self.wrapper.vendor != "postgresql":
+            raise ValueError("Notifications need a PostgreSQL database")
+        self.wrapper.ensure_connection()
+        self.wrapper.connection.execute(f"LISTEN {channel}")
+
+    def wait(self, timeout: float) -> set[str]:
+        """
+        Blocks for up to `timeout` seconds, returning the model labels that
+        were notified (or an empty set if nothing arrived in time).
+        """
+        return {
+            notify.payload
+            for notify in self.wrapper.connection.notifies(
+                timeout=timeout, stop_after=1
+            )
+        }
+
+    def close(self):
+        self.wrapper.close()
+
+
+class ResizableExecutor(ThreadPoolExecutor):
+    """
+    A thread pool that can be given more (or fewer) threads as it runs, so
+    the runner can make up for threads stuck in abandoned handlers.
+    """
+
+    def resize(self, change: int):
+        with self._shutdown_lock:
+            self._max_workers += change
+
+
+class ConnectionClosingExecutor(ResizableExecutor):
+    """
+    A thread pool that tidies up the worker thread's database connection
+    after every job, like task_transition does for itself.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(self.run_job, fn, *args, **kwargs)
+
+    @staticmethod
+    def run_job(fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+
 class StatorRunner:
     """
     Runs tasks on models that are looking for state changes.
     Designed to run either indefinitely, or just for a few seconds.
     """
 
+    executor_class: type[ResizableExecutor] = ResizableExecutor
+
     def __init__(
         self,
         models: list[type[StatorModel]],
@@ -59,21 +127,71 @@ class StatorRunner:
         liveness_file: str | None = None,
         schedule_interval: int = 60,
         delete_interval: int = 30,
-        lock_expiry: int = 300,
+        lock_expiry: int = 30,
         run_for: int = 0,
+        notify: bool = getattr(settings, "STATOR_NOTIFY", False),
+        shard: tuple[int, int] | None = None,
+        heartbeat: Callable[[dict[str, int]], None] | None = None,
+        concurrency_min: int | None = getattr(settings, "STATOR_CONCURRENCY_MIN", None),
+        concurrency_max: int | None = getattr(settings, "STATOR_CONCURRENCY_MAX", None),
+        adjust_interval: int = 10,
+        runner_id: str | None = None,
+        drain_timeout: int = 25,
     ):
         self.models = models
-        self.runner_id = uuid.uuid4().hex
+        # Rows we lock are marked with this, so giving a runner the same ID
+        # each time it starts lets it take back rows it had when it died
+        self.runner_id = runner_id or uuid.uuid4().hex
         self.concurrency = concurrency
         self.concurrency_per_model = concurrency_per_model
         self.liveness_file = liveness_file
         self.schedule_interval = schedule_interval
         self.delete_interval = delete_interval
+        # Our locks only last this long, but we keep renewing them while
+        # we're alive
         self.lock_expiry = lock_expiry
         self.run_for = run_for
+        self.notify = notify
+        # If set, as (index, count), we only claim rows hashing to our shard
+        self.shard = shard
+        # Called every scheduling loop with the counts handled since the last
+        # one, so a supervisor can keep track of its child runners
+        self.heartbeat = heartbeat
+        # With a maximum set, concurrency (and each model's share of it)
+        # adapts to the backlog and to how the database is coping
+        self.controller: ConcurrencyController | None = None
+        if concurrency_max:
+            self.controller = ConcurrencyController(
+                concurrency_min or 1, concurrency_max, concurrency
+            )
+            self.concurrency = self.controller.concurrency
+        self.adjust_interval = adjust_interval
+        # On SIGTERM we stop claiming work and give running tasks this long
+        # to finish before releasing everything and exiting
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self.waiting = False
+        self.listener: NotifyListener | None = None
+        # Our leases are renewed from their own thread, so a slow scheduling
+        # pass can't let them run out
+        self.lease_thread: threading.Thread | None = None
+        self.leases_stopped = threading.Event()
         self.minimum_loop_delay = 0.5
         self.maximum_loop_delay = 5
+        # With notifications, idle polling only has to catch retries coming due
+        self.maximum_notify_loop_delay = 30
         self.tasks: dict[tuple[str, str], Future] = {}
+        # The rows each transition task claimed, to release if it fails
+        self.task_pks: dict[tuple[str, str], list] = {}
+        # Tasks whose handlers ran out of time, and are no longer counted
+        # as running, but are still stuck in one of the pool's threads
+        self.abandoned_tasks: list[Future] = []
+        # The ones the pool has been given an extra thread to make up for,
+        # which it only does for up to max_replaced_threads at once (so the
+        # pool can at most double in size)
+        self.replaced_tasks: set[Future] = set()
+        self.max_replaced_threads = self.concurrency
+        self.scheduler = FairScheduler()
         # Set up SIGALRM handler
         signal.signal(signal.SIGALRM, self.alarm_handler)
 
@@ -81,10 +199,18 @@ class StatorRunner:
         sentry.set_takahe_app("stator")
         self.handled = {}
         self.started = time.monotonic()
-        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.executor = self.make_executor()
         self.loop_delay = self.minimum_loop_delay
         self.scheduling_timer = LoopingTimer(self.schedule_interval)
+        if self.notify:
+            self.start_listener()
         self.deletion_timer = LoopingTimer(self.delete_interval)
+        self.release_locks()
+        self.start_lease_thread()
+        profiling.profiler.start()
+        self.adjust_timer = LoopingTimer(self.adjust_interval, trigger_at_start=False)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.term_handler)
         # For the first time period, launch tasks
         logger.info("Running main task loop")
         try:
@@ -94,20 +220,29 @@ class StatorRunner:
                     if self.scheduling_timer.check():
                         # Set up the watchdog timer (each time we do this the previous one is cancelled)
                         signal.alarm(self.schedule_interval * 2)
-                        # Write liveness file if configured
-                        if self.liveness_file:
-                            with open(self.liveness_file, "w") as fh:
-                                fh.write(str(int(time.time())))
+                        self.write_liveness()
+                        if self.heartbeat:
+                            self.heartbeat(self.handled)
                         # Refresh the config
                         self.load_config()
-                        # Do scheduling (stale lock deletion and stats gathering)
+                        # Reconnect notifications if we lost them
+                        if self.notify and not self.listener:
+                            self.start_listener()
+                        # Do scheduling (stats gathering and partition upkeep)
                         self.run_scheduling()
 
+                    if self.draining:
+                        break
+
                     # Clear the cleaning breadcrumbs/extra for the main part of the loop
                     sentry.scope_clear(scope)
 
                     self.clean_tasks()
 
+                    # See if we should run more or fewer tasks at once
+                    if self.controller and self.adjust_timer.check():
+                        self.adjust_concurrency()
+
                     # See if we need to add deletion tasks
                     if self.deletion_timer.check():
                         self.add_deletion_tasks()
@@ -129,9 +264,13 @@ class StatorRunner:
                     else:
                         self.loop_delay = min(
                             self.loop_delay * 1.5,
-                            self.maximum_loop_delay,
+                            (
+                                self.maximum_notify_loop_delay
+                                if self.listener
+                                else self.maximum_loop_delay
+                            ),
                         )
-                    time.sleep(self.loop_delay)
+                    self.wait(self.loop_delay)
 
                     # Clear the Sentry breadcrumbs and extra for next loop
                     sentry.scope_clear(scope)
@@ -139,12 +278,82 @@ class StatorRunner:
             pass
 
         # Wait for tasks to finish
-        logger.info("Waiting for tasks to complete")
-        self.executor.shutdown()
+        logger.info("Draining: waiting for tasks to complete")
+        self.shutdown()
 
         # We're done
         logger.info("Complete")
 
+    def make_executor(self) -> ResizableExecutor:
+        """
+        Makes the thread pool tasks run in.
+        """
+        return self.executor_class(
+            max_workers=self.controller.maximum if self.controller else self.concurrency
+        )
+
+    def shutdown(self):
+        """
+        Drains the runner: drops tasks that haven't started, gives running
+        ones until drain_timeout to finish, then unlocks everything we still
+        hold so other runners can pick it up straight away.
+        """
+        self.finish_tasks(time.monotonic() + self.drain_timeout)
+        self.stop_lease_thread()
+        self.release_locks()
+        if self.listener:
+            self.listener.close()
+        if profiling.profiler.thread:
+            profiling.profiler.stop()
+            profiling.profiler.flush()
+
+    def finish_tasks(self, deadline: float):
+        """
+        Cancels queued tasks and waits until the deadline for running ones.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.wait_for_tasks(list(self.tasks.values()), deadline)
+
+    def wait_for_tasks(self, tasks: list[Future], deadline: float):
+        """
+        Waits for the tasks to finish, or the deadline to pass.
+        """
+        # wait() never counts futures cancelled before they started as done
+        _, not_done = wait(
+            [task for task in tasks if not task.cancelled()],
+            timeout=max(deadline - time.monotonic(), 0),
+        )
+        if not_done:
+            logger.warning(
+                f"{len(not_done)} tasks still running after {self.drain_timeout}s, releasing their locks anyway"
+            )
+
+    def term_handler(self, signum, frame):
+        """
+        Called on SIGTERM; starts draining, interrupting our wait for the
+        next loop if we're in one.
+        """
+        logger.info("SIGTERM received")
+        self.draining = True
+        if self.waiting:
+            raise KeyboardInterrupt()
+
+    @property
+    def is_primary(self) -> bool:
+        """
+        Whether we should do the work that only one of a set of sharded
+        runners needs to (deleting, and measuring queues).
+        """
+        return self.shard is None or self.shard[0] == 0
+
+    def write_liveness(self):
+        """
+        Writes the liveness file, if configured, to say we're still running.
+        """
+        if self.liveness_file:
+            with open(self.liveness_file, "w") as fh:
+                fh.write(str(int(time.time())))
+
     def alarm_handler(self, signum, frame):
         """
         Called when SIGALRM fires, which means we missed a schedule loop.
@@ -153,6 +362,99 @@ class StatorRunner:
         logger.warning("Watchdog timeout exceeded")
         os._exit(2)
 
+    def start_listener(self):
+        """
+        Starts listening for new work notifications, falling back to plain
+        polling if the database can't do it.
+        """
+        try:
+            self.listener = NotifyListener()
+        except Exception as e:
+            logger.warning(f"Cannot listen for notifications, polling instead: {e}")
+            self.listener = None
+
+    def wait(self, delay: float):
+        """
+        Waits up to `delay` seconds before the next loop, returning early if
+        we're notified of new work.
+        """
+        if self.draining:
+            return
+        self.waiting = True
+        try:
+            self.wait_for_work(delay)
+        finally:
+            self.waiting = False
+
+    def wait_for_work(self, delay: float):
+        """
+        Does the actual waiting for wait().
+        """
+        if self.listener:
+            try:
+                if self.listener.wait(delay):
+                    self.loop_delay = self.minimum_loop_delay
+                return
+            except Exception as e:
+                # The connection is probably gone; poll until the next
+                # scheduling run tries to listen again.
+                logger.warning(f"Lost notification connection: {e}")
+                self.listener.close()
+                self.listener = None
+        time.sleep(delay)
+
+    def release_locks(self):
+        """
+        Releases any rows still locked under our runner ID, which a previous
+        run of us must have been working on when it died.
+        """
+        for model in self.models:
+            released = model.transition_release_locks(self.runner_id)
+            if released:
+                logger.info(
+                    f"{model._meta.label_lower}: Reclaimed {released} locked items"
+                )
+
+    def start_lease_thread(self):
+        """
+        Starts the thread that keeps our leases renewed while we run.
+        """
+        self.leases_stopped.clear()
+        self.lease_thread = threading.Thread(
+            target=self.renew_leases_forever, name="stator-leases", daemon=True
+        )
+        self.lease_thread.start()
+
+    def stop_lease_thread(self):
+        """
+        Stops renewing our leases, once there's nothing left running.
+        """
+        if self.lease_thread:
+            self.leases_stopped.set()
+            self.lease_thread.join()
+            self.lease_thread = None
+
+    def renew_leases_forever(self):
+        """
+        Renews our leases every third of lock_expiry until stopped.
+        """
+        while not self.leases_stopped.wait(max(self.lock_expiry / 3, 1)):
+            try:
+                self.renew_leases()
+            except Exception:
+                logger.exception("Error renewing leases")
+        close_old_connections()
+
+    def renew_leases(self):
+        """
+        Extends the locks on everything we're still working on, and frees up
+        locks other runners have let expire.
+        """
+        lock_expiry = timezone.now() + datetime.timedelta(seconds=self.lock_expiry)
+        for model in self.models:
+            model.transition_renew_locks(self.runner_id, lock_expiry)
+            model.transition_clean_locks()
+
     def load_config(self):
         """
         Refreshes config from the DB
@@ -161,7 +463,7 @@ class StatorRunner:
 
     def run_scheduling(self):
         """
-        Deletes stale locks for models, and submits their stats.
+        Submits stats for models and makes sure they have partitions.
         """
         with sentry.start_transaction(op="task", name="stator.run_scheduling"):
             for model in self.models:
@@ -171,20 +473,82 @@ class StatorRunner:
                         logger.info(
                             f"{model._meta.label_lower}: Scheduling ({num} handled)"
                         )
-                    self.submit_stats(model)
-                    model.transition_clean_locks()
+                    self.handled.pop(model._meta.label_lower, None)
+                    if self.is_primary:
+                        self.submit_stats(model)
+                        try:
+                            if partitions.is_partitioned(model):
+                                partitions.ensure_partitions(model)
+                        except Exception as e:
+                            # Leave it for the next pass rather than stopping
+                            logger.exception(e)
+            metrics.recorder.flush()
+            if profiling.profiler.thread:
+                profiling.profiler.flush()
 
     def submit_stats(self, model: type[StatorModel]):
         """
-        Pop some statistics into the database from our local info for the given model
+        Records the model's current queue sizes for the metrics.
+        """
+        label = model._meta.label_lower
+        for state, number in model.transition_ready_counts().items():
+            metrics.recorder.set_queued(label, state, number)
+
+    @property
+    def pooled_models(self) -> list[type[StatorModel]]:
+        """
+        The models whose tasks run in the thread pool.
+        """
+        return self.models
+
+    def model_concurrency(self, model: type[StatorModel]) -> int:
+        """
+        Returns how many tasks the model may have in the thread pool at once.
+        """
+        if self.controller:
+            return self.controller.model_limits.get(
+                model._meta.label_lower, self.concurrency_per_model
+            )
+        return self.concurrency_per_model
+
+    def adjust_concurrency(self):
+        """
+        Has the controller resize the pool (and re-share it between models)
+        given the current backlogs, load and database connection usage.
         """
-        stats_instance = Stats.get_for_model(model)
-        if stats_instance.model_label in self.handled:
-            stats_instance.add_handled(self.handled[stats_instance.model_label])
-            del self.handled[stats_instance.model_label]
-        stats_instance.set_queued(model.transition_ready_count())
-        stats_instance.trim_data()
-        stats_instance.save()
+        assert self.controller
+        labels = {model._meta.label_lower for model in self.pooled_models}
+        backlogs = {
+            model._meta.label_lower: model.transition_ready_count(
+                cap=model.QUEUE_COUNT_CAP
+            )
+            for model in self.pooled_models
+        }
+        busy = sum(
+            1 for key in self.tasks if key[0] in labels and key[1] != "__delete__"
+        )
+        previous = self.concurrency
+        self.concurrency = self.controller.update(
+            busy, backlogs, database_connection_usage()
+        )
+        if self.concurrency != previous:
+            logger.info(f"Concurrency changed from {previous} to {self.concurrency}")
+
+    def add_task(self, key: tuple[str, str], future: Future, state: str, pks: list):
+        """
+        Tracks a started task for the rows in `pks`, timing it (against
+        others for the same model and state) for the controller if we have
+        one.
+        """
+        self.tasks[key] = future
+        self.task_pks[key] = pks
+        if self.controller:
+            controller = self.controller
+            kind = f"{key[0]}.{state}"
+            started = time.monotonic()
+            future.add_done_callback(
+                lambda _: controller.observe(kind, time.monotonic() - started)
+            )
 
     def add_transition_tasks(self, call_inline=False):
         """
@@ -194,33 +558,149 @@ class StatorRunner:
         # Calculate space left for tasks
         space_remaining = self.concurrency - len(self.tasks)
         # Fetch new tasks
-        for model in self.models:
-            if space_remaining > 0:
-                for instance in model.transition_get_with_lock(
-                    number=min(space_remaining, self.concurrency_per_model),
-                    lock_expiry=(
-                        timezone.now() + datetime.timedelta(seconds=self.lock_expiry)
-                    ),
-                ):
-                    key = (model._meta.label_lower, instance.pk)
-                    # Don't run two threads for the same thing
-                    if key in self.tasks:
-                        continue
-                    if call_inline:
-                        task_transition(instance, in_thread=False)
-                    else:
-                        self.tasks[key] = self.executor.submit(
-                            task_transition, instance
-                        )
-                    self.handled[model._meta.label_lower] = (
-                        self.handled.get(model._meta.label_lower, 0) + 1
-                    )
-                    space_remaining -= 1
+        self.add_scheduled_tasks(
+            self.models, space_remaining, self.model_concurrency, call_inline
+        )
+
+    def add_scheduled_tasks(
+        self,
+        models: list[type[StatorModel]],
+        space: int,
+        model_limit: Callable[[type[StatorModel]], int],
+        call_inline=False,
+        states: Callable[[type[StatorModel], State], bool] | None = None,
+    ) -> int:
+        """
+        Shares up to `space` new tasks between the models' automatic states
+        (those `states` returns true for, if given) in proportion to their
+        priorities, with no model getting more than model_limit(model).
+        Returns how many tasks were started.
+        """
+        if space <= 0:
+            return 0
+        by_label = {model._meta.label_lower: model for model in models}
+        queues = {
+            (label, state.name): model.transition_priority(state)
+            for label, model in by_label.items()
+            for state in model.state_graph.automatic_states
+            if states is None or states(model, state)
+        }
+        used: Counter[str] = Counter()
+
+        def claim(queue: tuple[str, str], number: int) -> int:
+            label, state_name = queue
+            model = by_label[label]
+            number = min(number, model_limit(model) - used[label])
+            if number <= 0:
+                return 0
+            started = self.add_model_tasks(
+                model,
+                number,
+                call_inline=call_inline,
+                state=model.state_graph.states[state_name],
+            )
+            used[label] += started
+            return started
+
+        return self.scheduler.fill(queues, space, claim)
+
+    def add_model_tasks(
+        self,
+        model: type[StatorModel],
+        number: int,
+        call_inline=False,
+        state: State | None = None,
+    ) -> int:
+        """
+        Claims up to `number` tasks' worth of instances of the model (only
+        those in `state`, if given) and starts them, returning how many tasks
+        were started. Instances in batch states are grouped into one task per
+        batch.
+        """
+        label = model._meta.label_lower
+        # If every state we're claiming from is a batch state, claim enough
+        # rows to fill a batch per task
+        states = [state] if state else list(model.state_graph.automatic_states)
+        batch_sizes = [state.batch_size for state in states]
+        rows_per_task = min(batch_sizes) if batch_sizes and all(batch_sizes) else 1
+        started = 0
+        batches: dict[str, list[StatorModel]] = {}
+        skipped = []
+        for instance in model.transition_get_with_lock(
+            number=number * rows_per_task,
+            lock_expiry=(timezone.now() + datetime.timedelta(seconds=self.lock_expiry)),
+            runner_id=self.runner_id,
+            shard=self.shard,
+            states=states,
+        ):
+            key = (label, instance.pk)
+            # Don't run two threads for the same thing (and don't keep
+            # renewing the lock we just took on it, either)
+            if key in self.tasks:
+                skipped.append(instance.pk)
+                continue
+            instance_state = model.state_graph.states[instance.state]
+            if instance_state.batch_size:
+                batch = batches.setdefault(instance_state.name, [])
+                batch.append(instance)
+                if len(batch) >= instance_state.batch_size:
+                    self.start_batch(batches.pop(instance_state.name), call_inline)
+                    started += 1
+                continue
+            if call_inline:
+                task_transition(instance, in_thread=False)
+            else:
+                self.add_task(
+                    key,
+                    self.submit_transition(instance),
+                    instance_state.name,
+                    [instance.pk],
+                )
+            self.handled[label] = self.handled.get(label, 0) + 1
+            started += 1
+        # Start any partially-filled batches too
+        for batch in batches.values():
+            self.start_batch(batch, call_inline)
+            started += 1
+        if skipped:
+            model.transition_release_locks(self.runner_id, pks=skipped)
+        return started
+
+    def start_batch(self, instances: list[StatorModel], call_inline=False):
+        """
+        Starts running a batch transition for the (locked) instances.
+        """
+        label = instances[0]._meta.label_lower
+        if call_inline:
+            task_transition_batch(instances, in_thread=False)
+        else:
+            self.add_task(
+                (label, instances[0].pk),
+                self.submit_batch(instances),
+                instances[0].state,
+                [instance.pk for instance in instances],
+            )
+        self.handled[label] = self.handled.get(label, 0) + len(instances)
+
+    def submit_transition(self, instance: StatorModel) -> Future:
+        """
+        Starts running a transition for the (locked) instance.
+        """
+        return self.executor.submit(task_transition, instance)
+
+    def submit_batch(self, instances: list[StatorModel]) -> Future:
+        """
+        Starts running a batch transition for the (locked) instances.
+        """
+        return self.executor.submit(task_transition_batch, instances)
 
     def add_deletion_tasks(self, call_inline=False):
         """
         Adds a deletion thread for each model
         """
+        # Only one of a set of sharded runners needs to delete things
+        if not self.is_primary:
+            return
         # Yes, this potentially goes over the capacity limit - it's fine.
         for model in self.models:
             if model.state_graph.deletion_states:
@@ -236,13 +716,52 @@ class StatorRunner:
         Removes any tasks that are done and handles exceptions if they
         raised them.
         """
+        for task in list(self.abandoned_tasks):
+            if task.done():
+                self.abandoned_tasks.remove(task)
+                if task in self.replaced_tasks:
+                    self.replaced_tasks.remove(task)
+                    self.executor.resize(-1)
+        abandoned: dict[str, set] = {}
         for key, task in list(self.tasks.items()):
             if task.done():
                 del self.tasks[key]
+                pks = self.task_pks.pop(key, None)
                 try:
                     task.result()
                 except BaseException as e:
                     logger.exception(e)
+                    # It may not have got as far as saving its outcomes (or
+                    # unlocking its rows), and we'd otherwise keep renewing
+                    # its leases for as long as we run
+                    if pks:
+                        self.release_task_locks(key[0], pks)
+            elif key[1] != "__delete__":
+                if key[0] not in abandoned:
+                    abandoned[key[0]] = timeouts.deadlines.abandoned(key[0])
+                # Its rows have already been released to be retried, so make
+                # room for another task, and give the pool a thread to make
+                # up for the one it's stuck in (unless it has too many
+                # already)
+                if key[1] in abandoned[key[0]]:
+                    del self.tasks[key]
+                    self.task_pks.pop(key, None)
+                    self.abandoned_tasks.append(task)
+                    if len(self.replaced_tasks) < self.max_replaced_threads:
+                        self.replaced_tasks.add(task)
+                        self.executor.resize(1)
+
+    def release_task_locks(self, label: str, pks: list):
+        """
+        Releases our locks on a failed task's rows, so they're retried
+        straight away.
+        """
+        for model in self.models:
+            if model._meta.label_lower == label:
+                try:
+                    model.transition_release_locks(self.runner_id, pks=pks)
+                except Exception:
+                    logger.exception(f"Error releasing {label} locks")
 
     def run_single_cycle(self):
         """
@@ -253,11 +772,137 @@ class StatorRunner:
         self.add_transition_tasks(call_inline=True)
 
 
+class AsyncStatorRunner(StatorRunner):
+    """
+    A runner that awaits states' async handlers natively on a single
+    asyncio event loop, so hundreds of them can be waiting on the network
+    at once. Everything else, including the async handlers' database work,
+    goes to the bounded thread pool, sized by `concurrency`.
+    """
+
+    executor_class = ConnectionClosingExecutor
+
+    def __init__(
+        self,
+        models: list[type[StatorModel]],
+        async_concurrency: int = getattr(settings, "STATOR_ASYNC_CONCURRENCY", 500),
+        async_concurrency_per_model: int = getattr(
+            settings, "STATOR_ASYNC_CONCURRENCY_PER_MODEL", 100
+        ),
+        **kwargs,
+    ):
+        super().__init__(models, **kwargs)
+        self.async_concurrency = async_concurrency
+        self.async_concurrency_per_model = async_concurrency_per_model
+        # (model label, state name) of the states with async handlers
+        self.async_states = {
+            (model._meta.label_lower, state.name)
+            for model in models
+            for state in model.state_graph.automatic_states
+            if state.async_handler
+        }
+        # The tasks running on the loop rather than in the pool
+        self.async_tasks: weakref.WeakSet[Future] = weakref.WeakSet()
+
+    def is_async(self, model: type[StatorModel], state: State) -> bool:
+        return (model._meta.label_lower, state.name) in self.async_states
+
+    @property
+    def pooled_models(self) -> list[type[StatorModel]]:
+        return [
+            model
+            for model in self.models
+            if not all(
+                self.is_async(model, state)
+                for state in model.state_graph.automatic_states
+            )
+        ]
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(
+            target=self.loop.run_forever,
+            name="stator-asyncio",
+            daemon=True,
+        )
+        self.loop_thread.start()
+        super().run()
+
+    def make_executor(self) -> ResizableExecutor:
+        # Async handlers' database calls (database_sync_to_async) run in the
+        # loop's default executor, so make that our pool
+        executor = super().make_executor()
+        self.loop.set_default_executor(executor)
+        return executor
+
+    def finish_tasks(self, deadline: float):
+        # Coroutines still need the thread pool to write their results, so
+        # let them finish before it goes away
+        self.wait_for_tasks(
+            [task for task in self.tasks.values() if task in self.async_tasks],
+            deadline,
+        )
+        super().finish_tasks(deadline)
+
+    def shutdown(self):
+        super().shutdown()
+        asyncio.run_coroutine_threadsafe(http.pool.aclose_loop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+
+    def add_transition_tasks(self, call_inline=False):
+        """
+        Claims work for each state, with async states limited by the async
+        concurrency values and everything else by the thread pool.
+        """
+        if call_inline:
+            return super().add_transition_tasks(call_inline=True)
+        in_flight = Counter(
+            task in self.async_tasks
+            for key, task in self.tasks.items()
+            if key[1] != "__delete__"
+        )
+        self.add_scheduled_tasks(
+            self.models,
+            self.async_concurrency - in_flight[True],
+            lambda model: self.async_concurrency_per_model,
+            states=self.is_async,
+        )
+        self.add_scheduled_tasks(
+            self.pooled_models,
+            self.concurrency - in_flight[False],
+            self.model_concurrency,
+            states=lambda model, state: not self.is_async(model, state),
+        )
+
+    def submit_transition(self, instance: StatorModel) -> Future:
+        state = instance.state_graph.states[instance.state]
+        if not self.is_async(instance.__class__, state):
+            return super().submit_transition(instance)
+        task = asyncio.run_coroutine_threadsafe(
+            atask_transition(instance, self.executor), self.loop
+        )
+        self.async_tasks.add(task)
+        return task
+
+    def submit_batch(self, instances: list[StatorModel]) -> Future:
+        state = instances[0].state_graph.states[instances[0].state]
+        if not self.is_async(instances[0].__class__, state):
+            return super().submit_batch(instances)
+        task = asyncio.run_coroutine_threadsafe(
+            atask_transition_batch(instances, self.executor), self.loop
+        )
+        self.async_tasks.add(task)
+        return task
+
+
 def task_transition(instance: StatorModel, in_thread: bool = True):
     """
     Runs one state transition/action.
     """
     task_name = f"stator.task_transition:{instance._meta.label_lower}#{{id}} from {instance.state}"
+    state = instance.state
     started = time.monotonic()
     with sentry.start_transaction(op="task", name=task_name):
         sentry.set_context(
@@ -269,8 +914,10 @@ def task_transition(instance: StatorModel, in_thread: bool = True):
                 "state_age": instance.state_age,
             },
         )
-        result = instance.transition_attempt()
+        with profiling.profiler.task(instance._meta.label_lower, state, [instance.pk]):
+            result = instance.transition_attempt()
         duration = time.monotonic() - started
+        metrics.recorder.observe(instance._meta.label_lower, state, duration)
         if result:
             logger.info(
                 f"{instance._meta.label_lower}: {instance.pk}: {instance.state} -> {result} ({duration:.2f}s)"
@@ -283,6 +930,86 @@ def task_transition(instance: StatorModel, in_thread: bool = True):
         close_old_connections()
 
 
+def task_transition_batch(instances: list[StatorModel], in_thread: bool = True):
+    """
+    Runs one batch state transition/action for several instances at once.
+    """
+    label = instances[0]._meta.label_lower
+    state = instances[0].state
+    task_name = f"stator.task_transition_batch:{label} from {state}"
+    started = time.monotonic()
+    with sentry.start_transaction(op="task", name=task_name):
+        sentry.set_context(
+            "instances",
+            {
+                "model": label,
+                "pks": [instance.pk for instance in instances],
+                "state": state,
+            },
+        )
+        with profiling.profiler.task(
+            label, state, [instance.pk for instance in instances]
+        ):
+            results = instances[0].__class__.transition_attempt_batch(instances)
+        duration = time.monotonic() - started
+        metrics.recorder.observe(label, state, duration, handled=len(instances))
+        changed = Counter(str(result) for result in results.values() if result)
+        logger.info(
+            f"{label}: batch of {len(instances)} from {state}: "
+            + (
+                ", ".join(f"{count} -> {name}" for name, count in changed.items())
+                or "unchanged"
+            )
+            + f" ({duration:.2f}s)"
+        )
+    if in_thread:
+        close_old_connections()
+
+
+async def atask_transition(instance: StatorModel, executor: Executor):
+    """
+    Runs one state transition/action on the event loop, using the executor
+    for anything synchronous.
+    """
+    started = time.monotonic()
+    state = instance.state
+    result = await instance.atransition_attempt(executor)
+    duration = time.monotonic() - started
+    metrics.recorder.observe(instance._meta.label_lower, state, duration)
+    if result:
+        logger.info(
+            f"{instance._meta.label_lower}: {instance.pk}: {state} -> {result} ({duration:.2f}s)"
+        )
+    else:
+        logger.info(
+            f"{instance._meta.label_lower}: {instance.pk}: {state} unchanged  ({duration:.2f}s)"
+        )
+
+
+async def atask_transition_batch(instances: list[StatorModel], executor: Executor):
+    """
+    Runs one batch state transition/action on the event loop, using the
+    executor for anything synchronous.
+    """
+    label = instances[0]._meta.label_lower
+    state = instances[0].state
+    started = time.monotonic()
+    results = await instances[0].__class__.atransition_attempt_batch(
+        instances, executor
+    )
+    duration = time.monotonic() - started
+    metrics.recorder.observe(label, state, duration, handled=len(instances))
+    changed = Counter(str(result) for result in results.values() if result)
+    logger.info(
+        f"{label}: batch of {len(instances)} from {state}: "
+        + (
+            ", ".join(f"{count} -> {name}" for name, count in changed.items())
+            or "unchanged"
+        )
+        + f" ({duration:.2f}s)"
+    )
+
+
 def task_deletion(model: type[StatorModel], in_thread: bool = True):
     """
     Runs one model deletion set.
@@ -0,0 +1,54 @@
+from collections.abc import Callable, Hashable
+
+
+class FairScheduler:
+    """
+    Shares out task slots between queues (a runner's model states) in
+    proportion to their weights, using stride scheduling.
+
+    Each queue has a "pass" that advances by 1/weight for every task it is
+    given, and the queue with the lowest pass goes next, so a queue with
+    weight 4 gets four tasks for every one a weight 1 queue gets - but the
+    weight 1 queue still gets its turn, however big the other backlog is.
+    Queues that were empty rejoin at the current virtual time rather than
+    cashing in credit they built up while idle.
+    """
+
+    def __init__(self):
+        self.passes: dict[Hashable, float] = {}
+        self.virtual_time = 0.0
+
+    def fill(
+        self,
+        queues: dict[Hashable, float],
+        space: int,
+        claim: Callable[[Hashable, int], int],
+    ) -> int:
+        """
+        Calls claim(queue, number) to start up to `number` tasks from the
+        queues, in weighted-fair order, until `space` tasks have started or
+        every queue has run dry. Returns how many tasks were started.
+        """
+        active = {key: weight for key, weight in queues.items() if weight > 0}
+        started = 0
+        while space > 0 and active:
+            key = min(
+                active,
+                key=lambda key: (
+                    max(self.passes.get(key, 0.0), self.virtual_time),
+                    -active[key],
+                ),
+            )
+            weight = active[key]
+            self.virtual_time = max(self.passes.get(key, 0.0), self.virtual_time)
+            # Ask for this queue's whole share of what's left, so one
+            # database claim can start several tasks
+            number = max(1, space * weight // sum(active.values()))
+            claimed = claim(key, int(number))
+            self.passes[key] = self.virtual_time + claimed / weight
+            if claimed < number:
+                # It's empty (or at its limit) for now
+                del active[key]
+            space -= claimed
+            started += claimed
+        return started
@@ -0,0 +1,199 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import uuid
+
+from django.db import connections
+
+from stator.models import StatorModel
+from stator.runner import LoopingTimer, StatorRunner
+
+logger = logging.getLogger(__name__)
+
+
+class StatorSupervisor:
+    """
+    Runs several Stator runners as child processes, so a single container
+    can use more than one CPU core.
+
+    Each child gets its own database connections and claims only the rows
+    whose primary key hashes to its shard (if the supervisor is itself given
+    a shard, the children split that one between them), and children that die (or stop
+    checking in) are replaced. The supervisor writes the liveness file for
+    all of them, and only while all of them are alive.
+    """
+
+    def __init__(
+        self,
+        models: list[type[StatorModel]],
+        processes: int,
+        runner_class: type[StatorRunner] = StatorRunner,
+        liveness_file: str | None = None,
+        schedule_interval: int = 60,
+        run_for: int = 0,
+        runner_id: str | None = None,
+        drain_timeout: int = 25,
+        shard: tuple[int, int] | None = None,
+        **runner_kwargs,
+    ):
+        self.models = models
+        self.processes = processes
+        self.runner_class = runner_class
+        self.liveness_file = liveness_file
+        self.schedule_interval = schedule_interval
+        self.run_for = run_for
+        self.runner_kwargs = runner_kwargs
+        # Each child's runner ID is this plus its index, so a replacement
+        # child can take back the rows the one before it had locked
+        self.runner_id = runner_id or uuid.uuid4().hex
+        self.drain_timeout = drain_timeout
+        self.shard = shard
+        # Children need to inherit the already-set-up Django, so fork
+        self.context = multiprocessing.get_context("fork")
+        # When each child last checked in, and how much it has handled
+        self.heartbeats = self.context.Array("d", processes)
+        self.handled = self.context.Array("q", processes)
+        self.children: list = [None] * processes
+        # A child that misses this many scheduling loops is presumed stuck
+        self.stale_after = schedule_interval * 3
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.term_handler)
+        for index in range(self.processes):
+            self.start_child(index)
+        report_timer = LoopingTimer(self.schedule_interval)
+        logger.info(f"Supervising {self.processes} runners")
+        try:
+            while True:
+                if self.run_for:
+                    # Limited runs just wait for the children to finish
+                    if not any(child.is_alive() for child in self.children):
+                        break
+                else:
+                    self.check_children()
+                if report_timer.check():
+                    self.report()
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        logger.info("Waiting for runners to complete")
+        self.stop_children()
+        logger.info("Complete")
+
+    def start_child(self, index: int):
+        """
+        Forks a new runner for the given shard.
+        """
+        # Forked children must not share our database connections
+        connections.close_all()
+        self.heartbeats[index] = time.time()
+        child = self.context.Process(
+            target=self.run_child,
+            args=(index,),
+            name=f"stator-{index}",
+        )
+        child.start()
+        self.children[index] = child
+        logger.info(f"Started runner {index} (pid {child.pid})")
+
+    def child_shard(self, index: int) -> tuple[int, int]:
+        """
+        Returns the shard the child with the given index claims from. Shards
+        are hash ranges, so splitting shard i/n into p pieces gives shards
+        i*p to i*p+p-1 of n*p.
+        """
+        if self.shard is None:
+            return (index, self.processes)
+        return (
+            self.shard[0] * self.processes + index,
+            self.shard[1] * self.processes,
+        )
+
+    def run_child(self, index: int):
+        """
+        The entrypoint of each child process.
+        """
+
+        # Ctrl-C in a terminal reaches every process; let the supervisor
+        # decide what to do about it (it'll send us SIGTERM, which the runner
+        # handles by draining)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        def heartbeat(handled: dict[str, int]):
+            self.heartbeats[index] = time.time()
+            self.handled[index] += sum(handled.values())
+
+        runner = self.runner_class(
+            self.models,
+            schedule_interval=self.schedule_interval,
+            run_for=self.run_for,
+            shard=self.child_shard(index),
+            runner_id=f"{self.runner_id}-{index}",
+            drain_timeout=self.drain_timeout,
+            heartbeat=heartbeat,
+            **self.runner_kwargs,
+        )
+        try:
+            runner.run()
+        except KeyboardInterrupt:
+            pass
+
+    def check_children(self):
+        """
+        Replaces any children that have exited or gone quiet.
+        """
+        for index, child in enumerate(self.children):
+            if not child.is_alive():
+                logger.warning(
+                    f"Runner {index} (pid {child.pid}) exited with code {child.exitcode}, restarting"
+                )
+                child.join()
+                self.start_child(index)
+            elif time.time() - self.heartbeats[index] > self.stale_after:
+                logger.warning(
+                    f"Runner {index} (pid {child.pid}) stopped checking in, restarting"
+                )
+                child.kill()
+                child.join()
+                self.start_child(index)
+
+    def report(self):
+        """
+        Logs what the children have done, and writes the liveness file if
+        every child is still checking in.
+        """
+        logger.info(
+            f"Runners have handled {sum(self.handled)} instances ("
+            + ", ".join(str(number) for number in self.handled)
+            + ")"
+        )
+        if self.liveness_file and all(
+            child.is_alive() and time.time() - heartbeat <= self.stale_after
+            for child, heartbeat in zip(self.children, self.heartbeats)
+        ):
+            with open(self.liveness_file, "w") as fh:
+                fh.write(str(int(time.time())))
+
+    def stop_children(self):
+        """
+        Asks every child to drain and exit, killing any that haven't a little
+        after their drain timeout.
+        """
+        for child in self.children:
+            if child.is_alive():
+                os.kill(child.pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.drain_timeout + 10
+        for child in self.children:
+            child.join(max(deadline - time.monotonic(), 0))
+            if child.is_alive():
+                logger.warning(f"Runner {child.name} did not stop, killing")
+                child.kill()
+                child.join()
+
+    def term_handler(self, signum, frame):
+        """
+        Treats SIGTERM like Ctrl-C, so the children get to drain.
+        """
+        raise KeyboardInterrupt()
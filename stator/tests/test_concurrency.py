@@ -0,0 +1,90 @@
+import pytest
+
+from stator.concurrency import ConcurrencyController
+from stator.runner import StatorRunner
+from users.models import Domain
+
+
+def test_controller_grows_with_backlog():
+    """
+    Tests that a busy pool with work waiting grows, up to the maximum.
+    """
+    controller = ConcurrencyController(2, 10, 4)
+    assert controller.update(busy=4, backlogs={"a": 100}) == 5
+    assert controller.update(busy=5, backlogs={"a": 100}) == 6
+    for _ in range(10):
+        controller.update(busy=controller.concurrency, backlogs={"a": 100})
+    assert controller.concurrency == 10
+    # A busy pool with nothing else waiting stays where it is
+    controller = ConcurrencyController(2, 10, 4)
+    assert controller.update(busy=4, backlogs={"a": 2}) == 4
+
+
+def test_controller_shrinks():
+    """
+    Tests that the pool shrinks sharply when the database is short of
+    connections or handlers slow down, and gently when idle.
+    """
+    controller = ConcurrencyController(2, 20, 16)
+    assert controller.update(busy=16, backlogs={"a": 100}, connection_usage=0.95) == 12
+    # Handlers suddenly taking five times as long
+    for _ in range(20):
+        controller.observe("a.new", 0.1)
+    for _ in range(5):
+        controller.observe("a.new", 0.5)
+    assert controller.latency_ratio > controller.latency_limit
+    assert controller.update(busy=12, backlogs={"a": 100}) == 9
+    # Until they run again, they don't keep it shrinking
+    assert controller.latency_ratio == 1.0
+    # Idle pools give back one slot at a time, down to the minimum
+    controller = ConcurrencyController(2, 20, 3)
+    assert controller.update(busy=0, backlogs={"a": 0}) == 2
+    assert controller.update(busy=0, backlogs={"a": 0}) == 2
+
+
+def test_controller_latency_per_kind():
+    """
+    Tests that handlers are only compared with others of the same kind, so
+    a mix of fast and slow ones isn't mistaken for a slowdown.
+    """
+    controller = ConcurrencyController(2, 20, 10)
+    for _ in range(20):
+        controller.observe("a.new", 0.1)
+        controller.observe("b.outgoing", 5)
+    for _ in range(5):
+        controller.observe("b.outgoing", 5)
+    assert controller.latency_ratio == pytest.approx(1.0)
+    assert controller.update(busy=10, backlogs={"a": 100}) == 11
+
+
+def test_controller_allocation():
+    """
+    Tests that slots are shared between models by backlog, with every model
+    keeping at least one.
+    """
+    controller = ConcurrencyController(1, 10, 10)
+    controller.allocate({"a": 900, "b": 100, "c": 0})
+    assert controller.model_limits == {"a": 9, "b": 1, "c": 1}
+    controller.allocate({"a": 0, "b": 0, "c": 0})
+    assert controller.model_limits == {"a": 1, "b": 1, "c": 1}
+    with pytest.raises(ValueError):
+        ConcurrencyController(5, 2, 3)
+
+
+@pytest.mark.django_db
+def test_runner_adjust_concurrency():
+    """
+    Tests that an adaptive runner measures its backlog and applies the
+    controller's per-model limits when claiming work.
+    """
+    for i in range(5):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    runner = StatorRunner([Domain], concurrency=2, concurrency_min=1, concurrency_max=8)
+    runner.tasks = {("users.domain", str(i)): None for i in range(2)}
+    runner.adjust_concurrency()
+    assert runner.concurrency == 3
+    assert runner.model_concurrency(Domain) == 3
+    # Non-adaptive runners keep the static per-model limit
+    assert (
+        StatorRunner([Domain], concurrency_per_model=4).model_concurrency(Domain) == 4
+    )
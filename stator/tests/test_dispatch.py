@@ -0,0 +1,136 @@
+import time
+
+import pytest
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.utils import timezone
+
+from stator import runner
+from stator.dispatch import dispatcher
+from users.models import Domain
+from users.models.domain import DomainStates
+
+
+def dispatch_outdated(monkeypatch):
+    """
+    Opts Domain's outdated state in to dispatch for the test.
+    """
+    monkeypatch.setattr(DomainStates.outdated, "dispatch", True)
+    monkeypatch.setattr(DomainStates, "dispatch_states", {DomainStates.outdated})
+
+
+@pytest.mark.django_db(transaction=True)
+def test_dispatch_on_commit(settings, monkeypatch, request):
+    """
+    Tests that, with dispatch on, rows arriving in states that opt in are
+    run in this process soon after they're committed, and not before.
+    """
+    # Make the pool threads close their connections so the test DB can go away
+    monkeypatch.setitem(connections.settings["default"], "CONN_MAX_AGE", 0)
+    settings.STATOR_DISPATCH = True
+    monkeypatch.setattr(dispatcher, "enabled", True)
+    dispatch_outdated(monkeypatch)
+
+    def handle_outdated(cls, instance):
+        return cls.updated
+
+    monkeypatch.setattr(DomainStates, "handle_outdated", classmethod(handle_outdated))
+    request.addfinalizer(dispatcher.shutdown)
+
+    with transaction.atomic():
+        for i in range(3):
+            Domain.objects.create(domain=f"remote{i}.test", local=False)
+        assert dispatcher.pending == {}
+    for _ in range(50):
+        if Domain.objects.filter(state=DomainStates.updated).count() == 3:
+            break
+        time.sleep(0.1)
+    assert Domain.objects.filter(state=DomainStates.updated).count() == 3
+    assert not Domain.objects.filter(state_locked_by__isnull=False).exists()
+
+    # Transitioning back into an immediate state dispatches it again
+    domain = Domain.objects.get(domain="remote0.test")
+    domain.transition_perform(DomainStates.outdated)
+    for _ in range(50):
+        domain.refresh_from_db()
+        if domain.state == DomainStates.updated:
+            break
+        time.sleep(0.1)
+    assert domain.state == DomainStates.updated
+
+    # States that don't opt in are left to the runners
+    monkeypatch.setattr(DomainStates.outdated, "dispatch", False)
+    monkeypatch.setattr(DomainStates, "dispatch_states", set())
+    Domain.objects.create(domain="remote3.test", local=False)
+    time.sleep(0.5)
+    assert Domain.objects.get(domain="remote3.test").state == DomainStates.outdated
+
+    # And nothing happens with it off
+    dispatch_outdated(monkeypatch)
+    settings.STATOR_DISPATCH = False
+    Domain.objects.create(domain="remote4.test", local=False)
+    time.sleep(0.5)
+    assert Domain.objects.get(domain="remote4.test").state == DomainStates.outdated
+
+
+@pytest.mark.django_db(transaction=True)
+def test_dispatch_leases(settings, monkeypatch, request):
+    """
+    Tests that dispatched work keeps its leases renewed for as long as it
+    runs, and that rows it didn't finish are unlocked straight away.
+    """
+    monkeypatch.setitem(connections.settings["default"], "CONN_MAX_AGE", 0)
+    settings.STATOR_DISPATCH = True
+    monkeypatch.setattr(dispatcher, "enabled", True)
+    monkeypatch.setattr(dispatcher, "lock_expiry", 0.6)
+    dispatch_outdated(monkeypatch)
+    request.addfinalizer(dispatcher.shutdown)
+    lock_checks = []
+
+    def handle_outdated(cls, instance):
+        # Run for a while longer than a single lease
+        time.sleep(1.5)
+        lock_checks.append(
+            Domain.objects.filter(
+                pk=instance.pk, state_locked_until__gt=timezone.now()
+            ).exists()
+        )
+        return cls.updated
+
+    monkeypatch.setattr(DomainStates, "handle_outdated", classmethod(handle_outdated))
+    Domain.objects.create(domain="remote0.test", local=False)
+    for _ in range(50):
+        if lock_checks:
+            break
+        time.sleep(0.1)
+    assert lock_checks == [True]
+
+    def broken(instance, in_thread=True):
+        broken_pks.append(instance.pk)
+        raise RuntimeError("Broken")
+
+    broken_pks: list[int] = []
+    monkeypatch.setattr(runner, "task_transition", broken)
+    domain = Domain.objects.create(domain="remote1.test", local=False)
+    for _ in range(50):
+        if broken_pks and dispatcher.claimed == {}:
+            break
+        time.sleep(0.1)
+    assert broken_pks == [domain.pk]
+    domain.refresh_from_db()
+    assert domain.state == DomainStates.outdated
+    assert domain.state_locked_by is None
+
+
+@pytest.mark.django_db
+def test_dispatch_runner_leaves_enabled(monkeypatch):
+    """
+    Tests that running a runner (as the .stator/ view does inside web
+    workers) doesn't turn dispatch off for the rest of the process, while
+    the runstator command does.
+    """
+    monkeypatch.setattr(dispatcher, "enabled", True)
+    runner.StatorRunner([Domain], run_for=1).run()
+    assert dispatcher.enabled
+    call_command("runstator", "--run-for", "1", "users.domain")
+    assert not dispatcher.enabled
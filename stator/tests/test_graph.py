@@ -10,7 +10,7 @@ def test_declare():
     """
 
     class TestGraph(StateGraph):
-        initial = State(try_interval=3600)
+        initial = State(try_interval=3600, dispatch=True)
         second = State(try_interval=1)
         third = State()
 
@@ -27,6 +27,7 @@ def test_declare():
 
     assert TestGraph.initial_state == TestGraph.initial
     assert TestGraph.terminal_states == {TestGraph.third}
+    assert TestGraph.dispatch_states == {TestGraph.initial}
 
     assert TestGraph.initial.handler == TestGraph.handle_initial
     assert TestGraph.initial.try_interval == 3600
@@ -67,3 +68,58 @@ def test_state():
     assert "initial" == TestGraph.initial
     assert TestGraph.initial == "initial"
     assert TestGraph.initial == TestGraph.initial
+
+
+def test_declare_batch():
+    """
+    Tests that batch states look up a batch handler instead, and must have
+    one.
+    """
+
+    class TestGraph(StateGraph):
+        initial = State(try_interval=3600, batch_size=10)
+        done = State()
+
+        initial.transitions_to(done)
+
+        @classmethod
+        def handle_initial_batch(cls, instances):
+            pass
+
+    assert TestGraph.initial.batch_size == 10
+    assert TestGraph.initial.batch_handler == TestGraph.handle_initial_batch
+    assert TestGraph.automatic_states == {TestGraph.initial}
+
+    with pytest.raises(ValueError):
+
+        class TestGraph2(StateGraph):
+            initial = State(try_interval=3600, batch_size=10)
+            done = State()
+
+            initial.transitions_to(done)
+
+            @classmethod
+            def handle_initial(cls, instance):
+                pass
+
+
+def test_retry_delay(monkeypatch):
+    """
+    Tests that retry delays back off exponentially up to the cap, with
+    jitter applied on top.
+    """
+
+    plain = State(try_interval=60)
+    backoff = State(try_interval=60, backoff_multiplier=2, backoff_cap=300)
+    jittered = State(try_interval=100, backoff_jitter=0.1)
+
+    assert [plain.retry_delay(n) for n in range(3)] == [60, 60, 60]
+    assert [backoff.retry_delay(n) for n in range(5)] == [
+        60,
+        120,
+        240,
+        300,
+        300,
+    ]
+    monkeypatch.setattr("random.uniform", lambda a, b: b)
+    assert jittered.retry_delay(0) == pytest.approx(110)
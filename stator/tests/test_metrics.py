@@ -0,0 +1,82 @@
+import pytest
+
+from stator.metrics import DURATION_BUCKETS, MetricsRecorder, render_metrics
+from stator.models import StatorMetric
+from users.models import Domain
+
+
+@pytest.mark.django_db
+def test_metrics_flush():
+    """
+    Tests that flushing adds to both the hourly and all-time rows, rather
+    than overwriting what other runners already wrote.
+    """
+    recorder = MetricsRecorder()
+    for _ in range(2):
+        recorder.observe("users.domain", "outdated", 0.02)
+        recorder.observe("users.domain", "outdated", 100, handled=5)
+        recorder.fail("users.domain", "outdated")
+        recorder.time_out("users.domain", "outdated", 3)
+        recorder.set_queued("users.domain", "outdated", 7)
+        recorder.flush()
+
+    rows = StatorMetric.objects.filter(model_label="users.domain", state="outdated")
+    assert rows.count() == 2
+    for row in rows:
+        assert row.handled == 12
+        assert row.failed == 2
+        assert row.timed_out == 6
+        assert row.duration_sum == pytest.approx(200.04)
+        assert row.queued == 7
+        assert len(row.duration_buckets) == len(DURATION_BUCKETS) + 1
+        assert row.duration_buckets[1] == 2
+        assert row.duration_buckets[-1] == 2
+        assert sum(row.duration_buckets) == 4
+
+    summary = StatorMetric.summary_for_model(Domain)
+    assert summary["queued"] == 7
+    assert summary["handled_today"] == 12
+    assert summary["failed_today"] == 2
+    assert summary["handled_month"] == 12
+    assert summary["average_duration"] == pytest.approx(50.01)
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint(client, settings):
+    """
+    Tests the metrics endpoint needs the token, and renders both formats.
+    """
+    recorder = MetricsRecorder()
+    recorder.observe("users.domain", "outdated", 0.3)
+    recorder.set_queued("users.domain", "outdated", 3)
+    recorder.flush()
+
+    settings.STATOR_TOKEN = "secret"
+    assert client.get("/.stator/metrics/").status_code == 403
+
+    assert client.get("/.stator/metrics/?token=wrong").status_code == 403
+
+    response = client.get("/.stator/metrics/?token=secret")
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    body = response.content.decode()
+    assert "# TYPE stator_handled_total counter" in body
+    assert 'stator_handled_total{model="users.domain",state="outdated"} 1' in body
+    assert (
+        'stator_handler_duration_seconds_bucket{model="users.domain",state="outdated",le="0.25"} 0'
+        in body
+    )
+    assert (
+        'stator_handler_duration_seconds_bucket{model="users.domain",state="outdated",le="0.5"} 1'
+        in body
+    )
+    assert 'stator_queued{model="users.domain",state="outdated"} 3' in body
+
+    response = client.get(
+        "/.stator/metrics/?token=secret",
+        HTTP_ACCEPT="application/openmetrics-text; version=1.0.0",
+    )
+    assert response["Content-Type"].startswith("application/openmetrics-text")
+    assert response.content.decode() == render_metrics(openmetrics=True)
+    assert "# TYPE stator_handled counter" in response.content.decode()
+    assert response.content.decode().endswith("# EOF\n")
@@ -0,0 +1,370 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.db import connection, connections, models, transaction
+from django.utils import timezone
+
+from activities.models import FanOut
+from stator import metrics
+from users.models import Domain
+from users.models.domain import DomainStates
+
+
+@pytest.mark.django_db
+def test_transition_get_with_lock():
+    """
+    Tests that claiming locks rows, tags them with the runner, and never
+    hands the same row out twice.
+    """
+    for i in range(3):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    lock_expiry = timezone.now() + datetime.timedelta(seconds=300)
+
+    claimed = Domain.transition_get_with_lock(2, lock_expiry, runner_id="runner-a")
+    assert len(claimed) == 2
+    for domain in claimed:
+        assert domain.state_locked_until == lock_expiry
+        assert domain.state_locked_by == "runner-a"
+
+    rest = Domain.transition_get_with_lock(5, lock_expiry, runner_id="runner-b")
+    assert len(rest) == 1
+    assert rest[0].pk not in {domain.pk for domain in claimed}
+    assert Domain.transition_get_with_lock(5, lock_expiry) == []
+    assert Domain.transition_get_with_lock(0, lock_expiry) == []
+
+    # Unlocking clears the owner as well
+    Domain.objects.update(state_locked_until=timezone.now())
+    Domain.transition_clean_locks()
+    assert not Domain.objects.filter(state_locked_by__isnull=False).exists()
+
+
+@pytest.mark.django_db
+def test_transition_get_with_lock_skips_not_ready():
+    """
+    Tests that rows in non-automatic states, or with a future next attempt,
+    are not claimed.
+    """
+    Domain.objects.create(domain="manual.test", local=False, state="connection_issue")
+    Domain.objects.create(
+        domain="later.test",
+        local=False,
+        state_next_attempt=timezone.now() + datetime.timedelta(hours=1),
+    )
+    lock_expiry = timezone.now() + datetime.timedelta(seconds=300)
+    assert Domain.transition_get_with_lock(10, lock_expiry) == []
+
+
+@pytest.mark.django_db
+def test_transition_get_with_lock_shards():
+    """
+    Tests that sharded claims split the rows between the shards, with every
+    row going to exactly one of them.
+    """
+    for i in range(20):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    lock_expiry = timezone.now() + datetime.timedelta(seconds=300)
+
+    first = Domain.transition_get_with_lock(100, lock_expiry, shard=(0, 2))
+    second = Domain.transition_get_with_lock(100, lock_expiry, shard=(1, 2))
+    assert first and second
+    assert {domain.pk for domain in first}.isdisjoint(domain.pk for domain in second)
+    assert len(first) + len(second) == 20
+
+
+@pytest.mark.django_db
+def test_transition_get_with_lock_reshard():
+    """
+    Tests that shards are hash ranges, so splitting a shard in two claims
+    exactly the rows the original shard would have.
+    """
+    for i in range(20):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    lock_expiry = timezone.now() + datetime.timedelta(seconds=300)
+
+    with transaction.atomic():
+        whole = Domain.transition_get_with_lock(100, lock_expiry, shard=(1, 2))
+        transaction.set_rollback(True)
+    halves = Domain.transition_get_with_lock(
+        100, lock_expiry, shard=(2, 4)
+    ) + Domain.transition_get_with_lock(100, lock_expiry, shard=(3, 4))
+    assert {domain.pk for domain in whole} == {domain.pk for domain in halves}
+
+
+def test_transition_shard_bounds():
+    """
+    Tests that shard ranges cover every hash value exactly once.
+    """
+    bounds = [Domain.transition_shard_bounds(index, 3) for index in range(3)]
+    assert bounds[0][0] == 0
+    assert bounds[-1][1] == 2**31
+    assert all(bounds[i][1] == bounds[i + 1][0] for i in range(2))
+    with pytest.raises(ValueError):
+        Domain.transition_shard_bounds(3, 3)
+
+
+@pytest.mark.django_db
+def test_transition_get_with_lock_pks():
+    """
+    Tests that claims can be limited to particular rows.
+    """
+    for i in range(3):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    lock_expiry = timezone.now() + datetime.timedelta(seconds=300)
+
+    claimed = Domain.transition_get_with_lock(
+        10, lock_expiry, pks=["remote1.test", "missing.test"]
+    )
+    assert [domain.pk for domain in claimed] == ["remote1.test"]
+    assert Domain.transition_get_with_lock(10, lock_expiry, pks=["remote1.test"]) == []
+
+
+@pytest.mark.django_db
+def test_transition_lock_leases():
+    """
+    Tests that runners can renew and release only their own locks.
+    """
+    for i in range(4):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    soon = timezone.now() + datetime.timedelta(seconds=30)
+    Domain.transition_get_with_lock(2, soon, runner_id="runner-a")
+    Domain.transition_get_with_lock(1, soon, runner_id="runner-b")
+
+    later = timezone.now() + datetime.timedelta(seconds=60)
+    assert Domain.transition_renew_locks("runner-a", later) == 2
+    assert Domain.objects.filter(state_locked_until=later).count() == 2
+    assert Domain.transition_release_locks("runner-a") == 2
+    assert list(
+        Domain.objects.filter(state_locked_until__isnull=False).values_list(
+            "state_locked_by", flat=True
+        )
+    ) == ["runner-b"]
+    # Rows whose lease was broken aren't renewed
+    Domain.objects.update(state_locked_until=timezone.now())
+    Domain.transition_clean_locks()
+    assert Domain.transition_renew_locks("runner-b", later) == 0
+
+
+@pytest.mark.django_db
+def test_transition_complete_lost_lease():
+    """
+    Tests that a runner whose lease ran out, and whose row was claimed by
+    another runner since, can't write its results over the new owner's.
+    """
+    Domain.objects.create(domain="remote.test", local=False)
+    soon = timezone.now() + datetime.timedelta(seconds=30)
+    (stale,) = Domain.transition_get_with_lock(1, soon, runner_id="runner-a")
+    Domain.objects.update(state_locked_until=timezone.now())
+    Domain.transition_clean_locks()
+    Domain.transition_get_with_lock(1, soon, runner_id="runner-b")
+
+    assert (
+        stale.transition_complete(DomainStates.outdated, DomainStates.updated) is None
+    )
+    stale.transition_complete(DomainStates.outdated, None)
+    domain = Domain.objects.get(pk="remote.test")
+    assert domain.state == DomainStates.outdated
+    assert domain.state_locked_by == "runner-b"
+    assert domain.state_attempts == 0
+
+
+@pytest.mark.django_db
+def test_transition_attempt_batch(monkeypatch):
+    """
+    Tests that batch states hand all instances to the batch handler at once,
+    and apply what it returns to each instance.
+    """
+    calls = []
+
+    def handle_outdated_batch(cls, instances):
+        calls.append(sorted(instance.pk for instance in instances))
+        return {
+            instance.pk: cls.updated
+            for instance in instances
+            if instance.pk != "remote1.test"
+        }
+
+    monkeypatch.setattr(DomainStates.outdated, "batch_size", 10)
+    monkeypatch.setattr(
+        DomainStates,
+        "handle_outdated_batch",
+        classmethod(handle_outdated_batch),
+        raising=False,
+    )
+    for i in range(3):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    lock_expiry = timezone.now() + datetime.timedelta(seconds=300)
+    instances = Domain.transition_get_with_lock(10, lock_expiry, runner_id="runner-a")
+
+    results = Domain.transition_attempt_batch(instances)
+    assert calls == [["remote0.test", "remote1.test", "remote2.test"]]
+    assert results == {
+        "remote0.test": DomainStates.updated,
+        "remote1.test": None,
+        "remote2.test": DomainStates.updated,
+    }
+    assert Domain.objects.filter(state=DomainStates.updated).count() == 2
+    # The one the handler left alone is unlocked and tried again later
+    unchanged = Domain.objects.get(pk="remote1.test")
+    assert unchanged.state == DomainStates.outdated
+    assert unchanged.state_locked_until is None
+    assert unchanged.state_next_attempt is not None
+
+    # Single instances in a batch state go through the batch handler too
+    assert unchanged.transition_attempt() is None
+    assert calls[-1] == ["remote1.test"]
+
+
+@pytest.mark.django_db
+def test_transition_backoff(monkeypatch):
+    """
+    Tests that failed attempts are counted and push the next attempt further
+    out, and that changing state resets the count.
+    """
+    monkeypatch.setattr(DomainStates.outdated, "backoff_multiplier", 2)
+    monkeypatch.setattr(
+        DomainStates, "handle_outdated", classmethod(lambda cls, instance: None)
+    )
+    domain = Domain.objects.create(domain="remote.test", local=False)
+    try_interval = DomainStates.outdated.try_interval
+
+    for attempts in range(3):
+        started = timezone.now()
+        assert domain.transition_attempt() is None
+        domain.refresh_from_db()
+        assert domain.state_attempts == attempts + 1
+        delay = (domain.state_next_attempt - started).total_seconds()
+        assert delay == pytest.approx(try_interval * 2**attempts, abs=5)
+
+    domain.transition_perform(DomainStates.updated)
+    domain.refresh_from_db()
+    assert domain.state_attempts == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_transition_handler_timeout(monkeypatch):
+    """
+    Tests that sync handlers which run out of time are abandoned (their rows
+    released to be retried with a backoff, and their result ignored) rather
+    than interrupted, that async ones are cancelled and retried later, and
+    that both are counted.
+    """
+    # Make the watchdog close its connection so the test DB can go away
+    monkeypatch.setitem(connections.settings["default"], "CONN_MAX_AGE", 0)
+    timed_out = []
+    monkeypatch.setattr(
+        metrics.recorder,
+        "time_out",
+        lambda label, state, number=1: timed_out.append((label, str(state))),
+    )
+    monkeypatch.setattr(DomainStates.outdated, "handler_timeout", 0.1)
+    lock_expiry = timezone.now() + datetime.timedelta(seconds=30)
+    Domain.objects.create(domain="remote.test", local=False)
+    [domain] = Domain.transition_get_with_lock(1, lock_expiry, runner_id="runner")
+
+    def handle_outdated(cls, instance):
+        # The handler keeps going (it isn't interrupted) after its row has
+        # been released
+        started = time.monotonic()
+        while time.monotonic() - started < 5:
+            if Domain.objects.filter(
+                pk=instance.pk, state_locked_until__isnull=True
+            ).exists():
+                break
+            time.sleep(0.05)
+        return DomainStates.updated
+
+    monkeypatch.setattr(DomainStates, "handle_outdated", classmethod(handle_outdated))
+    started = timezone.now()
+    assert domain.transition_attempt() is None
+    domain.refresh_from_db()
+    assert domain.state == DomainStates.outdated
+    assert domain.state_attempts == 1
+    assert domain.state_locked_until is None
+    assert domain.state_locked_by is None
+    delay = (domain.state_next_attempt - started).total_seconds()
+    assert delay == pytest.approx(DomainStates.outdated.try_interval, abs=5)
+    assert timed_out == [("users.domain", "outdated")]
+
+    async def ahandle_outdated(cls, instance):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(DomainStates, "ahandle_outdated", classmethod(ahandle_outdated))
+    started = time.monotonic()
+    assert async_to_sync(domain.atransition_attempt)() is None
+    assert time.monotonic() - started < 5
+    assert len(timed_out) == 2
+
+
+@pytest.mark.django_db
+def test_partial_indexes():
+    """
+    Tests that Stator's indexes only cover rows it will look for, and that
+    its queries can use them.
+    """
+    indexes = {index.name: index for index in Domain._meta.indexes}
+    assert indexes["ix_domain_ready"].condition == models.Q(
+        state__in=["outdated", "updated"], state_locked_until__isnull=True
+    )
+    assert "ix_domain_delete" not in indexes
+
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        ready_plan = Domain.objects.filter(
+            state__in=["outdated", "updated"],
+            state_locked_until__isnull=True,
+            state_next_attempt__lte=timezone.now(),
+        ).explain()
+        locked_plan = Domain.objects.filter(
+            state_locked_until__lte=timezone.now()
+        ).explain()
+    assert "ix_domain_ready" in ready_plan
+    assert "ix_domain_locked" in locked_plan
+
+
+@pytest.mark.django_db
+def test_shard_index():
+    """
+    Tests that sharded models get an index the shard claim query can use.
+    """
+    assert "ix_domain_shard" not in {index.name for index in Domain._meta.indexes}
+    assert "ix_fanout_shard" in {index.name for index in FanOut._meta.indexes}
+
+    start, end = FanOut.transition_shard_bounds(1, 4)
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute(
+            f"""
+            EXPLAIN SELECT id FROM activities_fanout
+            WHERE state = ANY(%s) AND state_locked_until IS NULL
+            AND {FanOut.transition_shard_sql()} >= %s
+            AND {FanOut.transition_shard_sql()} < %s
+            """,
+            [["new"], start, end],
+        )
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+    assert "ix_fanout_shard" in plan
+
+
+@pytest.mark.django_db
+def test_transition_ready_counts(settings, monkeypatch):
+    """
+    Tests each way of counting queues gives a sensible answer.
+    """
+    for i in range(5):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    Domain.objects.create(domain="later.test", local=False, state="updated")
+    monkeypatch.setattr(Domain, "QUEUE_COUNT_CAP", 3)
+
+    assert Domain.transition_queue_count_mode() == "exact"
+    assert Domain.transition_ready_counts() == {"outdated": 5, "updated": 1}
+
+    settings.STATOR_QUEUE_COUNT = {"users.domain": "capped"}
+    assert Domain.transition_ready_counts() == {"outdated": 3, "updated": 1}
+
+    settings.STATOR_QUEUE_COUNT = {"users.domain": "estimate"}
+    counts = Domain.transition_ready_counts()
+    assert set(counts) == {"outdated", "updated"}
+    assert all(isinstance(count, int) and count >= 0 for count in counts.values())
@@ -0,0 +1,250 @@
+import datetime
+
+import pytest
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.utils import timezone
+
+from activities.models import FanOut, FanOutStates
+from api.models import Application, PushNotification, PushType, Token
+from api.models.push import PushNotificationStates
+from stator import partitions
+from stator.operations import RemoveIndexConcurrently
+from users.models import (
+    Domain,
+    Identity,
+    InboxMessage,
+    InboxMessageStates,
+    User,
+)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_partition_table():
+    """
+    Tests converting a table to daily partitions and back keeps its rows,
+    and that expired partitions are dropped whole.
+    """
+    old = InboxMessage.objects.create(message={"type": "test"})
+    recent = InboxMessage.objects.create(message={"type": "test"})
+    ten_days_ago = timezone.now() - datetime.timedelta(days=10)
+    InboxMessage.objects.filter(pk=old.pk).update(
+        created=ten_days_ago,
+        state=InboxMessageStates.processed,
+        state_changed=ten_days_ago,
+    )
+
+    partitions.partition_table(InboxMessage)
+    try:
+        assert partitions.is_partitioned(InboxMessage)
+        days = partitions.list_partitions(InboxMessage)
+        today = timezone.now().astimezone(datetime.UTC).date()
+        assert min(days) == ten_days_ago.astimezone(datetime.UTC).date()
+        assert max(days) == today + datetime.timedelta(days=partitions.DAYS_AHEAD)
+        assert InboxMessage.objects.count() == 2
+        # IDs carry on from where they were
+        assert InboxMessage.objects.create(message={"type": "test"}).pk > recent.pk
+
+        # Only the old, fully processed day goes, along with the empty days
+        # after it that are also past the horizon
+        assert InboxMessage.transition_delete_due() == 1
+        assert not InboxMessage.objects.filter(pk=old.pk).exists()
+        assert InboxMessage.objects.filter(pk=recent.pk).exists()
+        assert today in partitions.list_partitions(InboxMessage)
+    finally:
+        partitions.unpartition_table(InboxMessage)
+    assert not partitions.is_partitioned(InboxMessage)
+    assert InboxMessage.objects.count() == 2
+    assert InboxMessage.objects.create(message={"type": "test"}).pk > recent.pk
+
+
+@pytest.mark.django_db(transaction=True)
+def test_partition_default():
+    """
+    Tests that rows with no daily partition to go in (because Stator has been
+    down past the horizon) are still inserted, and moved out of the DEFAULT
+    partition once their day's partition is made.
+    """
+
+    def partition_of(message) -> str:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT tableoid::regclass::text FROM users_inboxmessage WHERE id = %s",
+                [message.pk],
+            )
+            return cursor.fetchone()[0]
+
+    partitions.partition_table(InboxMessage)
+    try:
+        today = timezone.now().astimezone(datetime.UTC).date()
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        days = partitions.list_partitions(InboxMessage)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {days[today]}")
+        message = InboxMessage.objects.create(message={"type": "test"})
+        assert partition_of(message) == "users_inboxmessage_default"
+        # Including ones from days before the partitions that are left
+        late = InboxMessage.objects.create(message={"type": "test"})
+        InboxMessage.objects.filter(pk=late.pk).update(created=yesterday)
+        assert partition_of(late) == "users_inboxmessage_default"
+
+        created = partitions.ensure_partitions(InboxMessage)
+        assert created == [
+            f"users_inboxmessage_p{yesterday.astimezone(datetime.UTC):%Y%m%d}",
+            days[today],
+        ]
+        assert partition_of(message) == days[today]
+        assert partition_of(late) == created[0]
+        assert InboxMessage.objects.count() == 2
+        # They get all of the table's indexes
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT tablename, COUNT(*) FROM pg_indexes WHERE tablename = ANY(%s) "
+                "GROUP BY tablename",
+                [[days[today], "users_inboxmessage"]],
+            )
+            counts = dict(cursor.fetchall())
+        assert counts[days[today]] == counts["users_inboxmessage"]
+    finally:
+        partitions.unpartition_table(InboxMessage)
+    assert InboxMessage.objects.count() == 2
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("model", [FanOut, PushNotification])
+def test_partition_other_models(model):
+    """
+    Tests the other partitionable models can be partitioned, have their
+    DEFAULT partition emptied and their expired partitions dropped, and be
+    converted back, with their foreign keys intact.
+    """
+    domain = Domain.objects.create(domain="example.com", local=True)
+    identity = Identity.objects.create(
+        actor_uri="https://example.com/@test@example.com/",
+        username="test",
+        domain=domain,
+        local=True,
+    )
+    user = User.objects.create(email="test@example.com")
+    token = Token.objects.create(
+        application=Application.objects.create(
+            name="Test App", client_id="tk-test", client_secret="secret"
+        ),
+        user=user,
+        identity=identity,
+        token="testtoken",
+        scopes=["push"],
+    )
+    if model is FanOut:
+        done = FanOutStates.sent
+
+        def create():
+            return FanOut.objects.create(identity=identity, type=FanOut.Types.post)
+
+    else:
+        done = PushNotificationStates.sent
+
+        def create():
+            return PushNotification.objects.create(
+                token=token, type=PushType.mention, icon="", title="Test"
+            )
+
+    old = create()
+    ten_days_ago = timezone.now() - datetime.timedelta(days=10)
+    model.objects.filter(pk=old.pk).update(
+        created=ten_days_ago, state=done, state_changed=ten_days_ago
+    )
+    table = model._meta.db_table
+
+    partitions.partition_table(model)
+    try:
+        today = timezone.now().astimezone(datetime.UTC).date()
+        days = partitions.list_partitions(model)
+        assert min(days) == ten_days_ago.astimezone(datetime.UTC).date()
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {days[today]}")
+        # Goes in the DEFAULT partition, and is moved out of it
+        create()
+        assert partitions.ensure_partitions(model) == [days[today]]
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}_default")
+            assert cursor.fetchone()[0] == 0
+        assert model.objects.count() == 2
+        assert model.transition_delete_due() == 1
+        assert not model.objects.filter(pk=old.pk).exists()
+    finally:
+        partitions.unpartition_table(model)
+    assert model.objects.count() == 1
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM pg_constraint WHERE conrelid = %s::regclass "
+            "AND contype = 'f'",
+            [table],
+        )
+        assert cursor.fetchone()[0] == len(
+            [field for field in model._meta.concrete_fields if field.remote_field]
+        )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_index_operations_partitioned():
+    """
+    Tests that Stator's concurrent index operations still work once a table
+    has been partitioned (which can't have indexes built concurrently).
+    """
+    state = MigrationLoader(connection).project_state(
+        ("users", "0037_inboxmessage_shard_index")
+    )
+    removed = state.clone()
+    operation = RemoveIndexConcurrently("inboxmessage", "ix_inboxmessag_shard")
+    operation.state_forwards("users", removed)
+
+    def has_index() -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_inboxmessag_shard'"
+            )
+            return cursor.fetchone() is not None
+
+    partitions.partition_table(InboxMessage)
+    try:
+        with connection.schema_editor(atomic=False) as editor:
+            operation.database_forwards("users", editor, state, removed)
+            assert not has_index()
+            operation.database_backwards("users", editor, removed, state)
+            assert has_index()
+    finally:
+        partitions.unpartition_table(InboxMessage)
+    # And ordinary tables still get them concurrently
+    with connection.schema_editor(atomic=False) as editor:
+        operation.database_forwards("users", editor, state, removed)
+        assert not has_index()
+        operation.database_backwards("users", editor, removed, state)
+        assert has_index()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shard_index_migration_partitioned():
+    """
+    Tests that the shard index migration can be applied (and reversed) on a
+    partitioned table.
+    """
+    loader = MigrationLoader(connection)
+    before = loader.project_state(("users", "0036_stator_partial_indexes"))
+    after = loader.project_state(("users", "0037_inboxmessage_shard_index"))
+    migration = loader.get_migration("users", "0037_inboxmessage_shard_index")
+
+    partitions.partition_table(InboxMessage)
+    try:
+        with connection.schema_editor(atomic=False) as editor:
+            for operation in migration.operations:
+                operation.database_backwards("users", editor, after, before)
+            for operation in migration.operations:
+                operation.database_forwards("users", editor, before, after)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_inboxmessag_shard'"
+            )
+            assert cursor.fetchone() is not None
+    finally:
+        partitions.unpartition_table(InboxMessage)
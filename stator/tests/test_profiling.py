@@ -0,0 +1,75 @@
+import time
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from stator.models import StatorProfile, StatorSlowTask
+from stator.profiling import normalize_sql, profiler
+from stator.runner import task_transition
+from users.models import Domain
+from users.models.domain import DomainStates
+
+
+def test_normalize_sql():
+    """
+    Tests that queries differing only in how many parameters they take are
+    counted together.
+    """
+    assert (
+        normalize_sql("SELECT 1 FROM t WHERE id IN (%s, %s, %s) AND x = %s")
+        == "SELECT 1 FROM t WHERE id IN (%s, ...) AND x = %s"
+    )
+    assert normalize_sql("INSERT INTO t VALUES (%s, %s), (%s, %s)") == (
+        "INSERT INTO t VALUES (%s, ...), ..."
+    )
+
+
+@pytest.mark.django_db
+def test_profile_transition(settings, monkeypatch):
+    """
+    Tests that the profiler samples handler stacks and queries, captures
+    slow transitions, and that profilestator reports them.
+    """
+
+    def handle_outdated(cls, instance):
+        Domain.objects.count()
+        time.sleep(0.2)
+        return cls.updated
+
+    monkeypatch.setattr(DomainStates, "handle_outdated", classmethod(handle_outdated))
+    settings.STATOR_PROFILE = True
+    settings.STATOR_PROFILE_INTERVAL = 0.01
+    settings.STATOR_PROFILE_SLOW = 0.1
+    domain = Domain.objects.create(domain="remote.test", local=False)
+
+    profiler.start()
+    try:
+        task_transition(domain, in_thread=False)
+    finally:
+        profiler.stop()
+    profiler.flush()
+
+    stacks = StatorProfile.objects.filter(kind="stack", model_label="users.domain")
+    assert stacks.exists()
+    assert all(row.key.startswith("stator.models.") for row in stacks)
+    assert any("handle_outdated" in row.key for row in stacks)
+    queries = StatorProfile.objects.filter(kind="query", state="outdated")
+    assert any('COUNT(*) AS "__count"' in row.key for row in queries)
+    slow_task = StatorSlowTask.objects.get()
+    assert slow_task.pks == ["remote.test"]
+    assert slow_task.duration >= 0.2
+    assert slow_task.samples and slow_task.queries
+
+    output = StringIO()
+    call_command("profilestator", stdout=output)
+    assert "users.domain.outdated" in output.getvalue()
+    assert "handle_outdated" in output.getvalue()
+
+
+def test_profiler_off():
+    """
+    Tests that transitions aren't tracked unless the profiler is running.
+    """
+    with profiler.task("users.domain", "outdated", ["remote.test"]):
+        assert not profiler.tasks
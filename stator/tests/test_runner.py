@@ -0,0 +1,423 @@
+import datetime
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httpx
+import pytest
+from django.db import connections
+from django.utils import timezone
+
+from activities.models import Hashtag
+from activities.models.hashtag import HashtagStates
+
+from stator import partitions, timeouts
+from stator.runner import AsyncStatorRunner, NotifyListener, StatorRunner
+from stator.supervisor import StatorSupervisor
+from users.models import Domain
+from users.models.domain import DomainStates
+
+
+@pytest.mark.django_db(transaction=True)
+def test_notify_listener(settings):
+    """
+    Tests that saving or transitioning a model into an immediately-runnable
+    state wakes up a listening runner, and that nothing else does.
+    """
+    settings.STATOR_NOTIFY = True
+    listener = NotifyListener()
+    try:
+        domain = Domain.objects.create(domain="remote.test", local=False)
+        assert listener.wait(1) == {"users.domain"}
+        # Updated is not attempted immediately, so nobody needs waking
+        domain.transition_perform(DomainStates.updated)
+        assert listener.wait(0.1) == set()
+        domain.transition_perform(DomainStates.outdated)
+        assert listener.wait(1) == {"users.domain"}
+        # And with the setting off, there's no notification at all
+        settings.STATOR_NOTIFY = False
+        Domain.objects.create(domain="remote2.test", local=False)
+        assert listener.wait(0.1) == set()
+    finally:
+        listener.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_runner_wait_wakes_on_notify(settings):
+    """
+    Tests that a runner waiting with a listener returns as soon as there's
+    new work, and resets its backoff.
+    """
+    settings.STATOR_NOTIFY = True
+    runner = StatorRunner([Domain], notify=True)
+    runner.start_listener()
+    try:
+        runner.loop_delay = runner.maximum_notify_loop_delay
+        Domain.objects.create(domain="remote.test", local=False)
+        runner.wait(runner.loop_delay)
+        assert runner.loop_delay == runner.minimum_loop_delay
+    finally:
+        runner.listener.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_runner(monkeypatch, httpx_mock):
+    """
+    Tests that the asyncio runner awaits the async handlers of the states
+    that have them on its loop, with their database access going through
+    its thread pool, and writes their results back.
+    """
+    # Make the pool threads close their connections so the test DB can go away
+    monkeypatch.setitem(connections.settings["default"], "CONN_MAX_AGE", 0)
+    threads: dict[str, set[str]] = {"fetch": set(), "save": set()}
+
+    async def nodeinfo(request):
+        threads["fetch"].add(threading.current_thread().name)
+        return httpx.Response(
+            200,
+            json={
+                "version": "2.0",
+                "software": {"name": "takahe"},
+                "openRegistrations": False,
+                "usage": {},
+            },
+        )
+
+    httpx_mock.add_callback(nodeinfo, is_reusable=True)
+    for i in range(3):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    save = Domain.save
+
+    def record_save(self, *args, **kwargs):
+        threads["save"].add(threading.current_thread().name)
+        return save(self, *args, **kwargs)
+
+    monkeypatch.setattr(Domain, "save", record_save)
+
+    runner = AsyncStatorRunner([Domain], run_for=1)
+    assert runner.async_states == {("users.domain", "outdated")}
+    assert runner.pooled_models == [Domain]
+    runner.run()
+    assert Domain.objects.filter(state=DomainStates.updated).count() == 3
+    assert not Domain.objects.filter(state_locked_by__isnull=False).exists()
+    assert all(
+        nodeinfo["software"]["name"] == "takahe"
+        for nodeinfo in Domain.objects.values_list("nodeinfo", flat=True)
+    )
+    # The fetches ran on the event loop, and the saves off it
+    assert threads["fetch"] == {"stator-asyncio"}
+    assert threads["save"] and "stator-asyncio" not in threads["save"]
+
+
+@pytest.mark.django_db
+def test_runner_batches(monkeypatch):
+    """
+    Tests that the runner claims enough rows to fill batches for batch
+    states, and runs each batch as one task.
+    """
+    calls = []
+
+    def handle_outdated_batch(cls, instances):
+        calls.append(len(instances))
+        return {instance.pk: cls.updated for instance in instances}
+
+    # Every automatic state needs to batch for the runner to claim whole batches
+    monkeypatch.setattr(DomainStates.outdated, "batch_size", 2)
+    monkeypatch.setattr(DomainStates.updated, "batch_size", 2)
+    monkeypatch.setattr(
+        DomainStates,
+        "handle_outdated_batch",
+        classmethod(handle_outdated_batch),
+        raising=False,
+    )
+    for i in range(5):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+
+    runner = StatorRunner([Domain], concurrency_per_model=2)
+    runner.handled = {}
+    runner.add_transition_tasks(call_inline=True)
+    # Two tasks' worth of batches of two
+    assert calls == [2, 2]
+    assert runner.handled == {"users.domain": 4}
+    runner.add_transition_tasks(call_inline=True)
+    assert calls == [2, 2, 1]
+    assert Domain.objects.filter(state=DomainStates.updated).count() == 5
+
+
+@pytest.mark.django_db(transaction=True)
+def test_supervisor(monkeypatch):
+    """
+    Tests that the supervisor's child processes share out the work between
+    them and report back what they handled.
+    """
+
+    def handle_outdated(cls, instance):
+        return cls.updated
+
+    monkeypatch.setattr(DomainStates, "handle_outdated", classmethod(handle_outdated))
+    for i in range(6):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+
+    supervisor = StatorSupervisor([Domain], processes=2, run_for=2, schedule_interval=1)
+    supervisor.run()
+    assert all(child.exitcode == 0 for child in supervisor.children)
+    assert Domain.objects.filter(state=DomainStates.updated).count() == 6
+    assert sum(supervisor.handled) == 6
+
+
+def test_supervisor_shards():
+    """
+    Tests that a supervisor given a shard splits it between its children.
+    """
+    supervisor = StatorSupervisor([Domain], processes=2, shard=(1, 3))
+    assert [supervisor.child_shard(index) for index in range(2)] == [(2, 6), (3, 6)]
+    assert StatorSupervisor([Domain], processes=2).child_shard(1) == (1, 2)
+
+
+@pytest.mark.django_db
+def test_runner_priorities(monkeypatch):
+    """
+    Tests that a big backlog in one model doesn't starve a higher-priority
+    model that comes after it, and that neither starves the other.
+    """
+    handled = []
+
+    def handle_outdated(cls, instance):
+        handled.append("domain")
+        return cls.updated
+
+    def handle_outdated_batch(cls, instances):
+        handled.extend(["hashtag"] * len(instances))
+        return {instance.pk: cls.updated for instance in instances}
+
+    monkeypatch.setattr(DomainStates, "handle_outdated", classmethod(handle_outdated))
+    monkeypatch.setattr(
+        HashtagStates, "handle_outdated_batch", classmethod(handle_outdated_batch)
+    )
+    monkeypatch.setattr(HashtagStates.outdated, "batch_size", 1)
+    monkeypatch.setattr(HashtagStates.outdated, "priority", 3)
+    for i in range(20):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+        Hashtag.objects.create(hashtag=f"tag{i}")
+
+    runner = StatorRunner([Domain, Hashtag], concurrency=4, concurrency_per_model=4)
+    runner.handled = {}
+    runner.add_transition_tasks(call_inline=True)
+    assert sorted(handled) == ["domain", "hashtag", "hashtag", "hashtag"]
+    # One slot at a time, the lower priority model still gets every fourth
+    runner.concurrency = 1
+    handled.clear()
+    for _ in range(8):
+        runner.add_transition_tasks(call_inline=True)
+    assert handled.count("domain") == 2
+    assert handled.count("hashtag") == 6
+
+
+@pytest.mark.django_db(transaction=True)
+def test_runner_abandoned_tasks(monkeypatch):
+    """
+    Tests that a task whose handler has been abandoned for running out of
+    time stops taking up a slot, and that the pool gets a thread to make up
+    for it until it finishes.
+    """
+    monkeypatch.setitem(connections.settings["default"], "CONN_MAX_AGE", 0)
+    monkeypatch.setattr(DomainStates.outdated, "handler_timeout", 0.1)
+    release = threading.Event()
+
+    def handle_outdated(cls, instance):
+        release.wait(10)
+        return cls.updated
+
+    monkeypatch.setattr(DomainStates, "handle_outdated", classmethod(handle_outdated))
+    Domain.objects.create(domain="remote.test", local=False)
+
+    runner = StatorRunner([Domain], concurrency=1)
+    runner.handled = {}
+    runner.executor = runner.executor_class(max_workers=1)
+    try:
+        runner.add_transition_tasks()
+        [task] = runner.tasks.values()
+        started = time.monotonic()
+        while Domain.objects.filter(state_locked_until__isnull=False).exists():
+            assert time.monotonic() - started < 5
+            time.sleep(0.05)
+        runner.clean_tasks()
+        assert runner.tasks == {}
+        assert runner.abandoned_tasks == [task]
+        assert runner.executor._max_workers == 2
+
+        release.set()
+        task.result(timeout=5)
+        runner.clean_tasks()
+        assert runner.abandoned_tasks == []
+        assert runner.executor._max_workers == 1
+        # What it returned in the end was ignored
+        domain = Domain.objects.get()
+        assert domain.state == DomainStates.outdated
+        assert domain.state_attempts == 1
+    finally:
+        release.set()
+        runner.executor.shutdown()
+
+
+@pytest.mark.django_db
+def test_runner_reclaims_locks():
+    """
+    Tests that a runner restarted with the same ID takes back the rows it
+    had locked at once, and that running runners keep their leases.
+    """
+    for i in range(3):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+    Domain.transition_get_with_lock(
+        2, timezone.now() + datetime.timedelta(seconds=30), runner_id="runner-1"
+    )
+    # Someone else's locks stay put
+    Domain.transition_get_with_lock(
+        1, timezone.now() + datetime.timedelta(seconds=30), runner_id="runner-2"
+    )
+
+    restarted = StatorRunner([Domain], runner_id="runner-1", lock_expiry=30)
+    restarted.release_locks()
+    assert Domain.objects.filter(state_locked_by="runner-1").count() == 0
+    assert Domain.objects.filter(state_locked_by="runner-2").count() == 1
+
+    Domain.objects.filter(state_locked_by="runner-2").update(state_locked_by="runner-1")
+    restarted.renew_leases()
+    locked = Domain.objects.get(state_locked_by="runner-1")
+    assert locked.state_locked_until > timezone.now() + datetime.timedelta(seconds=25)
+
+
+@pytest.mark.django_db
+def test_runner_scheduling_errors(monkeypatch, caplog):
+    """
+    Tests that a failure maintaining one model's partitions is logged and
+    doesn't stop the runner or the other models' scheduling.
+    """
+    checked = []
+
+    def ensure_partitions(model):
+        checked.append(model)
+        raise RuntimeError("ATTACH failed")
+
+    monkeypatch.setattr(partitions, "is_partitioned", lambda model: True)
+    monkeypatch.setattr(partitions, "ensure_partitions", ensure_partitions)
+    runner = StatorRunner([Domain, Hashtag])
+    runner.handled = {}
+    runner.run_scheduling()
+    assert checked == [Domain, Hashtag]
+    assert "ATTACH failed" in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+def test_runner_drain(monkeypatch):
+    """
+    Tests that shutting down lets running tasks finish, and releases rows
+    that were claimed but never started.
+    """
+    monkeypatch.setitem(connections.settings["default"], "CONN_MAX_AGE", 0)
+
+    def handle_outdated(cls, instance):
+        time.sleep(0.5)
+        return cls.updated
+
+    monkeypatch.setattr(DomainStates, "handle_outdated", classmethod(handle_outdated))
+    for i in range(4):
+        Domain.objects.create(domain=f"remote{i}.test", local=False)
+
+    runner = StatorRunner([Domain], concurrency=4, concurrency_per_model=4)
+    runner.handled = {}
+    # Only one of the four claimed rows can start
+    runner.executor = ThreadPoolExecutor(max_workers=1)
+    runner.add_transition_tasks()
+    assert Domain.objects.filter(state_locked_by=runner.runner_id).count() == 4
+    runner.shutdown()
+    assert Domain.objects.filter(state=DomainStates.updated).count() == 1
+    assert Domain.objects.filter(state=DomainStates.outdated).count() == 3
+    assert not Domain.objects.filter(state_locked_until__isnull=False).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_runner_sigterm():
+    """
+    Tests that SIGTERM makes a runner drain and exit promptly, even while
+    it's idle.
+    """
+    runner = StatorRunner([Domain])
+    timer = threading.Timer(1, os.kill, [os.getpid(), signal.SIGTERM])
+    timer.start()
+    started = time.monotonic()
+    try:
+        runner.run()
+    finally:
+        timer.cancel()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    assert runner.draining
+    assert time.monotonic() - started < 3
+
+
+@pytest.mark.django_db(transaction=True)
+def test_runner_lease_thread():
+    """
+    Tests that a runner's leases are renewed from their own thread, so they
+    don't run out while the main loop is busy.
+    """
+    Domain.objects.create(domain="remote.test", local=False)
+    runner = StatorRunner([Domain], lock_expiry=3)
+    Domain.transition_get_with_lock(
+        1, timezone.now() + datetime.timedelta(seconds=3), runner_id=runner.runner_id
+    )
+    runner.start_lease_thread()
+    try:
+        time.sleep(4)
+    finally:
+        runner.stop_lease_thread()
+    domain = Domain.objects.get(pk="remote.test")
+    assert domain.state_locked_by == runner.runner_id
+    assert domain.state_locked_until > timezone.now()
+
+
+@pytest.mark.django_db
+def test_runner_failed_task_released():
+    """
+    Tests that the rows of a task that raised are unlocked when it's
+    cleaned up, rather than having their leases renewed forever.
+    """
+    Domain.objects.create(domain="remote.test", local=False)
+    runner = StatorRunner([Domain])
+    claimed = Domain.transition_get_with_lock(
+        1, timezone.now() + datetime.timedelta(seconds=30), runner_id=runner.runner_id
+    )
+    future: Future = Future()
+    future.set_exception(ValueError("Broken"))
+    runner.add_task(
+        ("users.domain", claimed[0].pk), future, claimed[0].state, [claimed[0].pk]
+    )
+    runner.clean_tasks()
+    assert runner.tasks == {}
+    assert runner.task_pks == {}
+    domain = Domain.objects.get(pk="remote.test")
+    assert domain.state_locked_by is None
+    assert domain.state_locked_until is None
+
+
+def test_runner_abandoned_threads_capped(monkeypatch):
+    """
+    Tests that the pool only gets extra threads for up to
+    max_replaced_threads abandoned tasks at once.
+    """
+    runner = StatorRunner([Domain], concurrency=1)
+    runner.executor = runner.make_executor()
+    tasks = {("users.domain", str(i)): Future() for i in range(3)}
+    runner.tasks = dict(tasks)
+    monkeypatch.setattr(timeouts.deadlines, "abandoned", lambda label: {"0", "1", "2"})
+    runner.clean_tasks()
+    assert runner.tasks == {}
+    assert len(runner.abandoned_tasks) == 3
+    assert runner.executor._max_workers == 2
+    for task in tasks.values():
+        task.set_result(None)
+    runner.clean_tasks()
+    assert runner.abandoned_tasks == []
+    assert runner.executor._max_workers == 1
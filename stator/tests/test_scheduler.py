@@ -0,0 +1,74 @@
+from collections import Counter
+
+from stator.scheduler import FairScheduler
+
+
+def test_fill_shares_by_weight():
+    """
+    Tests that slots are shared in proportion to weight when every queue
+    has plenty of work.
+    """
+    scheduler = FairScheduler()
+    given: Counter[str] = Counter()
+
+    def claim(queue, number):
+        given[queue] += number
+        return number
+
+    assert scheduler.fill({"high": 4, "low": 1}, 20, claim) == 20
+    assert given == {"high": 16, "low": 4}
+
+
+def test_fill_no_starvation():
+    """
+    Tests that a low-weight queue still gets its turn when there's only one
+    slot at a time, however much higher-weight work is waiting.
+    """
+    scheduler = FairScheduler()
+    given: list[str] = []
+
+    def claim(queue, number):
+        given.append(queue)
+        return 1
+
+    for _ in range(50):
+        scheduler.fill(
+            {"high": 4, "low": 1, "idle": 1},
+            1,
+            lambda q, n: 0 if q == "idle" else claim(q, n),
+        )
+    counts = Counter(given)
+    assert counts["low"] == 10
+    assert counts["high"] == 40
+    # And it never waits more than one round of the others
+    gaps = [i for i, queue in enumerate(given) if queue == "low"]
+    assert max(b - a for a, b in zip(gaps, gaps[1:])) <= 5
+
+
+def test_fill_moves_on_from_empty_queues():
+    """
+    Tests that space a queue can't use goes to the others, and that a queue
+    that was idle doesn't get a burst of catch-up work when it returns.
+    """
+    scheduler = FairScheduler()
+    backlog = {"a": 3, "b": 100}
+
+    def claim(queue, number):
+        number = min(number, backlog[queue])
+        backlog[queue] -= number
+        return number
+
+    assert scheduler.fill({"a": 1, "b": 1}, 10, claim) == 10
+    assert backlog == {"a": 0, "b": 93}
+    # Run b alone for a while, then give a work again
+    for _ in range(10):
+        scheduler.fill({"a": 1, "b": 1}, 2, claim)
+    backlog["a"] = 100
+    given: Counter[str] = Counter()
+    for _ in range(10):
+        before = dict(backlog)
+        scheduler.fill({"a": 1, "b": 1}, 2, claim)
+        given.update({queue: before[queue] - backlog[queue] for queue in backlog})
+    # Roughly even, rather than a catching up on everything b did alone
+    assert sum(given.values()) == 20
+    assert abs(given["a"] - given["b"]) <= 2
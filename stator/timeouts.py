@@ -0,0 +1,175 @@
+"""
+Per-handler time limits.
+
+Coroutine handlers are simply cancelled when they run out of time.
+Synchronous handlers can't be stopped safely from outside (they might be in
+the middle of a database call or holding a lock), so a watchdog thread
+instead logs any that run over and marks them abandoned: their rows are
+released to be retried (with the usual backoff) straight away, the runner
+stops counting them as running, and whatever the handler eventually returns
+is thrown away.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from contextlib import contextmanager
+from typing import TypeVar
+
+from django.db import close_old_connections
+
+from stator.exceptions import HandlerTimeout
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Deadline:
+    """
+    When one thread's current handler has to finish by, and the rows it is
+    working on.
+    """
+
+    def __init__(
+        self,
+        seconds: float,
+        label: str,
+        pks: Iterable,
+        on_abandon: Callable[[set], None] | None = None,
+    ):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        self.label = label
+        self.pks = set(pks)
+        # Called (from the watchdog thread) with the pks once it's abandoned
+        self.on_abandon = on_abandon
+        self.abandoned = False
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    def add(self, pks: Iterable):
+        """
+        Adds more rows the handler has taken on (and locked) itself.
+        """
+        self.pks.update(pks)
+
+
+class Deadlines:
+    """
+    Keeps track of when each thread's current handler has to finish by, and
+    abandons any that run over.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.reset()
+        # Forked children (like supervised runners) don't get our thread,
+        # and mustn't inherit a lock it might have been holding
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.deadlines: dict[int, Deadline] = {}
+        self.thread: threading.Thread | None = None
+
+    @contextmanager
+    def limit(
+        self,
+        seconds: float | None,
+        label: str = "",
+        pks: Iterable = (),
+        on_abandon: Callable[[set], None] | None = None,
+    ):
+        """
+        Tracks the block (a handler working on the `label` rows `pks`) until
+        it finishes, abandoning it (and calling `on_abandon` with the pks) if
+        that takes longer than `seconds` (if given). Yields the Deadline, or
+        None if there isn't one.
+        """
+        if not seconds:
+            yield None
+            return
+        ident = threading.get_ident()
+        deadline = Deadline(seconds, label, pks, on_abandon)
+        with self.lock:
+            self.deadlines[ident] = deadline
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.watch, name="stator-deadlines", daemon=True
+                )
+                self.thread.start()
+        try:
+            yield deadline
+        finally:
+            with self.lock:
+                del self.deadlines[ident]
+
+    def current(self) -> Deadline | None:
+        """
+        Returns the deadline of the handler running in this thread, if any.
+        """
+        return self.deadlines.get(threading.get_ident())
+
+    def abandoned(self, label: str) -> set:
+        """
+        Returns the pks of the `label` rows that abandoned handlers are still
+        working on.
+        """
+        with self.lock:
+            return {
+                pk
+                for deadline in self.deadlines.values()
+                if deadline.abandoned and deadline.label == label
+                for pk in deadline.pks
+            }
+
+    def watch(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            expired = []
+            with self.lock:
+                for deadline in self.deadlines.values():
+                    if deadline.expires <= now and not deadline.abandoned:
+                        deadline.abandoned = True
+                        expired.append(deadline)
+                        logger.warning(
+                            f"{deadline.label}: handler for {sorted(deadline.pks)} "
+                            f"still running after {deadline.seconds}s, abandoning it"
+                        )
+            # Release their rows outside the lock, as that's database work
+            for deadline in expired:
+                if deadline.on_abandon:
+                    try:
+                        deadline.on_abandon(set(deadline.pks))
+                    except Exception as e:
+                        logger.exception(e)
+            if expired:
+                close_old_connections()
+
+
+# The deadlines shared by every thread in this process
+deadlines = Deadlines()
+
+
+async def limit_async(awaitable: Awaitable[T], seconds: float | None) -> T:
+    """
+    Awaits the awaitable, cancelling it and raising HandlerTimeout if it
+    takes longer than `seconds` (if given).
+    """
+    if not seconds:
+        return await awaitable
+    timeout = asyncio.timeout(seconds)
+    try:
+        async with timeout:
+            return await awaitable
+    except TimeoutError:
+        # Only our own timeout; the handler's own TimeoutErrors pass through
+        if timeout.expired():
+            raise HandlerTimeout()
+        raise
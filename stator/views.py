@@ -2,6 +2,7 @@ from django.conf import settings
 from django.http import HttpResponse, HttpResponseForbidden
 from django.views import View
 
+from stator.metrics import render_metrics
 from stator.models import StatorModel
 from stator.runner import StatorRunner
 
@@ -22,3 +23,26 @@ class RequestRunner(View):
         runner = StatorRunner(StatorModel.subclasses, run_for=2)
         handled = runner.run()
         return HttpResponse(f"Handled {handled}")
+
+
+class Metrics(View):
+    """
+    Serves Stator's metrics in the Prometheus text format (or OpenMetrics,
+    if the scraper asks for it). Needs the Stator token in the query string,
+    like RequestRunner.
+    """
+
+    def get(self, request):
+        if not settings.STATOR_TOKEN:
+            return HttpResponseForbidden("No token set")
+        if request.GET.get("token") != settings.STATOR_TOKEN:
+            return HttpResponseForbidden("Invalid token")
+        if "application/openmetrics-text" in request.headers.get("Accept", ""):
+            return HttpResponse(
+                render_metrics(openmetrics=True),
+                content_type="application/openmetrics-text; version=1.0.0; charset=utf-8",
+            )
+        return HttpResponse(
+            render_metrics(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
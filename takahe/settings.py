@@ -167,6 +167,28 @@ class Settings(BaseSettings):
     #: float or tuple of floats for (connect, read, write, pool)
     REMOTE_TIMEOUT: float | tuple[float, float, float, float] = 5.0
 
+    #: How many connections to other servers each process can have open at
+    #: once, how many of those it keeps alive for reuse (and for how many
+    #: seconds) while idle, and how many can be to any one host
+    REMOTE_POOL_SIZE: int = 100
+    REMOTE_POOL_KEEPALIVE: int = 50
+    REMOTE_POOL_KEEPALIVE_EXPIRY: float = 30
+    REMOTE_POOL_PER_HOST: int = 10
+
+    #: How many requests a second each process sends to any one host on
+    #: average, and how many it can send in a burst. Set the rate to zero
+    #: for no limit.
+    REMOTE_HOST_RATE: float = 20
+    REMOTE_HOST_BURST: int = 40
+
+    #: Different (connections, requests a second) limits for particular
+    #: hosts, as JSON, e.g. {"mastodon.social": [20, 50]}
+    REMOTE_HOST_LIMITS: dict[str, tuple[int, float]] = {}
+
+    #: Use HTTP/2 with other servers that support it (needs the h2 package,
+    #: installed by the httpx[http2] extra)
+    REMOTE_HTTP2: bool = True
+
     #: If search features like full text search should be enabled.
     #: (placeholder setting, no effect)
     SEARCH: bool = True
@@ -182,10 +204,64 @@ class Settings(BaseSettings):
     # Remote posts older than this will not be pushed to timeline.
     FANOUT_LIMIT_DAYS: int = 9
 
+    #: How many fan-outs each batch sends at most (claiming more from the
+    #: queue that are waiting for the same remote inboxes to fill it), and
+    #: how many requests it sends at once. Set the first to zero to send
+    #: each fan-out on its own.
+    FANOUT_INBOX_BATCH: int = 100
+    FANOUT_DELIVERY_CONCURRENCY: int = 8
+
+    #: After this many deliveries in a row to a server fail, stop sending to
+    #: it for REMOTE_CIRCUIT_OPEN seconds (doubling each time a retry fails,
+    #: up to REMOTE_CIRCUIT_OPEN_MAX). Set to zero to always keep trying.
+    REMOTE_CIRCUIT_FAILURES: int = 5
+    REMOTE_CIRCUIT_OPEN: float = 60
+    REMOTE_CIRCUIT_OPEN_MAX: float = 60 * 60
+
     # Stator tuning
     STATOR_CONCURRENCY: int = 20
     STATOR_CONCURRENCY_PER_MODEL: int = 4
 
+    #: If a maximum is set, Stator adjusts its concurrency between these
+    #: bounds (and shares it between models by backlog) as the load changes
+    STATOR_CONCURRENCY_MIN: int | None = None
+    STATOR_CONCURRENCY_MAX: int | None = None
+
+    #: How many seconds a Stator handler may run before it's given up on and
+    #: retried later (states can set their own handler_timeout instead). Off
+    #: by default, as a synchronous handler keeps running after it's given up
+    #: on, and so can repeat its side effects when it's retried
+    STATOR_HANDLER_TIMEOUT: float | None = None
+
+    #: How many coroutine handlers an asyncio-mode runner keeps in flight
+    STATOR_ASYNC_CONCURRENCY: int = 500
+    STATOR_ASYNC_CONCURRENCY_PER_MODEL: int = 100
+
+    #: If enabled, new Stator work sends a PostgreSQL NOTIFY so idle runners
+    #: wake up immediately instead of waiting for their next poll.
+    STATOR_NOTIFY: bool = False
+
+    #: If enabled, web processes run work that's ready immediately (like new
+    #: posts and their fan-outs) themselves, in a small thread pool, as soon
+    #: as it's committed. Runners still pick up anything they don't.
+    STATOR_DISPATCH: bool = False
+    STATOR_DISPATCH_CONCURRENCY: int = 4
+
+    #: Per-model overrides of how Stator counts its queues ("exact", "capped"
+    #: or "estimate"), keyed by model label, e.g. {"activities.fanout": "estimate"}
+    STATOR_QUEUE_COUNT: dict[str, Literal["exact", "capped", "estimate"]] = {}
+
+    #: Per-model overrides of how much of each runner's capacity a model gets
+    #: relative to the others, keyed by model label, e.g. {"users.domain": 0.5}
+    STATOR_PRIORITY: dict[str, float] = {}
+
+    #: If enabled, runners sample their handlers' stacks every
+    #: STATOR_PROFILE_INTERVAL seconds and record their SQL, and save the
+    #: details of any transition slower than STATOR_PROFILE_SLOW seconds
+    STATOR_PROFILE: bool = False
+    STATOR_PROFILE_INTERVAL: float = 0.05
+    STATOR_PROFILE_SLOW: float = 5
+
     # Web Push keys
     # Generate via https://web-push-codelab.glitch.me/
     VAPID_PUBLIC_KEY: str | None = None
@@ -348,6 +424,19 @@ AUTO_ADMIN_EMAIL = SETUP.AUTO_ADMIN_EMAIL
 STATOR_TOKEN = SETUP.STATOR_TOKEN
 STATOR_CONCURRENCY = SETUP.STATOR_CONCURRENCY
 STATOR_CONCURRENCY_PER_MODEL = SETUP.STATOR_CONCURRENCY_PER_MODEL
+STATOR_CONCURRENCY_MIN = SETUP.STATOR_CONCURRENCY_MIN
+STATOR_CONCURRENCY_MAX = SETUP.STATOR_CONCURRENCY_MAX
+STATOR_HANDLER_TIMEOUT = SETUP.STATOR_HANDLER_TIMEOUT
+STATOR_ASYNC_CONCURRENCY = SETUP.STATOR_ASYNC_CONCURRENCY
+STATOR_ASYNC_CONCURRENCY_PER_MODEL = SETUP.STATOR_ASYNC_CONCURRENCY_PER_MODEL
+STATOR_NOTIFY = SETUP.STATOR_NOTIFY
+STATOR_DISPATCH = SETUP.STATOR_DISPATCH
+STATOR_DISPATCH_CONCURRENCY = SETUP.STATOR_DISPATCH_CONCURRENCY
+STATOR_QUEUE_COUNT = SETUP.STATOR_QUEUE_COUNT
+STATOR_PRIORITY = SETUP.STATOR_PRIORITY
+STATOR_PROFILE = SETUP.STATOR_PROFILE
+STATOR_PROFILE_INTERVAL = SETUP.STATOR_PROFILE_INTERVAL
+STATOR_PROFILE_SLOW = SETUP.STATOR_PROFILE_SLOW
 
 ROBOTS_TXT_DISALLOWED_USER_AGENTS = SETUP.ROBOTS_TXT_DISALLOWED_USER_AGENTS
 
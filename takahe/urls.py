@@ -380,6 +380,7 @@ urlpatterns = [
     re_path(r"oauth/revoke/?$", oauth.RevokeTokenView.as_view()),
     # Stator
     path(".stator/", stator.RequestRunner.as_view()),
+    path(".stator/metrics/", stator.Metrics.as_view()),
     # Django admin
     path("djadmin/", djadmin.site.urls),
     # Media files
@@ -0,0 +1,370 @@
+import json
+from datetime import timedelta
+
+import httpx
+import pytest
+from django.conf import settings
+from django.utils import timezone
+from pytest_httpx import HTTPXMock
+
+from activities.models import (
+    ActivityPayload,
+    FanOut,
+    FanOutStates,
+    Post,
+    PostStates,
+)
+from core import http
+from stator.runner import StatorRunner
+from users.models import Domain, Follow, FollowStates, Identity
+
+
+@pytest.mark.django_db
+def test_fan_out_payload(
+    identity: Identity,
+    remote_identity: Identity,
+    config_system,
+    httpx_mock: HTTPXMock,
+):
+    """
+    Tests that a post's activity is serialized once when it's fanned out,
+    and that the remote fan-outs send exactly that.
+    """
+    Follow.objects.create(
+        source=remote_identity, target=identity, state=FollowStates.accepted
+    )
+    # Stator hands over posts fresh from the database
+    post = Post.create_local(author=identity, content="Hello world")
+    post = Post.objects.get(pk=post.pk)
+    PostStates.targets_fan_out(post, FanOut.Types.post)
+    payload = ActivityPayload.objects.get(post=post)
+    assert json.loads(bytes(payload.body))["type"] == "Create"
+
+    httpx_mock.add_response(url="https://remote.test/@test/inbox/", status_code=202)
+    fan_outs = list(FanOut.objects.filter(subject_post=post, identity=remote_identity))
+    FanOutStates.handle_outgoing_batch(fan_outs)
+    request = httpx_mock.get_request()
+    assert request.content == bytes(payload.body)
+    assert request.headers["Digest"] == payload.digest
+
+    # It's deleted with old fan-outs once it's expired
+    FanOut.transition_delete_due()
+    assert ActivityPayload.objects.filter(pk=payload.pk).exists()
+    ActivityPayload.objects.filter(pk=payload.pk).update(
+        created=timezone.now() - timedelta(days=5)
+    )
+    FanOut.transition_delete_due()
+    assert not ActivityPayload.objects.filter(pk=payload.pk).exists()
+
+
+@pytest.mark.django_db
+def test_fan_out_local_priority(
+    identity: Identity, remote_identity: Identity, config_system, monkeypatch
+):
+    """
+    Tests that remote fan-outs wait in their own queue, so local ones are
+    claimed ahead of a backlog of them.
+    """
+    handled = []
+
+    def handle_new_batch(cls, instances):
+        handled.extend(["local"] * len(instances))
+        return {instance.pk: cls.sent for instance in instances}
+
+    def handle_outgoing_batch(cls, instances):
+        handled.extend(["remote"] * len(instances))
+        return {instance.pk: cls.sent for instance in instances}
+
+    monkeypatch.setattr(FanOutStates, "handle_new_batch", classmethod(handle_new_batch))
+    monkeypatch.setattr(
+        FanOutStates, "handle_outgoing_batch", classmethod(handle_outgoing_batch)
+    )
+    monkeypatch.setattr(FanOutStates.new, "batch_size", 1)
+    monkeypatch.setattr(FanOutStates.outgoing, "batch_size", 1)
+    post = Post.create_local(author=identity, content="Hello world")
+    for _ in range(20):
+        FanOut.objects.create(
+            identity=remote_identity, type=FanOut.Types.post, subject_post=post
+        )
+    for _ in range(5):
+        FanOut.objects.create(
+            identity=identity, type=FanOut.Types.post, subject_post=post
+        )
+    assert FanOut.objects.filter(state="outgoing").count() == 20
+
+    runner = StatorRunner([FanOut], concurrency=5, concurrency_per_model=5)
+    runner.handled = {}
+    runner.add_transition_tasks(call_inline=True)
+    assert sorted(handled) == ["local", "local", "local", "local", "remote"]
+
+
+@pytest.mark.django_db
+def test_fan_out_remote_moved(
+    identity: Identity, remote_identity: Identity, config_system
+):
+    """
+    Tests that a remote fan-out left in the local queue is moved on to be
+    delivered rather than sent from there.
+    """
+    post = Post.create_local(author=identity, content="Hello world")
+    fan_out = FanOut.objects.create(
+        identity=remote_identity,
+        type=FanOut.Types.post,
+        subject_post=post,
+        state=FanOutStates.new,
+    )
+    FanOut.objects.filter(pk=fan_out.pk).update(state=FanOutStates.new)
+    fan_out.refresh_from_db()
+    assert FanOut.transition_attempt_batch([fan_out]) == {
+        fan_out.pk: FanOutStates.outgoing
+    }
+    fan_out.refresh_from_db()
+    assert fan_out.state == "outgoing"
+
+
+@pytest.mark.django_db
+def test_fan_out_payload_outdated(
+    identity: Identity, remote_identity: Identity, config_system
+):
+    """
+    Tests that a payload for an older version of a post isn't sent.
+    """
+    Follow.objects.create(
+        source=remote_identity, target=identity, state=FollowStates.accepted
+    )
+    # Stator hands over posts fresh from the database
+    post = Post.create_local(author=identity, content="Hello world")
+    post = Post.objects.get(pk=post.pk)
+    PostStates.targets_fan_out(post, FanOut.Types.post)
+    fan_out = FanOut.objects.get(subject_post=post, identity=remote_identity)
+    assert isinstance(FanOutStates.post_activity(fan_out)[0], bytes)
+
+    post.edit_local(content="Hello again")
+    fan_out = FanOut.objects.get(pk=fan_out.pk)
+    body, digest = FanOutStates.post_activity(fan_out)
+    assert body["object"]["content"] == "<p>Hello again</p>"
+    assert digest is None
+
+
+@pytest.mark.django_db
+def test_fan_out_inbox_batch(
+    identity: Identity,
+    remote_identity: Identity,
+    config_system,
+    httpx_mock: HTTPXMock,
+):
+    """
+    Tests that sending one remote fan-out also sends the others waiting for
+    the same inbox, and saves all their outcomes.
+    """
+    Follow.objects.create(
+        source=remote_identity, target=identity, state=FollowStates.accepted
+    )
+    for i in range(5):
+        post = Post.create_local(author=identity, content=f"Hello {i}")
+        PostStates.targets_fan_out(Post.objects.get(pk=post.pk), FanOut.Types.post)
+    pks = list(
+        FanOut.objects.filter(identity=remote_identity)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    assert len(pks) == 5
+
+    httpx_mock.add_response(
+        url="https://remote.test/@test/inbox/", status_code=202, is_reusable=True
+    )
+    claimed = FanOut.transition_get_with_lock(
+        1, timezone.now() + timedelta(seconds=30), "runner", pks=pks[:1]
+    )
+    results = FanOut.transition_attempt_batch(claimed)
+    assert results == {pks[0]: FanOutStates.sent}
+    assert len(httpx_mock.get_requests()) == 5
+    assert set(
+        FanOut.objects.filter(pk__in=pks).values_list("state", "state_locked_by")
+    ) == {("sent", None)}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_fan_out_inbox_batch_async(
+    identity: Identity,
+    remote_identity: Identity,
+    config_system,
+    httpx_mock: HTTPXMock,
+):
+    """
+    Tests that the asyncio runner's path sends a batch, topped up with the
+    others waiting for the same inbox, and saves all their outcomes.
+    """
+    Follow.objects.create(
+        source=remote_identity, target=identity, state=FollowStates.accepted
+    )
+    for i in range(5):
+        post = Post.create_local(author=identity, content=f"Hello {i}")
+        PostStates.targets_fan_out(Post.objects.get(pk=post.pk), FanOut.Types.post)
+    pks = list(
+        FanOut.objects.filter(identity=remote_identity)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+    httpx_mock.add_response(
+        url="https://remote.test/@test/inbox/", status_code=202, is_reusable=True
+    )
+    claimed = FanOut.transition_get_with_lock(
+        1, timezone.now() + timedelta(seconds=30), "runner", pks=pks[:1]
+    )
+    results = http.async_to_sync(FanOut.atransition_attempt_batch)(claimed)
+    assert results == {pks[0]: FanOutStates.sent}
+    assert len(httpx_mock.get_requests()) == 5
+    assert set(
+        FanOut.objects.filter(pk__in=pks).values_list("state", "state_locked_by")
+    ) == {("sent", None)}
+    domain = Domain.objects.get(pk=remote_identity.domain_id)
+    assert domain.delivery_failures == 0
+
+
+@pytest.mark.django_db
+def test_fan_out_inbox_batch_partial(
+    identity: Identity,
+    remote_identity: Identity,
+    config_system,
+    httpx_mock: HTTPXMock,
+    monkeypatch,
+):
+    """
+    Tests that a batch only tops up to FANOUT_INBOX_BATCH fan-outs in all,
+    and that outcomes are kept even if something fails partway through.
+    """
+    monkeypatch.setattr(settings.SETUP, "FANOUT_INBOX_BATCH", 3)
+    Follow.objects.create(
+        source=remote_identity, target=identity, state=FollowStates.accepted
+    )
+    for i in range(5):
+        post = Post.create_local(author=identity, content=f"Hello {i}")
+        PostStates.targets_fan_out(Post.objects.get(pk=post.pk), FanOut.Types.post)
+    pks = list(
+        FanOut.objects.filter(identity=remote_identity)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+    def broken(cls, instances):
+        raise RuntimeError("Broken")
+
+    monkeypatch.setattr(FanOutStates, "record_health", classmethod(broken))
+    httpx_mock.add_response(
+        url="https://remote.test/@test/inbox/", status_code=202, is_reusable=True
+    )
+    claimed = FanOut.transition_get_with_lock(
+        1, timezone.now() + timedelta(seconds=30), "runner", pks=pks[:1]
+    )
+    assert FanOut.transition_attempt_batch(claimed) == {pks[0]: FanOutStates.sent}
+    assert len(httpx_mock.get_requests()) == 3
+    states = FanOut.objects.filter(pk__in=pks).values_list("state", flat=True)
+    assert sorted(states) == ["outgoing", "outgoing", "sent", "sent", "sent"]
+
+
+@pytest.mark.django_db
+def test_fan_out_circuit_open(
+    identity: Identity,
+    remote_identity: Identity,
+    config_system,
+    httpx_mock: HTTPXMock,
+):
+    """
+    Tests that fan-outs to a server that keeps failing are held back without
+    trying to send them, and let go again once it's back.
+    """
+    Follow.objects.create(
+        source=remote_identity, target=identity, state=FollowStates.accepted
+    )
+    post = Post.create_local(author=identity, content="Hello world")
+    PostStates.targets_fan_out(Post.objects.get(pk=post.pk), FanOut.Types.post)
+    fan_out = FanOut.objects.get(subject_post=post, identity=remote_identity)
+    domain = remote_identity.domain
+    open_until = timezone.now() + timedelta(minutes=5)
+    Domain.objects.filter(pk=domain.pk).update(
+        delivery_failures=5, delivery_open_until=open_until
+    )
+    FanOut.objects.filter(pk=fan_out.pk).update(state_attempts=3)
+    fan_out.refresh_from_db()
+
+    # It waits until the circuit half-opens, without that counting as an
+    # attempt
+    assert FanOut.transition_attempt_batch([fan_out]) == {fan_out.pk: None}
+    assert httpx_mock.get_requests() == []
+    fan_out.refresh_from_db()
+    assert fan_out.state == "outgoing"
+    assert fan_out.state_attempts == 3
+    assert abs(fan_out.state_next_attempt - open_until) < timedelta(seconds=5)
+
+    # A success elsewhere closes the circuit and lets it straight through,
+    # with its backoff starting over
+    domain.record_delivery(True, 0.1)
+    fan_out.refresh_from_db()
+    assert fan_out.state_next_attempt is None
+    assert fan_out.state_attempts == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_fan_out_retry_after(
+    status_code: int,
+    identity: Identity,
+    remote_identity: Identity,
+    config_system,
+    httpx_mock: HTTPXMock,
+):
+    """
+    Tests that a fan-out the server refuses with a Retry-After is tried
+    again when it says, without counting as a failed attempt.
+    """
+    Follow.objects.create(
+        source=remote_identity, target=identity, state=FollowStates.accepted
+    )
+    post = Post.create_local(author=identity, content="Hello world")
+    PostStates.targets_fan_out(Post.objects.get(pk=post.pk), FanOut.Types.post)
+    fan_out = FanOut.objects.get(subject_post=post, identity=remote_identity)
+
+    httpx_mock.add_response(
+        url="https://remote.test/@test/inbox/",
+        status_code=status_code,
+        headers={"Retry-After": "120"},
+    )
+    assert FanOut.transition_attempt_batch([fan_out]) == {fan_out.pk: None}
+    fan_out.refresh_from_db()
+    assert fan_out.state == "outgoing"
+    assert fan_out.state_attempts == 0
+    assert (
+        timedelta(seconds=110)
+        < fan_out.state_next_attempt - timezone.now()
+        <= timedelta(seconds=120)
+    )
+    # Being told to slow down says nothing about the server's health
+    assert Domain.objects.get(pk=remote_identity.domain_id).delivery_failures == 0
+
+
+@pytest.mark.django_db
+def test_fan_out_pool_timeout(
+    identity: Identity,
+    remote_identity: Identity,
+    config_system,
+    httpx_mock: HTTPXMock,
+):
+    """
+    Tests that a fan-out which can't get a connection to its server here is
+    tried again shortly, without counting as a failed attempt.
+    """
+    Follow.objects.create(
+        source=remote_identity, target=identity, state=FollowStates.accepted
+    )
+    post = Post.create_local(author=identity, content="Hello world")
+    PostStates.targets_fan_out(Post.objects.get(pk=post.pk), FanOut.Types.post)
+    fan_out = FanOut.objects.get(subject_post=post, identity=remote_identity)
+
+    httpx_mock.add_exception(httpx.PoolTimeout("Too many requests"))
+    assert FanOut.transition_attempt_batch([fan_out]) == {fan_out.pk: None}
+    fan_out.refresh_from_db()
+    assert fan_out.state_attempts == 0
+    assert fan_out.state_next_attempt - timezone.now() <= timedelta(seconds=15)
+    assert Domain.objects.get(pk=remote_identity.domain_id).delivery_failures == 0
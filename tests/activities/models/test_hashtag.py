@@ -0,0 +1,36 @@
+import pytest
+
+from activities.models import Hashtag, HashtagStates, Post
+
+
+@pytest.mark.django_db
+def test_hashtag_stats_batch(identity, config_system):
+    """
+    Tests that updating several hashtags' stats at once counts each one
+    (and its aliases) separately.
+    """
+    Post.create_local(author=identity, content="Hello, #cats")
+    Post.create_local(author=identity, content="Hello, #cats and #dogs")
+    Post.create_local(author=identity, content="Hello, #kittens")
+    cats = Hashtag.objects.create(hashtag="cats", aliases=["kittens"])
+    dogs = Hashtag.objects.create(hashtag="dogs")
+    birds = Hashtag.objects.create(hashtag="birds")
+
+    results = HashtagStates.handle_outdated_batch([cats, dogs, birds])
+    assert results == {
+        "cats": HashtagStates.updated,
+        "dogs": HashtagStates.updated,
+        "birds": HashtagStates.updated,
+    }
+
+    cats.refresh_from_db()
+    dogs.refresh_from_db()
+    birds.refresh_from_db()
+    assert cats.stats["total"] == 3
+    assert dogs.stats["total"] == 1
+    assert birds.stats["total"] == 0
+    assert cats.stats["history"][0]["uses"] == "3"
+    assert cats.stats["history"][0]["accounts"] == "1"
+    assert dogs.stats["history"][0]["uses"] == "1"
+    assert len(birds.stats["history"]) == 8
+    assert cats.stats_updated is not None
@@ -6,7 +6,7 @@ from django.utils import timezone
 from activities.models import Post, PostInteraction, PostInteractionStates
 from activities.models.post_types import QuestionData
 from core.ld import format_ld_date
-from users.models import Identity
+from users.models import Block, Follow, FollowStates, Identity
 
 
 @pytest.mark.django_db
@@ -433,3 +433,34 @@ def test_handle_remove_ap(remote_identity: Identity, config_system):
 
     # Remove activity on unknown post is a no-op
     PostInteraction.handle_remove_ap(data=remove_ap | {"object": "unknown-post"})
+
+
+@pytest.mark.django_db
+def test_boost_targets(
+    identity: Identity,
+    other_identity: Identity,
+    remote_identity: Identity,
+    remote_identity2: Identity,
+    config_system,
+):
+    """
+    Tests that a boost goes to the post author and to followers who follow
+    boosts, apart from blocked ones.
+    """
+    post = Post.create_local(author=other_identity, content="<p>Boost me</p>")
+    Follow.objects.create(
+        source=remote_identity, target=identity, state=FollowStates.accepted
+    )
+    Follow.objects.create(
+        source=remote_identity2,
+        target=identity,
+        state=FollowStates.accepted,
+        boosts=False,
+    )
+    boost = PostInteraction.objects.create(
+        type=PostInteraction.Types.boost, identity=identity, post=post
+    )
+    assert boost.get_targets() == {other_identity, remote_identity}
+
+    Block.create_local_block(identity, remote_identity)
+    assert boost.get_targets() == {other_identity}
@@ -1,6 +1,6 @@
 import pytest
 
-from activities.models import Post
+from activities.models import FanOut, Post, PostStates
 from users.models import Block, Domain, Follow, Identity
 
 
@@ -179,3 +179,41 @@ def test_post_blocked(identity, other_identity, remote_identity):
     # The muted block should be in targets, the full block should not
     targets = post.get_targets()
     assert targets == {identity, other_identity}
+
+
+@pytest.mark.django_db
+def test_post_targets_fan_out_bulk(
+    identity, config_system, django_assert_max_num_queries
+):
+    """
+    Tests that fanning out to lots of followers takes the same handful of
+    queries as fanning out to a few, with one fan-out per shared inbox.
+    """
+    domain = Domain.objects.create(domain="remote.test", local=False, state="updated")
+    for i in range(50):
+        follower = Identity.objects.create(
+            actor_uri=f"https://remote.test/test{i}/",
+            inbox_uri=f"https://remote.test/@test{i}/inbox/",
+            shared_inbox_uri=f"https://remote.test/inbox/{i % 10}/",
+            username=f"test{i}",
+            domain=domain,
+            local=False,
+            state="updated",
+        )
+        Follow.objects.create(source=follower, target=identity, state="accepted")
+    post = Post.objects.get(
+        pk=Post.create_local(author=identity, content="<p>Hello</p>").pk
+    )
+    FanOut.objects.all().delete()
+
+    with django_assert_max_num_queries(20):
+        PostStates.targets_fan_out(post, FanOut.Types.post)
+    # The author, and one for each of the ten shared inboxes
+    assert FanOut.objects.filter(subject_post=post).count() == 11
+    assert (
+        FanOut.objects.filter(subject_post=post)
+        .values("identity__shared_inbox_uri")
+        .distinct()
+        .count()
+        == 11
+    )
@@ -4,6 +4,7 @@ import pytest
 from django.test import Client
 
 from api.models import Application, Token
+from core import http
 from core.models import Config
 from stator.runner import StatorModel, StatorRunner
 from users.models import Domain, Identity, User
@@ -72,6 +73,14 @@ def _test_settings(settings):
     settings.MAIN_DOMAIN = "example.com"
 
 
+@pytest.fixture(autouse=True)
+def _http_clients():
+    # Start each test with fresh clients, so per-host rate limits and
+    # backoffs left by one test don't hold up the next
+    yield
+    http.pool.close()
+
+
 @pytest.fixture
 def config_system(keypair):
     Config.system = Config.SystemOptions(
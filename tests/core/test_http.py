@@ -0,0 +1,151 @@
+import asyncio
+
+import httpx
+import pytest
+from pytest_httpx import HTTPXMock
+
+from core import http
+from core.http import AsyncHostLimitedTransport, HostLimitedTransport
+
+
+def ok(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, content=b"ok")
+
+
+def test_shared_client(httpx_mock: HTTPXMock):
+    """
+    Tests that the same client (and so the same connection pool) is handed
+    out every time, and that it identifies us.
+    """
+    httpx_mock.add_response()
+    assert http.client() is http.client()
+    assert http.client() is not http.client("other")
+
+    http.client().get("https://example.com/")
+    assert httpx_mock.get_request().headers["User-Agent"].startswith("Takahe/")
+
+
+def test_host_limit():
+    """
+    Tests that only so many requests to one host can be open at once, and
+    that a slot frees up when a response is closed.
+    """
+    client = httpx.Client(
+        transport=HostLimitedTransport(httpx.MockTransport(ok), per_host=1),
+        timeout=httpx.Timeout(5, pool=0.1),
+    )
+    with client.stream("GET", "https://example.com/one"):
+        # Other hosts aren't affected
+        assert client.get("https://example.org/").status_code == 200
+        with pytest.raises(httpx.PoolTimeout):
+            client.get("https://example.com/two")
+    assert client.get("https://example.com/two").content == b"ok"
+
+
+def test_async_host_limit():
+    """
+    Tests that the async client limits each host the same way.
+    """
+
+    async def run():
+        client = httpx.AsyncClient(
+            transport=AsyncHostLimitedTransport(httpx.MockTransport(ok), per_host=1),
+            timeout=httpx.Timeout(5, pool=0.1),
+        )
+        async with client.stream("GET", "https://example.com/one"):
+            with pytest.raises(httpx.PoolTimeout):
+                await client.get("https://example.com/two")
+        assert (await client.get("https://example.com/two")).content == b"ok"
+        assert http.async_client() is http.async_client()
+        await http.pool.aclose_loop()
+
+    asyncio.run(run())
+
+
+def test_async_to_sync_closes_clients(httpx_mock: HTTPXMock):
+    """
+    Tests that async clients made while running coroutines from sync code
+    are closed when their event loop finishes, rather than left open.
+    """
+    httpx_mock.add_response(is_reusable=True)
+    clients = []
+
+    async def fetch():
+        client = http.async_client()
+        clients.append(client)
+        return (await client.get("https://example.com/")).status_code
+
+    for _ in range(3):
+        assert http.async_to_sync(fetch)() == 200
+    assert len(clients) == 3
+    assert all(client.is_closed for client in clients)
+    assert len(http.pool.async_clients) == 0
+
+
+def test_host_rate_limit():
+    """
+    Tests that requests to one host beyond its burst wait for its rate limit,
+    and are refused if that'd take longer than the pool timeout.
+    """
+    transport = HostLimitedTransport(
+        httpx.MockTransport(ok),
+        per_host=10,
+        rate=1,
+        burst=2,
+        overrides={"example.org": (10, 1000)},
+    )
+    client = httpx.Client(transport=transport, timeout=httpx.Timeout(5, pool=0.1))
+    client.get("https://example.com/one")
+    client.get("https://example.com/two")
+    with pytest.raises(http.RateLimited) as error:
+        client.get("https://example.com/three")
+    assert 0.5 < error.value.retry_after <= 1
+    # Hosts with their own limits get those instead
+    for _ in range(5):
+        assert client.get("https://example.org/").status_code == 200
+
+
+def test_host_limit_refund():
+    """
+    Tests that a request which times out waiting for a slot gives back its
+    place in the host's rate limit.
+    """
+    client = httpx.Client(
+        transport=HostLimitedTransport(
+            httpx.MockTransport(ok), per_host=1, rate=0.01, burst=2
+        ),
+        timeout=httpx.Timeout(5, pool=0.1),
+    )
+    with client.stream("GET", "https://example.com/one"):
+        with pytest.raises(httpx.PoolTimeout) as error:
+            client.get("https://example.com/two")
+        assert not isinstance(error.value, http.RateLimited)
+    assert client.get("https://example.com/two").content == b"ok"
+
+
+def test_host_retry_after():
+    """
+    Tests that a host which says to back off isn't sent anything else until
+    it said to come back.
+    """
+
+    def busy(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "example.com":
+            return httpx.Response(429, headers={"Retry-After": "120"})
+        return httpx.Response(200)
+
+    client = httpx.Client(
+        transport=HostLimitedTransport(httpx.MockTransport(busy), per_host=1)
+    )
+    assert client.get("https://example.com/").status_code == 429
+    with pytest.raises(http.RateLimited) as error:
+        client.get("https://example.com/")
+    assert 119 < error.value.retry_after <= 120
+    assert client.get("https://example.org/").status_code == 200
+
+
+def test_parse_retry_after():
+    assert http.parse_retry_after("30") == 30
+    assert http.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert http.parse_retry_after("soon") is None
+    assert http.parse_retry_after(None) is None
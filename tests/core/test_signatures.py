@@ -8,6 +8,8 @@ from pytest_httpx import HTTPXMock
 from core.signatures import (
     HttpSignature,
     LDSignature,
+    RequestRefused,
+    RsaKeys,
     VerificationError,
     VerificationFormatError,
 )
@@ -107,6 +109,31 @@ def test_sign_http(httpx_mock: HTTPXMock, keypair):
     HttpSignature.verify_request(fake_request, keypair["public_key"])
 
 
+def test_signed_request_errors(httpx_mock: HTTPXMock, keypair):
+    """
+    Tests that POSTs refused with a 4xx raise with the response attached,
+    while server errors (even 503s) come back as normal responses.
+    """
+    httpx_mock.add_response(status_code=429, headers={"Retry-After": "120"})
+    with pytest.raises(RequestRefused) as error:
+        HttpSignature.signed_request(
+            uri="https://example.com/inbox/",
+            body={"type": "Test"},
+            private_key=keypair["private_key"],
+            key_id=keypair["public_key_id"],
+        )
+    assert error.value.response.status_code == 429
+
+    httpx_mock.add_response(status_code=503)
+    response = HttpSignature.signed_request(
+        uri="https://example.org/inbox/",
+        body={"type": "Test"},
+        private_key=keypair["private_key"],
+        key_id=keypair["public_key_id"],
+    )
+    assert response.status_code == 503
+
+
 def test_verify_http(keypair):
     """
     Tests verifying HTTP requests against a known good example
@@ -280,3 +307,27 @@ def test_verify_request_malformed_date_header(keypair):
     )
     with pytest.raises(VerificationFormatError, match="Invalid Date header"):
         HttpSignature.verify_request(request, keypair["public_key"])
+
+
+def test_key_cache(keypair, monkeypatch):
+    """
+    Tests that loaded keys are reused, replaced when the key for an ID
+    changes, and that the cache stays within its size.
+    """
+    RsaKeys.clear_cache()
+    key_id = "https://example.com/test-actor#test-key"
+    private_key = RsaKeys.load_private_key(keypair["private_key"], key_id)
+    assert RsaKeys.load_private_key(keypair["private_key"], key_id) is private_key
+    public_key = RsaKeys.load_public_key(keypair["public_key"])
+    assert RsaKeys.load_public_key(keypair["public_key"]) is public_key
+
+    new_private, _ = RsaKeys.generate_keypair()
+    new_key = RsaKeys.load_private_key(new_private, key_id)
+    assert new_key is not private_key
+    assert RsaKeys.load_private_key(new_private, key_id) is new_key
+
+    monkeypatch.setattr(RsaKeys, "CACHE_SIZE", 2)
+    RsaKeys.load_public_key(keypair["public_key"], "one")
+    RsaKeys.load_public_key(keypair["public_key"], "two")
+    assert len(RsaKeys._cache) == 2
+    RsaKeys.clear_cache()
@@ -1,4 +1,8 @@
+from datetime import timedelta
+
 import pytest
+from django.conf import settings
+from django.utils import timezone
 
 from users.models import Domain
 
@@ -51,3 +55,41 @@ def test_recursive_block():
 
     # An unrelated domain should not be blocked
     assert not Domain.get_remote_domain("example.com").recursively_blocked()
+
+
+@pytest.mark.django_db
+def test_delivery_circuit():
+    """
+    Tests that failing deliveries open the circuit, that it lets only one
+    probe through once it's half-open, and that a success closes it.
+    """
+    domain = Domain.objects.create(domain="remote.test", local=False)
+    for _ in range(settings.SETUP.REMOTE_CIRCUIT_FAILURES - 1):
+        domain.record_delivery(False)
+    domain.refresh_from_db()
+    assert domain.delivery_circuit == "closed"
+    assert domain.delivery_allowed()
+
+    domain.record_delivery(False)
+    domain.refresh_from_db()
+    assert domain.delivery_circuit == "open"
+    assert not domain.delivery_allowed()
+
+    # Once the wait is over, only one runner gets to try
+    Domain.objects.filter(pk=domain.pk).update(
+        delivery_open_until=timezone.now() - timedelta(seconds=1)
+    )
+    domain.refresh_from_db()
+    other = Domain.objects.get(pk=domain.pk)
+    assert domain.delivery_circuit == "half_open"
+    assert domain.delivery_allowed()
+    assert not other.delivery_allowed()
+
+    domain.record_delivery(True, 0.5)
+    domain.refresh_from_db()
+    assert domain.delivery_circuit == "closed"
+    assert domain.delivery_failures == 0
+    assert domain.delivery_latency == 0.5
+    domain.record_delivery(True, 1.5)
+    domain.refresh_from_db()
+    assert domain.delivery_latency == pytest.approx(0.7)
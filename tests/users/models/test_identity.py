@@ -2,6 +2,7 @@ import httpx
 import pytest
 from pytest_httpx import HTTPXMock
 
+from core import http
 from core.models import Config
 from users.models import Domain, Identity, User
 from users.views.identity import CreateIdentity
@@ -234,6 +235,92 @@ def test_fetch_actor(httpx_mock, config_system):
     assert not identity.indexable
 
 
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.httpx_mock(assert_all_requests_were_expected=False)
+def test_afetch_actor(httpx_mock, config_system):
+    """
+    Ensures that fetching actors from an event loop works, with the saving
+    done off the loop
+    """
+    identity = Identity.objects.create(
+        actor_uri="https://example.com/test-actor/",
+        local=False,
+    )
+    httpx_mock.add_response(
+        url="https://example.com/.well-known/webfinger?resource=acct:test@example.com",
+        headers={"Content-Type": "application/activity+json"},
+        json={
+            "subject": "acct:test@example.org",
+            "links": [
+                {
+                    "rel": "self",
+                    "type": "application/activity+json",
+                    "href": "https://example.com/test-actor/",
+                },
+            ],
+        },
+    )
+    httpx_mock.add_response(
+        url="https://example.com/test-actor/",
+        headers={"Content-Type": "application/activity+json"},
+        json={
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": "https://example.com/test-actor/",
+            "type": "Person",
+            "inbox": "https://example.com/test-actor/inbox/",
+            "name": "Test User",
+            "preferredUsername": "test",
+        },
+    )
+    assert http.async_to_sync(identity.afetch_actor)()
+
+    identity = Identity.objects.get(pk=identity.pk)
+    assert identity.name == "Test User"
+    assert identity.username == "test"
+    # The handle webfinger gave us wins
+    assert identity.domain_id == "example.org"
+    assert identity.inbox_uri == "https://example.com/test-actor/inbox/"
+    assert identity.fetched
+
+
+@pytest.mark.django_db
+@pytest.mark.httpx_mock(assert_all_requests_were_expected=False)
+def test_fetch_actor_broken_webfinger(httpx_mock, config_system):
+    """
+    Ensures that an actor whose server returns garbage for webfinger is
+    still fetched, under the domain it's hosted on
+    """
+    identity = Identity.objects.create(
+        actor_uri="https://example.com/test-actor/",
+        local=False,
+    )
+    httpx_mock.add_response(
+        url="https://example.com/.well-known/webfinger?resource=acct:test@example.com",
+        content=b"<html>Oops</html>",
+    )
+    httpx_mock.add_response(
+        url="https://example.com/test-actor/",
+        headers={"Content-Type": "application/activity+json"},
+        json={
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": "https://example.com/test-actor/",
+            "type": "Person",
+            "inbox": "https://example.com/test-actor/inbox/",
+            "name": "Test User",
+            "preferredUsername": "test",
+        },
+    )
+    assert identity.fetch_actor()
+    assert identity.username == "test"
+    assert identity.name == "Test User"
+
+    identity = Identity.objects.get(pk=identity.pk)
+    assert identity.username == "test"
+    assert identity.domain_id == "example.com"
+    assert identity.inbox_uri == "https://example.com/test-actor/inbox/"
+    assert identity.fetched
+
+
 @pytest.mark.django_db
 @pytest.mark.httpx_mock(assert_all_requests_were_expected=False)
 def test_fetch_webfinger_url(httpx_mock: HTTPXMock, config_system):
@@ -33,6 +33,7 @@ class DomainAdmin(admin.ModelAdmin):
         "software",
         "user_count",
         "public",
+        "delivery_circuit",
     ]
     list_filter = ("local", "blocked")
     search_fields = ("domain", "service_domain")
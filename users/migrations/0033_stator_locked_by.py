@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0032_add_account_note"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="block",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="domain",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="follow",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="identity",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="inboxmessage",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="passwordreset",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="relay",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="report",
+            name="state_locked_by",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
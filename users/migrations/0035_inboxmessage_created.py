@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0034_stator_attempts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="inboxmessage",
+            name="created",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        # Existing messages were created at about the time they last changed
+        migrations.RunSQL(
+            "UPDATE users_inboxmessage SET created = state_changed",
+            migrations.RunSQL.noop,
+        ),
+    ]
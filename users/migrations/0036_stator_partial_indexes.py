@@ -0,0 +1,282 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:50
+
+from django.db import migrations, models
+
+from stator.operations import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("activities", "0032_stator_partial_indexes"),
+        ("users", "0035_inboxmessage_created"),
+    ]
+
+    operations = [
+        RemoveIndexConcurrently(
+            model_name="block",
+            name="ix_block_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="domain",
+            name="ix_domain_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="follow",
+            name="ix_follow_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="identity",
+            name="ix_identity_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="inboxmessage",
+            name="ix_inboxmessag_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="passwordreset",
+            name="ix_passwordres_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="relay",
+            name="ix_relay_state_next",
+        ),
+        RemoveIndexConcurrently(
+            model_name="report",
+            name="ix_report_state_next",
+        ),
+        migrations.AlterField(
+            model_name="block",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="domain",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="follow",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="identity",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="inboxmessage",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="passwordreset",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="relay",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="report",
+            name="state_locked_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name="block",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_block_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="block",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["awaiting_expiry", "new", "undone"]),
+                    ("state_locked_until__isnull", True),
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_block_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="block",
+            index=models.Index(
+                condition=models.Q(("state__in", ["undone", "undone_sent"])),
+                fields=["state", "state_changed"],
+                name="ix_block_delete",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="domain",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_domain_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="domain",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["outdated", "updated"]),
+                    ("state_locked_until__isnull", True),
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_domain_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="follow",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_follow_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="follow",
+            index=models.Index(
+                condition=models.Q(
+                    (
+                        "state__in",
+                        [
+                            "accepting",
+                            "pending_removal",
+                            "rejecting",
+                            "undone",
+                            "unrequested",
+                        ],
+                    ),
+                    ("state_locked_until__isnull", True),
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_follow_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="follow",
+            index=models.Index(
+                condition=models.Q(("state__in", ["removed"])),
+                fields=["state", "state_changed"],
+                name="ix_follow_delete",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="identity",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_identity_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="identity",
+            index=models.Index(
+                condition=models.Q(
+                    (
+                        "state__in",
+                        ["deleted", "edited", "moved", "outdated", "updated"],
+                    ),
+                    ("state_locked_until__isnull", True),
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_identity_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="inboxmessage",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_inboxmessag_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="inboxmessage",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["received"]), ("state_locked_until__isnull", True)
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_inboxmessag_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="inboxmessage",
+            index=models.Index(
+                condition=models.Q(("state__in", ["errored", "processed", "received"])),
+                fields=["state", "state_changed"],
+                name="ix_inboxmessag_delete",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="passwordreset",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_passwordres_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="passwordreset",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["new"]), ("state_locked_until__isnull", True)
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_passwordres_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="relay",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_relay_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="relay",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["new", "unsubscribing"]),
+                    ("state_locked_until__isnull", True),
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_relay_ready",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="relay",
+            index=models.Index(
+                condition=models.Q(("state__in", ["unsubscribed"])),
+                fields=["state", "state_changed"],
+                name="ix_relay_delete",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="report",
+            index=models.Index(
+                condition=models.Q(("state_locked_until__isnull", False)),
+                fields=["state_locked_until"],
+                name="ix_report_locked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="report",
+            index=models.Index(
+                condition=models.Q(
+                    ("state__in", ["new"]), ("state_locked_until__isnull", True)
+                ),
+                fields=["state", "state_next_attempt"],
+                name="ix_report_ready",
+            ),
+        ),
+    ]
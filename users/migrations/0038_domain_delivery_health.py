@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0037_inboxmessage_shard_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="domain",
+            name="delivery_failed",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="domain",
+            name="delivery_failures",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="domain",
+            name="delivery_latency",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="domain",
+            name="delivery_open_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="domain",
+            name="delivery_succeeded",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,9 +1,10 @@
+import datetime
 import json
 import logging
 import re
 import ssl
 from functools import cached_property
-from typing import Optional
+from typing import Literal, Optional
 
 import httpx
 import pydantic
@@ -11,9 +12,19 @@ import urlman
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
+from core import http
 from core.models import Config
-from stator.models import State, StateField, StateGraph, StatorModel
+from stator.models import (
+    State,
+    StateField,
+    StateGraph,
+    StatorModel,
+    database_sync_to_async,
+    notify_ready,
+)
 from users.schemas import NodeInfo, NodeInfoSoftware, NodeInfoUsage
 
 logger = logging.getLogger(__name__)
@@ -48,6 +59,18 @@ class DomainStates(StateGraph):
             instance.save()
             return cls.updated
 
+    @classmethod
+    async def ahandle_outdated(cls, instance: "Domain"):
+        # As above, but for the asyncio runner, which can have many of these
+        # waiting on other servers at once
+        if instance.blocked:
+            return cls.updated
+        info = await instance.afetch_nodeinfo()
+        if info:
+            instance.nodeinfo = info.model_dump()
+            await database_sync_to_async(instance.save)()
+            return cls.updated
+
     @classmethod
     def handle_updated(cls, instance: "Domain"):
         if instance.blocked:
@@ -117,6 +140,19 @@ class Domain(StatorModel):
     # Free-form notes field for admins
     notes = models.TextField(blank=True, null=True)
 
+    # How deliveries to this server are going: how many in a row have
+    # failed, a moving average of its response time (in seconds), and when
+    # one last succeeded and failed
+    delivery_failures = models.PositiveIntegerField(default=0)
+    delivery_latency = models.FloatField(null=True, blank=True)
+    delivery_succeeded = models.DateTimeField(null=True, blank=True)
+    delivery_failed = models.DateTimeField(null=True, blank=True)
+
+    # If too many deliveries have failed, when to next try one - the circuit
+    # is "open" until then, and "half-open" (letting one probe through)
+    # after
+    delivery_open_until = models.DateTimeField(null=True, blank=True)
+
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
@@ -131,6 +167,13 @@ class Domain(StatorModel):
     class Meta:
         indexes: list = []
 
+    # How much each new response time counts towards delivery_latency
+    DELIVERY_LATENCY_WEIGHT = 0.2
+
+    # How long a half-open circuit waits to hear back from its probe
+    # before letting another through
+    DELIVERY_PROBE_SECONDS = 60
+
     @classmethod
     def is_valid_domain(cls, domain: str) -> bool:
         """
@@ -190,97 +233,246 @@ class Domain(StatorModel):
                 )
         super().save(*args, **kwargs)
 
+    ### Delivery health ###
+
+    @property
+    def delivery_circuit(self) -> Literal["closed", "open", "half_open"]:
+        if self.delivery_open_until is None:
+            return "closed"
+        if self.delivery_open_until > timezone.now():
+            return "open"
+        return "half_open"
+
+    def delivery_allowed(self) -> bool:
+        """
+        Returns if a delivery to this domain should be attempted. Once the
+        circuit is half-open, only one delivery (across all runners) is let
+        through as a probe, until it reports back or DELIVERY_PROBE_SECONDS
+        pass.
+        """
+        circuit = self.delivery_circuit
+        if circuit != "half_open":
+            return circuit == "closed"
+        probe_until = timezone.now() + datetime.timedelta(
+            seconds=self.DELIVERY_PROBE_SECONDS
+        )
+        claimed = Domain.objects.filter(
+            pk=self.pk, delivery_open_until=self.delivery_open_until
+        ).update(delivery_open_until=probe_until)
+        self.delivery_open_until = probe_until
+        return bool(claimed)
+
+    def delivery_retry_delay(self) -> float:
+        """
+        Returns how many seconds until deliveries held back by the circuit
+        should be tried again (when it half-opens, or the current probe
+        should have reported back).
+        """
+        if self.delivery_open_until is None:
+            return 0
+        return max((self.delivery_open_until - timezone.now()).total_seconds(), 0)
+
+    def record_delivery(self, succeeded: bool, latency: float | None = None):
+        """
+        Records how deliveries to this domain went. Any success closes the
+        circuit (and releases the deliveries it held back); enough failures
+        in a row open it for a while, for longer each time.
+        """
+        now = timezone.now()
+        domains = Domain.objects.filter(pk=self.pk)
+        if succeeded:
+            updates: dict = {
+                "delivery_failures": 0,
+                "delivery_succeeded": now,
+                "delivery_open_until": None,
+            }
+            if latency is not None:
+                weight = self.DELIVERY_LATENCY_WEIGHT
+                updates["delivery_latency"] = Coalesce(
+                    models.F("delivery_latency") * (1 - weight) + latency * weight,
+                    models.Value(latency),
+                )
+            if domains.filter(delivery_open_until__isnull=False).update(**updates):
+                self.release_deliveries()
+            else:
+                domains.update(**updates)
+            return
+        domains.update(
+            delivery_failures=models.F("delivery_failures") + 1,
+            delivery_failed=now,
+        )
+        failures = domains.values_list("delivery_failures", flat=True).first() or 0
+        threshold = settings.SETUP.REMOTE_CIRCUIT_FAILURES
+        if threshold and failures >= threshold:
+            delay = min(
+                settings.SETUP.REMOTE_CIRCUIT_OPEN * 2 ** min(failures - threshold, 16),
+                settings.SETUP.REMOTE_CIRCUIT_OPEN_MAX,
+            )
+            domains.update(delivery_open_until=now + datetime.timedelta(seconds=delay))
+
+    def release_deliveries(self):
+        """
+        Makes fan-outs to this domain that were backing off ready to go again,
+        with their backoff starting over
+        """
+        from activities.models import FanOut, FanOutStates
+
+        if FanOut.objects.filter(
+            state=FanOutStates.outgoing,
+            identity__domain=self,
+            state_locked_until__isnull=True,
+            state_next_attempt__gt=timezone.now(),
+        ).update(state_next_attempt=None, state_attempts=0):
+            notify_ready(FanOut)
+
     def fetch_nodeinfo(self) -> NodeInfo | None:
         """
         Fetch the /NodeInfo/2.0 for the domain
         """
         if self.domain == "threads.net":
-            # too bad Meta don't implement node info
-            return NodeInfo(
-                version="2.0",
-                software=NodeInfoSoftware(name="threads.net"),
-                protocols=["activitypub"],
-                openRegistrations=True,
-                usage=NodeInfoUsage(),
-                metadata={},
+            return self.threads_nodeinfo()
+
+        client = http.client()
+        try:
+            response = client.get(
+                f"https://{self.domain}/.well-known/nodeinfo",
+                follow_redirects=True,
+                headers={"Accept": "application/json"},
             )
+        except httpx.HTTPError:
+            response = None
+        except (ssl.SSLCertVerificationError, ssl.SSLError, UnicodeDecodeError):
+            return None
+        nodeinfo20_url = self.nodeinfo_url(response)
 
-        nodeinfo20_url = f"https://{self.domain}/nodeinfo/2.0"
+        try:
+            response = client.get(
+                nodeinfo20_url,
+                follow_redirects=True,
+                headers={"Accept": "application/json"},
+            )
+            response.raise_for_status()
+        except (
+            httpx.HTTPError,
+            ssl.SSLCertVerificationError,
+            UnicodeDecodeError,
+        ) as ex:
+            self.nodeinfo_error(nodeinfo20_url, ex)
+            return None
+        return self.nodeinfo_from_response(nodeinfo20_url, response)
 
-        with httpx.Client(
-            timeout=settings.SETUP.REMOTE_TIMEOUT,
-            headers={"User-Agent": settings.TAKAHE_USER_AGENT},
-        ) as client:
-            try:
-                response = client.get(
-                    f"https://{self.domain}/.well-known/nodeinfo",
-                    follow_redirects=True,
-                    headers={"Accept": "application/json"},
-                )
-            except httpx.HTTPError:
-                pass
-            except (ssl.SSLCertVerificationError, ssl.SSLError, UnicodeDecodeError):
-                return None
-            else:
-                try:
-                    for link in response.json().get("links", []):
-                        if isinstance(
-                            link, dict
-                        ) and "://nodeinfo.diaspora.software/ns/schema/2." in str(
-                            link.get("rel", "")
-                        ):
-                            nodeinfo20_url = link.get("href", nodeinfo20_url)
-                            break
-                except (json.JSONDecodeError, AttributeError, UnicodeDecodeError):
-                    pass
-
-            try:
-                response = client.get(
-                    nodeinfo20_url,
-                    follow_redirects=True,
-                    headers={"Accept": "application/json"},
-                )
-                response.raise_for_status()
-            except (
-                httpx.HTTPError,
-                ssl.SSLCertVerificationError,
-                UnicodeDecodeError,
-            ) as ex:
-                response = getattr(ex, "response", None)
-                if (
-                    response
-                    and response.status_code < 500
-                    and response.status_code not in [401, 403, 404, 406, 410]
+    async def afetch_nodeinfo(self) -> NodeInfo | None:
+        """
+        Fetch the /NodeInfo/2.0 for the domain, without blocking the event
+        loop
+        """
+        if self.domain == "threads.net":
+            return self.threads_nodeinfo()
+
+        client = http.async_client()
+        try:
+            response = await client.get(
+                f"https://{self.domain}/.well-known/nodeinfo",
+                follow_redirects=True,
+                headers={"Accept": "application/json"},
+            )
+        except httpx.HTTPError:
+            response = None
+        except (ssl.SSLCertVerificationError, ssl.SSLError, UnicodeDecodeError):
+            return None
+        nodeinfo20_url = self.nodeinfo_url(response)
+
+        try:
+            response = await client.get(
+                nodeinfo20_url,
+                follow_redirects=True,
+                headers={"Accept": "application/json"},
+            )
+            response.raise_for_status()
+        except (
+            httpx.HTTPError,
+            ssl.SSLCertVerificationError,
+            UnicodeDecodeError,
+        ) as ex:
+            self.nodeinfo_error(nodeinfo20_url, ex)
+            return None
+        return self.nodeinfo_from_response(nodeinfo20_url, response)
+
+    def threads_nodeinfo(self) -> NodeInfo:
+        # too bad Meta don't implement node info
+        return NodeInfo(
+            version="2.0",
+            software=NodeInfoSoftware(name="threads.net"),
+            protocols=["activitypub"],
+            openRegistrations=True,
+            usage=NodeInfoUsage(),
+            metadata={},
+        )
+
+    def nodeinfo_url(self, response: httpx.Response | None) -> str:
+        """
+        Returns the NodeInfo 2.x URL from a /.well-known/nodeinfo response,
+        or the usual one if it doesn't say
+        """
+        nodeinfo20_url = f"https://{self.domain}/nodeinfo/2.0"
+        if response is None:
+            return nodeinfo20_url
+        try:
+            for link in response.json().get("links", []):
+                if isinstance(
+                    link, dict
+                ) and "://nodeinfo.diaspora.software/ns/schema/2." in str(
+                    link.get("rel", "")
                 ):
-                    logger.warning(
-                        "Client error fetching nodeinfo: %d %s %s",
-                        response.status_code,
-                        nodeinfo20_url,
-                        ex,
-                        extra={
-                            "content": response.content,
-                            "domain": self.domain,
-                        },
-                    )
-                return None
-
-            try:
-                info = NodeInfo(**response.json())
-            except (
-                json.JSONDecodeError,
-                pydantic.ValidationError,
-                UnicodeDecodeError,
-            ) as ex:
-                logger.warning(
-                    "Client error decoding nodeinfo: %s %s",
-                    nodeinfo20_url,
-                    ex,
-                    extra={
-                        "domain": self.domain,
-                    },
-                )
-                return None
-            return info
+                    return link.get("href", nodeinfo20_url)
+        except (json.JSONDecodeError, AttributeError, UnicodeDecodeError):
+            pass
+        return nodeinfo20_url
+
+    def nodeinfo_error(self, nodeinfo20_url: str, ex: Exception):
+        """
+        Logs a failed NodeInfo fetch, if it looks like our fault
+        """
+        response = getattr(ex, "response", None)
+        if (
+            response
+            and response.status_code < 500
+            and response.status_code not in [401, 403, 404, 406, 410]
+        ):
+            logger.warning(
+                "Client error fetching nodeinfo: %d %s %s",
+                response.status_code,
+                nodeinfo20_url,
+                ex,
+                extra={
+                    "content": response.content,
+                    "domain": self.domain,
+                },
+            )
+
+    def nodeinfo_from_response(
+        self, nodeinfo20_url: str, response: httpx.Response
+    ) -> NodeInfo | None:
+        """
+        Parses a NodeInfo 2.x response
+        """
+        try:
+            info = NodeInfo(**response.json())
+        except (
+            json.JSONDecodeError,
+            pydantic.ValidationError,
+            UnicodeDecodeError,
+        ) as ex:
+            logger.warning(
+                "Client error decoding nodeinfo: %s %s",
+                nodeinfo20_url,
+                ex,
+                extra={
+                    "domain": self.domain,
+                },
+            )
+            return None
+        return info
 
     @property
     def software(self):
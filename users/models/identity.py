@@ -6,14 +6,15 @@ from urllib.parse import urlparse
 
 import httpx
 import urlman
-from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Cast, RowNumber
 from django.utils import timezone
 from lxml import etree
 from pyld.jsonld import JsonLdError
 
 from api.models.push import PushSubscription, PushType
+from core import http
 from core.exceptions import ActorMismatchError
 from core.html import ContentRenderer, FediverseHtmlParser
 from core.json import json_from_response
@@ -35,7 +36,13 @@ from core.uris import (
     StaticAbsoluteUrl,
 )
 from stator.exceptions import TryAgainLater
-from stator.models import State, StateField, StateGraph, StatorModel
+from stator.models import (
+    State,
+    StateField,
+    StateGraph,
+    StatorModel,
+    database_sync_to_async,
+)
 from users.models.domain import Domain
 from users.models.inbox_message import InboxMessage
 from users.models.system_actor import SystemActor
@@ -205,6 +212,15 @@ class IdentityStates(StateGraph):
         if identity.fetch_actor():
             return cls.updated
 
+    @classmethod
+    async def ahandle_outdated(cls, identity: "Identity"):
+        # As above, but for the asyncio runner, which can have many actor
+        # fetches waiting on other servers at once
+        if identity.local:
+            return await database_sync_to_async(cls.handle_outdated)(identity)
+        if await identity.afetch_actor():
+            return cls.updated
+
     @classmethod
     def handle_updated(cls, instance: "Identity"):
         if instance.state_age > Config.system.identity_max_age:
@@ -216,6 +232,27 @@ class IdentityQuerySet(models.QuerySet):
         query = self.exclude(state__in=IdentityStates.group_deleted())
         return query
 
+    def one_per_inbox(self):
+        """
+        Keeps only one remote identity for each shared inbox (the one with
+        the lowest ID), as delivering to any one of them reaches them all.
+        Local identities, and remote ones without a shared inbox, are all
+        kept.
+        """
+        inbox = models.Case(
+            models.When(
+                local=False,
+                shared_inbox_uri__gt="",
+                then=models.F("shared_inbox_uri"),
+            ),
+            default=Cast("pk", models.TextField()),
+            output_field=models.TextField(),
+        )
+        query = self.alias(
+            inbox_rank=models.Window(RowNumber(), partition_by=inbox, order_by="pk")
+        ).filter(inbox_rank=1)
+        return query
+
 
 class IdentityManager(models.Manager):
     def get_queryset(self):
@@ -224,6 +261,9 @@ class IdentityManager(models.Manager):
     def not_deleted(self):
         return self.get_queryset().not_deleted()
 
+    def one_per_inbox(self):
+        return self.get_queryset().one_per_inbox()
+
 
 class Identity(StatorModel):
     """
@@ -853,29 +893,57 @@ class Identity(StatorModel):
         Given a domain (hostname), returns the correct webfinger URL to use
         based on probing host-meta.
         """
-        with httpx.Client(
-            timeout=settings.SETUP.REMOTE_TIMEOUT,
-            headers={"User-Agent": settings.TAKAHE_USER_AGENT},
-        ) as client:
+        client = http.client()
+        try:
+            response = client.get(
+                f"https://{domain}/.well-known/host-meta",
+                follow_redirects=True,
+                headers={"Accept": "application/xml"},
+            )
+        except httpx.RequestError:
+            response = None
+        return cls.webfinger_url_from_host_meta(domain, response)
+
+    @classmethod
+    async def afetch_webfinger_url(cls, domain: str):
+        """
+        Like fetch_webfinger_url, without blocking the event loop.
+        """
+        client = http.async_client()
+        try:
+            response = await client.get(
+                f"https://{domain}/.well-known/host-meta",
+                follow_redirects=True,
+                headers={"Accept": "application/xml"},
+            )
+        except httpx.RequestError:
+            response = None
+        return cls.webfinger_url_from_host_meta(domain, response)
+
+    @classmethod
+    def webfinger_url_from_host_meta(
+        cls, domain: str, response: httpx.Response | None
+    ) -> str:
+        """
+        Returns the webfinger URL template from a host-meta response.
+        """
+        # In the case of anything other than a success, we'll still try
+        # hitting the webfinger URL on the domain we were given to handle
+        # incorrectly setup servers.
+        if (
+            response is not None
+            and response.status_code == 200
+            and response.content.strip()
+        ):
             try:
-                response = client.get(
-                    f"https://{domain}/.well-known/host-meta",
-                    follow_redirects=True,
-                    headers={"Accept": "application/xml"},
+                parser = etree.XMLParser(resolve_entities=False, no_network=True)
+                tree = etree.fromstring(response.content, parser=parser)
+                template = tree.xpath(
+                    "string(.//*[local-name() = 'Link' and @rel='lrdd' and (not(@type) or @type='application/jrd+json')]/@template)"
                 )
-
-                # In the case of anything other than a success, we'll still try
-                # hitting the webfinger URL on the domain we were given to handle
-                # incorrectly setup servers.
-                if response.status_code == 200 and response.content.strip():
-                    parser = etree.XMLParser(resolve_entities=False, no_network=True)
-                    tree = etree.fromstring(response.content, parser=parser)
-                    template = tree.xpath(
-                        "string(.//*[local-name() = 'Link' and @rel='lrdd' and (not(@type) or @type='application/jrd+json')]/@template)"
-                    )
-                    if template:
-                        return template
-            except (httpx.RequestError, etree.ParseError):
+                if template:
+                    return template
+            except etree.ParseError:
                 pass
 
         return f"https://{domain}/.well-known/webfinger?resource={{uri}}"
@@ -893,34 +961,70 @@ class Identity(StatorModel):
             return None, None
 
         # Go make a Webfinger request
-        with httpx.Client(
-            timeout=settings.SETUP.REMOTE_TIMEOUT,
-            headers={"User-Agent": settings.TAKAHE_USER_AGENT},
-        ) as client:
-            try:
-                response = client.get(
-                    webfinger_url.format(uri=f"acct:{handle}"),
-                    follow_redirects=True,
-                    headers={"Accept": "application/json"},
-                )
-                response.raise_for_status()
-            except (httpx.HTTPError, ssl.SSLCertVerificationError) as ex:
-                response = getattr(ex, "response", None)
-                if isinstance(ex, httpx.TimeoutException) or (
-                    response and response.status_code in [408, 429, 504]
-                ):
-                    raise TryAgainLater() from ex
-                elif (
-                    response
-                    and response.status_code < 500
-                    and response.status_code not in [400, 401, 403, 404, 406, 410]
-                ):
-                    raise ValueError(
-                        f"Client error fetching webfinger: {response.status_code}",
-                        response.content,
-                    )
-                return None, None
+        client = http.client()
+        try:
+            response = client.get(
+                webfinger_url.format(uri=f"acct:{handle}"),
+                follow_redirects=True,
+                headers={"Accept": "application/json"},
+            )
+            response.raise_for_status()
+        except (httpx.HTTPError, ssl.SSLCertVerificationError) as ex:
+            return cls.webfinger_error(ex)
+        return cls.webfinger_from_response(response)
+
+    @classmethod
+    async def afetch_webfinger(cls, handle: str) -> tuple[str | None, str | None]:
+        """
+        Like fetch_webfinger, without blocking the event loop.
+        """
+        domain = handle.split("@")[1].lower()
+        try:
+            webfinger_url = await cls.afetch_webfinger_url(domain)
+        except ssl.SSLCertVerificationError:
+            return None, None
+
+        client = http.async_client()
+        try:
+            response = await client.get(
+                webfinger_url.format(uri=f"acct:{handle}"),
+                follow_redirects=True,
+                headers={"Accept": "application/json"},
+            )
+            response.raise_for_status()
+        except (httpx.HTTPError, ssl.SSLCertVerificationError) as ex:
+            return cls.webfinger_error(ex)
+        return cls.webfinger_from_response(response)
+
+    @classmethod
+    def webfinger_error(cls, ex: Exception) -> tuple[None, None]:
+        """
+        Handles a failed Webfinger request, raising if it's worth retrying
+        or looks like our fault.
+        """
+        response = getattr(ex, "response", None)
+        if isinstance(ex, httpx.TimeoutException) or (
+            response and response.status_code in [408, 429, 504]
+        ):
+            raise TryAgainLater() from ex
+        elif (
+            response
+            and response.status_code < 500
+            and response.status_code not in [400, 401, 403, 404, 406, 410]
+        ):
+            raise ValueError(
+                f"Client error fetching webfinger: {response.status_code}",
+                response.content,
+            )
+        return None, None
 
+    @classmethod
+    def webfinger_from_response(
+        cls, response: httpx.Response
+    ) -> tuple[str | None, str | None]:
+        """
+        Returns the (actor uri, canonical handle) from a Webfinger response.
+        """
         try:
             data = response.json()
         except ValueError:
@@ -1022,11 +1126,7 @@ class Identity(StatorModel):
         Fetches the user's actor information, as well as their domain from
         webfinger if it's available.
         """
-        from activities.models import Emoji
-
-        if self.local:
-            raise ValueError("Cannot fetch local identities")
-        if (self.actor_uri or "").lower().split(":")[0] not in ["http", "https"]:
+        if not self.actor_fetchable():
             return False
         try:
             response = SystemActor().signed_request(
@@ -1037,22 +1137,89 @@ class Identity(StatorModel):
             raise TryAgainLater()
         except (httpx.RequestError, ssl.SSLCertVerificationError):
             return False
+        document = self.actor_document(response)
+        if document is None:
+            if self.actor_gone(response):
+                # Their account got deleted, so let's do the same.
+                Identity.objects.filter(pk=self.pk).delete()
+            return False
+        self.apply_actor(document)
+        # Now go do webfinger with that info to see if we can get a canonical domain
+        webfinger_handle = None
+        if self.username:
+            try:
+                _, webfinger_handle = self.fetch_webfinger(
+                    f"{self.username}@{urlparse(self.actor_uri).hostname}"
+                )
+            except TryAgainLater:
+                # continue with original domain when webfinger times out
+                logger.info("WebFinger timed out: %s", self.actor_uri)
+            except ValueError as exc:
+                # or when it's broken
+                self.actor_webfinger_error(exc)
+        return self.update_from_actor(document, webfinger_handle)
+
+    async def afetch_actor(self) -> bool:
+        """
+        Like fetch_actor, but doing its fetches on the running event loop's
+        shared async client, and its database work in the loop's executor.
+        """
+        if not self.actor_fetchable():
+            return False
+        try:
+            response = await SystemActor().asigned_request(
+                method="get",
+                uri=self.actor_uri,
+            )
+        except httpx.TimeoutException:
+            raise TryAgainLater()
+        except (httpx.RequestError, ssl.SSLCertVerificationError):
+            return False
+        document = self.actor_document(response)
+        if document is None:
+            if self.actor_gone(response):
+                await database_sync_to_async(
+                    Identity.objects.filter(pk=self.pk).delete
+                )()
+            return False
+        await database_sync_to_async(self.apply_actor)(document)
+        webfinger_handle = None
+        if self.username:
+            try:
+                _, webfinger_handle = await self.afetch_webfinger(
+                    f"{self.username}@{urlparse(self.actor_uri).hostname}"
+                )
+            except TryAgainLater:
+                logger.info("WebFinger timed out: %s", self.actor_uri)
+            except ValueError as exc:
+                self.actor_webfinger_error(exc)
+        return await database_sync_to_async(self.update_from_actor)(
+            document, webfinger_handle
+        )
+
+    def actor_fetchable(self) -> bool:
+        if self.local:
+            raise ValueError("Cannot fetch local identities")
+        return (self.actor_uri or "").lower().split(":")[0] in ["http", "https"]
+
+    def actor_document(self, response: httpx.Response) -> dict | None:
+        """
+        Returns the canonicalised actor document from a response to fetching
+        it, or None if there isn't a usable one.
+        """
         content_type = response.headers.get("content-type")
         if content_type and "html" in content_type:
             # Some servers don't properly handle "application/activity+json"
-            return False
+            return None
         status_code = response.status_code
         if status_code >= 400:
             if status_code in [408, 429, 504]:
                 raise TryAgainLater()
-            if status_code == 410 and self.pk:
-                # Their account got deleted, so let's do the same.
-                Identity.objects.filter(pk=self.pk).delete()
             if status_code < 500 and status_code not in [401, 403, 404, 406, 410]:
                 logger.info(
                     "Client error fetching actor: %d %s", status_code, self.actor_uri
                 )
-            return False
+            return None
         try:
             json_data = json_from_response(response)
             document = canonicalise(json_data, include_security=True)
@@ -1065,9 +1232,43 @@ class Identity(StatorModel):
                     "content": response.content,
                 },
             )
-            return False
+            return None
         if "type" not in document:
-            return False
+            return None
+        return document
+
+    def actor_gone(self, response: httpx.Response) -> bool:
+        """
+        Whether a response to fetching the actor says their account is gone.
+        """
+        content_type = response.headers.get("content-type")
+        return (
+            response.status_code == 410
+            and bool(self.pk)
+            and not (content_type and "html" in content_type)
+        )
+
+    @staticmethod
+    def actor_username(document: dict) -> str | None:
+        username = document.get("preferredUsername")
+        if username and "@value" in username:
+            username = username["@value"]
+        return username
+
+    def actor_webfinger_error(self, exc: ValueError):
+        logger.info(
+            "Can't parse WebFinger: %s %s",
+            exc.args[0],
+            self.actor_uri,
+            exc_info=exc,
+        )
+
+    def apply_actor(self, document: dict):
+        """
+        Copies what we fetched of the user's actor document onto the
+        identity, with the domain the actor is hosted on (until webfinger
+        tells us otherwise).
+        """
         self.name = document.get("name")
         self.profile_uri = document.get("url")
         self.inbox_uri = document.get("inbox")
@@ -1079,11 +1280,7 @@ class Identity(StatorModel):
         self.actor_type = document["type"].lower()
         self.shared_inbox_uri = document.get("endpoints", {}).get("sharedInbox")
         self.summary = document.get("summary")
-        self.username = document.get("preferredUsername")
-        if self.username and "@value" in self.username:
-            self.username = self.username["@value"]
-        if self.username:
-            self.username = self.username
+        self.username = self.actor_username(document)
         self.manually_approves_followers = document.get("manuallyApprovesFollowers")
         self.public_key = document.get("publicKey", {}).get("publicKeyPem")
         self.public_key_id = document.get("publicKey", {}).get("id")
@@ -1109,30 +1306,20 @@ class Identity(StatorModel):
                         "value": FediverseHtmlParser(attachment["value"]).html,
                     }
                 )
-        # Now go do webfinger with that info to see if we can get a canonical domain
-        actor_url_parts = urlparse(self.actor_uri)
-        self.domain = Domain.get_remote_domain(actor_url_parts.hostname)
-        if self.username:
-            try:
-                webfinger_actor, webfinger_handle = self.fetch_webfinger(
-                    f"{self.username}@{actor_url_parts.hostname}"
-                )
-                if webfinger_handle:
-                    webfinger_username, webfinger_domain = webfinger_handle.split("@")
-                    self.username = webfinger_username
-                    self.domain = Domain.get_remote_domain(webfinger_domain)
-            except TryAgainLater:
-                # continue with original domain when webfinger times out
-                logger.info("WebFinger timed out: %s", self.actor_uri)
-                pass
-            except ValueError as exc:
-                logger.info(
-                    "Can't parse WebFinger: %s %s",
-                    exc.args[0],
-                    self.actor_uri,
-                    exc_info=exc,
-                )
-                return False
+        self.domain = Domain.get_remote_domain(urlparse(self.actor_uri).hostname)
+
+    def update_from_actor(self, document: dict, webfinger_handle: str | None) -> bool:
+        """
+        Saves the identity once apply_actor() has filled it in from the
+        actor document (using the handle webfinger gave us for them, if any).
+        """
+        from activities.models import Emoji
+
+        # Use the canonical domain from webfinger, if we got one
+        if webfinger_handle:
+            webfinger_username, webfinger_domain = webfinger_handle.split("@")
+            self.username = webfinger_username
+            self.domain = Domain.get_remote_domain(webfinger_domain)
         # Emojis (we need the domain so we do them here)
         for tag in get_list(document, "tag"):
             if tag["type"].lower() in ["toot:emoji", "emoji"]:
@@ -1289,7 +1476,8 @@ class Identity(StatorModel):
         self,
         method: Literal["get", "post"],
         uri: str,
-        body: dict | None = None,
+        body: dict | bytes | None = None,
+        digest: str | None = None,
     ):
         """
         Performs a signed request on behalf of the System Actor.
@@ -1300,6 +1488,27 @@ class Identity(StatorModel):
             body=body,
             private_key=self.private_key,
             key_id=self.public_key_id,
+            digest=digest,
+        )
+
+    async def asigned_request(
+        self,
+        method: Literal["get", "post"],
+        uri: str,
+        body: dict | bytes | None = None,
+        digest: str | None = None,
+    ):
+        """
+        Performs a signed request on behalf of this identity, without
+        blocking the event loop.
+        """
+        return await HttpSignature.asigned_request(
+            method=method,
+            uri=uri,
+            body=body,
+            private_key=self.private_key,
+            key_id=self.public_key_id,
+            digest=digest,
         )
 
     def generate_keypair(self):
@@ -18,7 +18,10 @@ logger = logging.getLogger(__name__)
 
 
 class InboxMessageStates(StateGraph):
-    received = State(try_interval=300, delete_after=86400 * 3)
+    # Incoming activities are what people are waiting on, so go ahead of
+    # background work. Each message needs different lookups and writes, so
+    # they're run one per task (in parallel) rather than batched.
+    received = State(try_interval=300, delete_after=86400 * 3, priority=4)
     processed = State(externally_progressed=True, delete_after=86400)
     errored = State(externally_progressed=True, delete_after=86400)
 
@@ -92,12 +95,15 @@ class InboxMessageStates(StateGraph):
                     # Prefer raw_document if stored; fall back to canonicalized
                     # instance.message for older deferred entries.
                     ld_doc = sig_data.get("raw_document") or instance.message
-                    LDSignature.verify_signature(ld_doc, identity.public_key)
+                    LDSignature.verify_signature(
+                        ld_doc, identity.public_key, key_id=identity.public_key_id
+                    )
                 else:
                     HttpSignature.verify_signature(
                         base64.b64decode(sig_data["signature"]),
                         sig_data["headers_string"],
                         identity.public_key,
+                        key_id=identity.public_key_id,
                     )
                 logger.debug(
                     "Inbox: Deferred %s verification succeeded for %s",
@@ -331,11 +337,21 @@ class InboxMessage(StatorModel):
     It's fine. It'll scale up to a decent point.
     """
 
+    PARTITION_FIELD = "created"
+
+    # This queue can back up into the millions; don't count all of it
+    QUEUE_COUNT = "capped"
+
+    # Big enough that it's worth splitting between runners with --shard
+    SHARDED = True
+
     message = models.JSONField()
     metadata = models.JSONField(null=True, blank=True, default=None)
 
     state = StateField(InboxMessageStates)
 
+    created = models.DateTimeField(auto_now_add=True)
+
     @classmethod
     def create_internal(cls, payload):
         """
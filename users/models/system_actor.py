@@ -95,3 +95,21 @@ class SystemActor:
             private_key=self.private_key,
             key_id=self.public_key_id,
         )
+
+    async def asigned_request(
+        self,
+        method: Literal["get", "post"],
+        uri: str,
+        body: dict | None = None,
+    ):
+        """
+        Performs a signed request on behalf of the System Actor, without
+        blocking the event loop.
+        """
+        return await HttpSignature.asigned_request(
+            method=method,
+            uri=uri,
+            body=body,
+            private_key=self.private_key,
+            key_id=self.public_key_id,
+        )
@@ -1,8 +1,6 @@
 import concurrent.futures
 import logging
 
-import httpx
-from django.conf import settings
 from django.core.exceptions import MultipleObjectsReturned
 from django.db import models, transaction
 from django.template.defaultfilters import linebreaks_filter
@@ -14,6 +12,7 @@ from activities.models import (
     PostInteraction,
     PostInteractionStates,
 )
+from core import http
 from core.files import resize_image
 from core.html import FediverseHtmlParser
 from stator.exceptions import TryAgainLater
@@ -425,27 +424,21 @@ class IdentityService:
             ),
         ]
         future_actions = {}
-        with httpx.Client(
-            timeout=settings.SETUP.REMOTE_TIMEOUT,
-            headers={"User-Agent": settings.TAKAHE_USER_AGENT},
-        ) as client:
-            # TODO: move this to a global pool, or use stator executor
-            with concurrent.futures.ThreadPoolExecutor(
-                max_workers=len(pipeline)
-            ) as pool:
-                # Do all the fetching in threads using a single client
-                for fn, url, action in pipeline:
-                    if url:
-                        future_actions[pool.submit(fn, client, url)] = (action, url)
-                # Re-submit the updates to happen in threads as well
-                for f in concurrent.futures.as_completed(future_actions):
-                    action, url = future_actions[f]
-                    try:
-                        pool.submit(action, f.result())
-                    except ValueError:
-                        logger.exception("Error fetching %s", url)
-                # Wait for everything to finish
-                pool.shutdown()
+        client = http.client()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(pipeline)) as pool:
+            # Do all the fetching in threads using the shared client
+            for fn, url, action in pipeline:
+                if url:
+                    future_actions[pool.submit(fn, client, url)] = (action, url)
+            # Re-submit the updates to happen in threads as well
+            for f in concurrent.futures.as_completed(future_actions):
+                action, url = future_actions[f]
+                try:
+                    pool.submit(action, f.result())
+                except ValueError:
+                    logger.exception("Error fetching %s", url)
+            # Wait for everything to finish
+            pool.shutdown()
         logger.info("SYNC %s: %s", actor.actor_uri, stats)
         actor.stats = stats
         actor.save(update_fields=["stats"])
@@ -340,7 +340,9 @@ class Inbox(FederatedView):
                     # Verify against raw_document (original structure as signed),
                     # not the canonicalized form which may differ in N-Quads output.
                     LDSignature.verify_signature(
-                        raw_document, creator_identity.public_key
+                        raw_document,
+                        creator_identity.public_key,
+                        key_id=creator_identity.public_key_id,
                     )
                     # For relay: only mark fully verified when relay HTTP was also
                     # confirmed immediately (not deferred).
@@ -1,7 +1,7 @@
 from django.utils.decorators import method_decorator
 from django.views.generic import TemplateView
 
-from stator.models import StatorModel, Stats
+from stator.models import StatorMetric, StatorModel
 from users.decorators import admin_required
 
 
@@ -12,7 +12,9 @@ class Stator(TemplateView):
     def get_context_data(self):
         return {
             "model_stats": {
-                model._meta.verbose_name_plural.title(): Stats.get_for_model(model)
+                model._meta.verbose_name_plural.title(): StatorMetric.summary_for_model(
+                    model
+                )
                 for model in StatorModel.subclasses
             },
             "section": "stator",